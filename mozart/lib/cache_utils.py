@@ -0,0 +1,200 @@
+from future import standard_library
+
+standard_library.install_aliases()
+
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+# every cache created in this process, by name (reported by /cache_stats)
+CACHES = {}
+
+
+class LocalStore:
+    """In-process LRU store, shared by all requests handled by one worker."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, now):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires <= now:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires):
+        evicted = 0
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                evicted += 1
+        return evicted
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SqliteStore:
+    """
+    LRU store kept in a SQLite database so every gunicorn worker on the host shares it;
+    point it at a tmpfs path (e.g. /dev/shm/mozart_cache.db) to keep it memory backed.
+    Values must be JSON serializable.
+    """
+
+    def __init__(self, path, table, maxsize):
+        self.path = path
+        self.table = table
+        self.maxsize = maxsize
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS %s (key TEXT PRIMARY KEY, value TEXT, "
+                "expires REAL, accessed REAL)" % table
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS %s_accessed ON %s (accessed)"
+                % (table, table)
+            )
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key, now):
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT value, expires FROM %s WHERE key = ?" % self.table, (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        if row[1] <= now:
+            conn.execute("DELETE FROM %s WHERE key = ?" % self.table, (key,))
+            return None
+        conn.execute(
+            "UPDATE %s SET accessed = ? WHERE key = ?" % self.table, (now, key)
+        )
+        return json.loads(row[0])
+
+    def set(self, key, value, expires):
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO %s (key, value, expires, accessed) "
+            "VALUES (?, ?, ?, ?)" % self.table,
+            (key, json.dumps(value), expires, time.time()),
+        )
+        overflow = len(self) - self.maxsize
+        if overflow <= 0:
+            return 0
+        conn.execute(
+            "DELETE FROM %s WHERE key IN (SELECT key FROM %s ORDER BY accessed LIMIT ?)"
+            % (self.table, self.table),
+            (overflow,),
+        )
+        return overflow
+
+    def delete(self, key):
+        self._conn().execute("DELETE FROM %s WHERE key = ?" % self.table, (key,))
+
+    def clear(self):
+        self._conn().execute("DELETE FROM %s" % self.table)
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM %s" % self.table).fetchone()[0]
+
+
+class TTLCache:
+    """
+    Size and TTL bounded LRU cache with hit/miss counters
+    @param name - cache name, used for stats reporting and as the shared table name
+    @param maxsize - max number of entries before the least recently used is evicted
+    @param ttl - seconds an entry stays valid
+    @param shared_path - optional SQLite path to share entries across worker processes
+    """
+
+    def __init__(self, name, maxsize=1024, ttl=300, shared_path=None):
+        self.name = name
+        self.ttl = ttl
+        if shared_path:
+            self._store = SqliteStore(shared_path, name.replace("-", "_"), maxsize)
+        else:
+            self._store = LocalStore(maxsize)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._loading = {}
+        self._loading_lock = threading.Lock()
+        CACHES[name] = self
+
+    def get(self, key, default=None):
+        value = self._store.get(key, time.time())
+        if value is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        self.evictions += self._store.set(key, value, expires)
+
+    def get_or_load(self, key, loader, ttl=None):
+        """
+        Return the cached value for key, calling loader() to fill it on a miss; concurrent
+        misses on the same key wait for the one in-flight load instead of repeating it
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        with self._loading_lock:
+            lock = self._loading.setdefault(key, threading.Lock())
+        with lock:
+            value = self._store.get(key, time.time())  # filled while we waited?
+            if value is None:
+                value = loader()
+                if value is not None:  # misses are not cached
+                    self.set(key, value, ttl=ttl)
+        with self._loading_lock:
+            self._loading.pop(key, None)
+        return value
+
+    def pop(self, key):
+        self._store.delete(key)
+
+    def clear(self):
+        self._store.clear()
+
+    def stats(self):
+        return {
+            "size": len(self._store),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "shared": isinstance(self._store, SqliteStore),
+        }
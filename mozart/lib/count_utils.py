@@ -0,0 +1,139 @@
+from future import standard_library
+
+standard_library.install_aliases()
+
+from mozart import app, mozart_es
+from mozart.lib.cache_utils import TTLCache
+
+
+# breakdown dimensions -> job_status field
+COUNT_DIMENSIONS = {
+    "status": "status",
+    "queue": "job.job_info.job_queue",
+    "type": "job.type",
+    "user": "job.username",
+}
+
+JOB_STATUS_INDICES = "job_status-*"
+MAX_TERMS = 1000
+
+count_cache = TTLCache(
+    "job-counts", maxsize=256, ttl=app.config.get("JOB_COUNT_CACHE_TTL", 10)
+)
+index_cache = TTLCache("job-status-indices", maxsize=1, ttl=300)
+
+
+def get_job_status_indices():
+    """Return [(index, creation time in epoch millis)] of all job_status-* indices"""
+
+    def load():
+        rows = mozart_es.es.cat.indices(
+            index=JOB_STATUS_INDICES, h="index,creation.date", format="json"
+        )
+        indices = [(row["index"], int(row["creation.date"])) for row in rows]
+        return sorted(indices, key=lambda i: i[1])
+
+    return index_cache.get_or_load("indices", load)
+
+
+def select_indices(start_time=None, end_time=None):
+    """
+    Narrow job_status-* to the indices that can hold documents in a time range; an
+    index holds documents from its creation until the next index is created (rollover)
+    @param start_time - epoch millis, or None for unbounded
+    @param end_time - epoch millis, or None for unbounded
+    @return: comma separated index names for the search request
+    """
+    if start_time is None and end_time is None:
+        return JOB_STATUS_INDICES
+
+    indices = get_job_status_indices()
+    selected = []
+    for i, (index, created) in enumerate(indices):
+        next_created = indices[i + 1][1] if i + 1 < len(indices) else None
+        if end_time is not None and created > end_time:
+            continue
+        if start_time is not None and next_created is not None:
+            if next_created < start_time:
+                continue
+        selected.append(index)
+    return ",".join(selected) or JOB_STATUS_INDICES
+
+
+def compute_job_counts(dims, start_time=None, end_time=None):
+    """
+    Count jobs along the given dimensions with a single multi-aggregation request
+    @param dims - tuple of keys of COUNT_DIMENSIONS
+    @param start_time - epoch millis lower bound on @timestamp (optional)
+    @param end_time - epoch millis upper bound on @timestamp (optional)
+    @return: dict of total, per-dimension counts and, for 2+ dimensions, the
+             count of every combination
+    """
+    aggs = {
+        dim: {"terms": {"field": COUNT_DIMENSIONS[dim], "size": MAX_TERMS}}
+        for dim in dims
+    }
+    if len(dims) > 1:
+        aggs["combinations"] = {
+            "composite": {
+                "size": MAX_TERMS,
+                "sources": [
+                    {dim: {"terms": {"field": COUNT_DIMENSIONS[dim]}}} for dim in dims
+                ],
+            }
+        }
+
+    body = {"size": 0, "track_total_hits": True, "aggs": aggs}
+    if start_time is not None or end_time is not None:
+        time_range = {"format": "epoch_millis"}
+        if start_time is not None:
+            time_range["gte"] = start_time
+        if end_time is not None:
+            time_range["lte"] = end_time
+        body["query"] = {"range": {"@timestamp": time_range}}
+
+    index = select_indices(start_time, end_time)
+    results = mozart_es.search(index=index, body=body)
+    aggregations = results["aggregations"]
+
+    counts = {
+        dim: {b["key"]: b["doc_count"] for b in aggregations[dim]["buckets"]}
+        for dim in dims
+    }
+    response = {"total": results["hits"]["total"]["value"], "counts": counts}
+
+    if len(dims) > 1:
+        combinations = []
+        composite = aggregations["combinations"]
+        while True:
+            for bucket in composite["buckets"]:
+                combinations.append({**bucket["key"], "count": bucket["doc_count"]})
+            if len(composite["buckets"]) < MAX_TERMS or "after_key" not in composite:
+                break
+            page = {"size": 0, "aggs": {"combinations": aggs["combinations"]}}
+            page["aggs"]["combinations"]["composite"]["after"] = composite["after_key"]
+            if "query" in body:
+                page["query"] = body["query"]
+            composite = mozart_es.search(index=index, body=page)["aggregations"][
+                "combinations"
+            ]
+        response["combinations"] = combinations
+    return response
+
+
+def get_job_counts(dims=("status",), start_time=None, end_time=None):
+    """
+    Cached compute_job_counts; a burst of identical requests triggers one aggregation
+    """
+    dims = tuple(sorted(set(dims)))
+    for dim in dims:
+        if dim not in COUNT_DIMENSIONS:
+            raise ValueError(
+                "unknown dimension %s, expected one of %s"
+                % (dim, ", ".join(COUNT_DIMENSIONS))
+            )
+
+    key = "%s:%s:%s" % (",".join(dims), start_time, end_time)
+    return count_cache.get_or_load(
+        key, lambda: compute_job_counts(dims, start_time, end_time)
+    )
@@ -0,0 +1,122 @@
+from future import standard_library
+
+standard_library.install_aliases()
+
+import re
+import html
+import time
+import codecs
+import requests
+from requests.adapters import HTTPAdapter
+
+from mozart import app
+
+
+DAV_POOL_SIZE = app.config.get("DAV_POOL_SIZE", 16)
+CHUNK_SIZE = 64 * 1024
+FOLLOW_INTERVAL = app.config.get("GET_TEXT_FOLLOW_INTERVAL", 2)
+FOLLOW_IDLE_TIMEOUT = app.config.get("GET_TEXT_FOLLOW_IDLE_TIMEOUT", 300)
+
+CONTENT_RANGE_RE = re.compile(r"^bytes (\d+)-(\d+)/(\d+|\*)$")
+
+# pooled keep-alive connections to the workers' WebDAV servers
+dav_session = requests.Session()
+dav_session.mount(
+    "http://", HTTPAdapter(pool_connections=32, pool_maxsize=DAV_POOL_SIZE)
+)
+dav_session.mount(
+    "https://", HTTPAdapter(pool_connections=32, pool_maxsize=DAV_POOL_SIZE)
+)
+
+
+def get_range(url, start=0, end=None, **kwargs):
+    """
+    Streaming GET of bytes start..end (inclusive) of a file
+    @return: requests response; status 206 if the server honored the range
+    """
+    headers = {}
+    if start or end is not None:
+        headers["Range"] = "bytes=%d-%s" % (start, "" if end is None else end)
+    return dav_session.get(url, headers=headers, stream=True, verify=False, **kwargs)
+
+
+def get_size(url):
+    """Return the size of a remote file in bytes"""
+    r = dav_session.head(url, verify=False, timeout=10)
+    r.raise_for_status()
+    return int(r.headers["Content-Length"])
+
+
+def find_tail_offset(url, lines):
+    """Return the byte offset where the last N lines of a remote file start"""
+    size = get_size(url)
+    end = size
+    newlines = 0
+    while end > 0:
+        start = max(end - CHUNK_SIZE, 0)
+        r = get_range(url, start, end - 1, timeout=10)
+        r.raise_for_status()
+        if r.status_code != 206:  # ranges not supported, scan the whole file once
+            start, end = 0, size
+        block = r.content[start:end] if r.status_code != 206 else r.content
+        # a trailing newline terminates the last line, it doesn't start a new one
+        if end == size and block.endswith(b"\n"):
+            newlines -= 1
+        for i in range(len(block) - 1, -1, -1):
+            if block[i] == 0x0A:
+                newlines += 1
+                if newlines == lines:
+                    return start + i + 1
+        end = start
+    return 0
+
+
+def iter_bytes(url, offset=0, length=None):
+    """
+    Yield the bytes of a remote file from offset (up to length bytes) using a Range
+    request, falling back to skipping bytes if the server ignores ranges
+    """
+    end = None if length is None else offset + length - 1
+    r = get_range(url, offset, end, timeout=10)
+    if r.status_code == 416:  # nothing at or after offset
+        return
+    r.raise_for_status()
+
+    skip = offset if r.status_code == 200 else 0
+    remaining = length
+    for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+        if skip:
+            chunk, skip = chunk[skip:], max(skip - len(chunk), 0)
+        if remaining is not None:
+            chunk = chunk[:remaining]
+            remaining -= len(chunk)
+        if chunk:
+            yield chunk
+        if remaining == 0:
+            break
+
+
+def follow_bytes(url, offset=0):
+    """
+    Yield the bytes of a remote file from offset, then keep polling for bytes appended
+    by a running job until nothing was appended for FOLLOW_IDLE_TIMEOUT seconds
+    """
+    idle_since = time.time()
+    while time.time() - idle_since < FOLLOW_IDLE_TIMEOUT:
+        for chunk in iter_bytes(url, offset):
+            offset += len(chunk)
+            idle_since = time.time()
+            yield chunk
+        time.sleep(FOLLOW_INTERVAL)
+
+
+def escape_chunks(chunks):
+    """HTML escape a stream of utf-8 bytes without splitting multi-byte characters"""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield html.escape(text, quote=False)
+    text = decoder.decode(b"", final=True)
+    if text:
+        yield html.escape(text, quote=False)
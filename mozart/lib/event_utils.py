@@ -0,0 +1,137 @@
+from future import standard_library
+
+standard_library.install_aliases()
+
+import json
+import socket
+from uuid import uuid4
+from collections import Counter
+from datetime import datetime, timezone
+
+from mozart import app, mozart_es
+
+
+EVENT_STATUS_INDEX = app.config.get("EVENT_STATUS_INDEX", "event_status-current")
+
+# at most this many rejected events are logged individually per batch
+EVENT_LOG_SAMPLE = 5
+
+
+def parse_events(data):
+    """
+    Parse a batch of events given as a JSON array or NDJSON (one event per line)
+    @param data - request body (str)
+    @return: list of (line or array position, event or None, error or None)
+    """
+    if data.lstrip().startswith("["):
+        try:
+            events = json.loads(data)
+        except ValueError as e:
+            raise ValueError("malformed JSON array: %s" % str(e))
+        return [(i, event, None) for i, event in enumerate(events, 1)]
+
+    records = []
+    for i, line in enumerate(data.splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            records.append((i, json.loads(line), None))
+        except ValueError as e:
+            records.append((i, None, "malformed JSON: %s" % str(e)))
+    return records
+
+
+def _json_field(event, name, types, default):
+    """value of an event field that may also be given as a JSON string"""
+    value = event.get(name, default)
+    if isinstance(value, str) and types is not str:
+        try:
+            value = json.loads(value)
+        except ValueError:
+            raise ValueError("%s is malformed JSON" % name)
+    if value is not None and not isinstance(value, types):
+        raise ValueError("%s must be a %s" % (name, types.__name__))
+    return value
+
+
+def custom_event_doc(event, hostname=None):
+    """
+    Validate an event ({type, status, event, tags, hostname}) and return its event
+    status document, the same as hysds.log_utils.log_custom_event writes
+    @raise ValueError: if the event is invalid
+    """
+    if not isinstance(event, dict):
+        raise ValueError("event must be a JSON object")
+    for field in ("type", "status"):
+        if not isinstance(event.get(field), str) or not event[field]:
+            raise ValueError("missing field: %s" % field)
+    tags = _json_field(event, "tags", list, None)
+    if tags is not None and not all(isinstance(tag, str) for tag in tags):
+        raise ValueError("tags must be a list of strings")
+
+    return {
+        "resource": "event",
+        "type": event["type"],
+        "status": event["status"],
+        "@timestamp": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+        "hostname": _json_field(event, "hostname", str, None) or hostname,
+        "uuid": str(uuid4()),
+        "tags": tags or [],
+        "event": _json_field(event, "event", dict, {}),
+    }
+
+
+def log_custom_events(records):
+    """
+    Write a batch of custom events to the event status index with one bulk request
+    @param records - list of (line, event, parse error) as returned by parse_events
+    @return: list of per-line results ({line, success, result or message})
+    """
+    hostname = socket.getfqdn()
+    results, actions, pending = [], [], []
+    for line, event, error in records:
+        if error is None:
+            try:
+                doc = custom_event_doc(event, hostname)
+            except ValueError as e:
+                error = str(e)
+        if error is not None:
+            results.append({"line": line, "success": False, "message": error})
+            continue
+        actions.append({"index": {"_index": EVENT_STATUS_INDEX, "_id": doc["uuid"]}})
+        actions.append(doc)
+        pending.append((len(results), doc))
+        results.append({"line": line, "success": True, "result": doc["uuid"]})
+
+    counts = Counter()
+    if actions:
+        response = mozart_es.es.bulk(body=actions)
+        for (i, doc), item in zip(pending, response["items"]):
+            item = item["index"]
+            if item.get("error") is not None:
+                results[i] = {
+                    "line": results[i]["line"],
+                    "success": False,
+                    "message": str(item["error"]),
+                }
+            else:
+                counts["%s/%s" % (doc["type"], doc["status"])] += 1
+
+    failed = [r for r in results if not r["success"]]
+    app.logger.info(
+        "logged %d of %d custom events: %s"
+        % (
+            len(results) - len(failed),
+            len(results),
+            ", ".join("%s x%d" % (key, n) for key, n in counts.most_common()),
+        )
+    )
+    for result in failed[:EVENT_LOG_SAMPLE]:
+        app.logger.warning(
+            "custom event at line %d rejected: %s" % (result["line"], result["message"])
+        )
+    if len(failed) > EVENT_LOG_SAMPLE:
+        app.logger.warning(
+            "%d more custom events rejected" % (len(failed) - EVENT_LOG_SAMPLE)
+        )
+    return results
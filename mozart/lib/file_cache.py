@@ -0,0 +1,123 @@
+from future import standard_library
+
+standard_library.install_aliases()
+
+import os
+import gzip
+import hashlib
+import tempfile
+import threading
+
+from mozart import app, dbdir
+from mozart.lib.cache_utils import CACHES
+
+
+class JobFileCache:
+    """
+    gzip compressed on-disk cache of job work dir files (e.g. _stdout.txt, _job.json)
+    keyed by job id and URL; the least recently read files are evicted once the cache
+    grows past max_bytes. It is shared by all workers using the same directory.
+    @param path - cache directory
+    @param max_bytes - max total (compressed) size of the cache
+    @param max_file_bytes - files bigger than this (uncompressed) are not cached
+    """
+
+    def __init__(self, path, max_bytes, max_file_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._size = None  # estimate, recomputed when eviction scans the directory
+        self._lock = threading.Lock()
+        CACHES["job-files"] = self
+
+    def _file(self, job_id, url):
+        key = hashlib.sha256(("%s\n%s" % (job_id, url)).encode("utf-8")).hexdigest()
+        return os.path.join(self.path, key[:2], key + ".gz")
+
+    def get(self, job_id, url):
+        """Return the cached file content (bytes), or None"""
+        cache_file = self._file(job_id, url)
+        try:
+            with gzip.open(cache_file, "rb") as f:
+                content = f.read()
+            os.utime(cache_file)  # mark as recently used
+        except (OSError, EOFError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return content
+
+    def put(self, job_id, url, content):
+        """Cache the content (bytes) of a job file"""
+        if len(content) > self.max_file_bytes:
+            return
+        cache_file = self._file(job_id, url)
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(cache_file))
+        try:
+            with os.fdopen(fd, "wb") as f, gzip.GzipFile(fileobj=f, mode="wb") as gz:
+                gz.write(content)
+            os.replace(tmp_file, cache_file)
+        except OSError as e:
+            app.logger.warning("failed to cache %s: %s" % (url, str(e)))
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            return
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan()[1]
+            else:
+                self._size += os.path.getsize(cache_file)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _scan(self):
+        files = []
+        total = 0
+        for root, _, names in os.walk(self.path):
+            for name in names:
+                if not name.endswith(".gz"):
+                    continue
+                try:
+                    st = os.stat(os.path.join(root, name))
+                except OSError:  # evicted by another worker
+                    continue
+                files.append((st.st_mtime, st.st_size, os.path.join(root, name)))
+                total += st.st_size
+        return files, total
+
+    def _evict(self):
+        """remove least recently used files until the cache is 90% of max_bytes"""
+        files, total = self._scan()
+        files.sort()
+        target = self.max_bytes * 0.9
+        for _, size, path in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                self.evictions += 1
+            except OSError:
+                pass
+            total -= size
+        self._size = total
+
+    def stats(self):
+        return {
+            "size_bytes": self._size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "shared": True,
+        }
+
+
+job_file_cache = JobFileCache(
+    app.config.get("JOB_FILE_CACHE_DIR", os.path.join(dbdir, "job_files")),
+    max_bytes=app.config.get("JOB_FILE_CACHE_MAX_BYTES", 1024**3),
+    max_file_bytes=app.config.get("JOB_FILE_CACHE_MAX_FILE_BYTES", 256 * 1024**2),
+)
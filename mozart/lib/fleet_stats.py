@@ -0,0 +1,322 @@
+from future import standard_library
+
+standard_library.install_aliases()
+
+import os
+import json
+import time
+import fcntl
+import warnings
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from mozart import app
+from mozart.lib.job_utils import get_execute_nodes
+from mozart.lib import ssh_utils
+from mozart.lib.ssh_utils import get_node_user, node_stats_command, parse_sections
+
+
+FLEET_STATS_INTERVAL = app.config.get("FLEET_STATS_INTERVAL", 60)
+FLEET_STATS_WORKERS = app.config.get("FLEET_STATS_WORKERS", 32)
+FLEET_STATS_SAMPLES = app.config.get("FLEET_STATS_SAMPLES", 60)
+# state shared by the collector with all workers on the host (the collector holds
+# <path>.lock, so only one worker samples the nodes)
+FLEET_STATS_PATH = app.config.get(
+    "FLEET_STATS_PATH",
+    os.path.join(
+        "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(),
+        "mozart_fleet_stats.json",
+    ),
+)
+
+# metrics of a sample (columns of the ring buffers), all in percent
+METRICS = ("cpu_user", "cpu_sys", "memory", "swap")
+
+SAMPLE_COMMANDS = {"cpu": "mpstat 1 1", "memory": "free"}
+
+
+def parse_sample(sections):
+    """Return the METRICS values of a node from its mpstat and free output"""
+    cpu_user = cpu_sys = memory = swap = np.nan
+    for line in sections["cpu"].splitlines():
+        fields = line.split()
+        # Average:  CPU  %usr  %nice  %sys ...
+        if len(fields) > 4 and fields[0] == "Average:" and fields[1] == "all":
+            cpu_user, cpu_sys = float(fields[2]), float(fields[4])
+    for line in sections["memory"].splitlines():
+        fields = line.split()
+        if len(fields) > 2 and fields[0] in ("Mem:", "Swap:"):
+            total, used = float(fields[1]), float(fields[2])
+            used_perc = used / total * 100.0 if total else 0.0
+            if fields[0] == "Mem:":
+                memory = used_perc
+            else:
+                swap = used_perc
+    return cpu_user, cpu_sys, memory, swap
+
+
+def to_list(array):
+    """JSON friendly list of an array (NaN -> None)"""
+    return [None if np.isnan(v) else float(v) for v in array]
+
+
+class RingBuffer:
+    """Fixed number of the most recent (time, METRICS) samples of a node"""
+
+    def __init__(self, size):
+        self.times = np.full(size, np.nan, dtype=np.float64)
+        self.values = np.full((size, len(METRICS)), np.nan, dtype=np.float32)
+        self.count = 0
+
+    def append(self, timestamp, values):
+        i = self.count % len(self.times)
+        self.times[i] = timestamp
+        self.values[i] = values
+        self.count += 1
+
+    def latest(self):
+        """(time, values) of the last sample, or None"""
+        if self.count == 0:
+            return None
+        i = (self.count - 1) % len(self.times)
+        return self.times[i], self.values[i]
+
+    def history(self):
+        """(times, values) of the samples in chronological order"""
+        size = len(self.times)
+        if self.count < size:
+            return self.times[: self.count], self.values[: self.count]
+        i = self.count % size
+        order = np.r_[i:size, 0:i]
+        return self.times[order], self.values[order]
+
+    def to_dict(self):
+        times, values = self.history()
+        return {"times": times.tolist(), "values": values.tolist()}
+
+    @classmethod
+    def from_dict(cls, size, data):
+        buf = cls(size)
+        for timestamp, values in zip(data["times"], data["values"]):
+            buf.append(timestamp, values)
+        return buf
+
+
+class FleetStatsCollector:
+    """
+    Samples CPU and memory utilization of every execute node concurrently in a
+    background thread, started by the first request, and keeps the last samples of
+    each node in a ring buffer so the fleet overview needs no SSH calls. Only the
+    worker holding the lock on <path>.lock samples; it writes its buffers to path
+    after every run and the other workers read them from there (a worker takes over
+    when the collecting one exits).
+    @param interval - seconds between samples
+    @param workers - max nodes sampled concurrently
+    @param samples - samples kept per node
+    @param path - file shared with the other workers, None to collect in every one
+    """
+
+    def __init__(self, interval=60, workers=32, samples=60, path=None):
+        self.interval = interval
+        self.workers = workers
+        self.samples = samples
+        self.path = path
+        self.buffers = {}  # node -> RingBuffer
+        self.errors = {}  # node -> (time, message) of the last failed sample
+        self.last_run = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._lock_file = None
+        self._loaded_mtime = None
+
+    @property
+    def collecting(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _acquire_collector_lock(self):
+        """True if this worker is (now) the one collecting for the host"""
+        if self.path is None or self._lock_file is not None:
+            return True
+        lock_file = open(self.path + ".lock", "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:  # held by another worker
+            lock_file.close()
+            return False
+        self._lock_file = lock_file  # released by the OS when this process exits
+        return True
+
+    def start(self):
+        self.load()  # a worker taking over continues from the shared samples
+        with self._lock:
+            if not self.collecting and self._acquire_collector_lock():
+                self._thread = threading.Thread(
+                    target=self._run, name="fleet-stats-collector", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while True:
+                started = time.time()
+                try:
+                    self.collect(executor)
+                except Exception as e:
+                    app.logger.error("fleet stats collection failed: %s" % str(e))
+                time.sleep(max(self.interval - (time.time() - started), 1))
+
+    def sample(self, node):
+        output = ssh_utils.ssh_runner.run(
+            get_node_user(node), node, node_stats_command(SAMPLE_COMMANDS)
+        )
+        return parse_sample(parse_sections(output))
+
+    def collect(self, executor):
+        """sample all execute nodes once"""
+        nodes = get_execute_nodes()
+
+        def sample(node):
+            try:
+                return node, time.time(), self.sample(node), None
+            except (Exception, SystemExit) as e:
+                return node, time.time(), None, str(e)
+
+        for node, timestamp, values, error in executor.map(sample, nodes):
+            with self._lock:
+                if error is not None:
+                    self.errors[node] = (timestamp, error)
+                    continue
+                self.errors.pop(node, None)
+                if node not in self.buffers:
+                    self.buffers[node] = RingBuffer(self.samples)
+                self.buffers[node].append(timestamp, values)
+
+        with self._lock:  # forget nodes no longer reported by get_execute_nodes
+            for node in set(self.buffers) - set(nodes):
+                del self.buffers[node]
+            for node in set(self.errors) - set(nodes):
+                del self.errors[node]
+            self.last_run = time.time()
+        self.save()
+
+    def save(self):
+        """write the buffers to path for the other workers (atomic replace)"""
+        if self.path is None:
+            return
+        with self._lock:
+            state = {
+                "last_run": self.last_run,
+                "errors": self.errors,
+                "buffers": {node: buf.to_dict() for node, buf in self.buffers.items()},
+            }
+        tmp = "%s.%d.tmp" % (self.path, os.getpid())
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, self.path)
+
+    def load(self):
+        """read the buffers written by the collecting worker, if they changed"""
+        if self.path is None or self.collecting:
+            return
+        try:
+            mtime = os.stat(self.path).st_mtime
+            if mtime == self._loaded_mtime:
+                return
+            with open(self.path) as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            app.logger.debug("no fleet stats to load: %s" % str(e))
+            return
+        buffers = {
+            node: RingBuffer.from_dict(self.samples, data)
+            for node, data in state["buffers"].items()
+        }
+        with self._lock:
+            self.buffers = buffers
+            self.errors = {n: tuple(error) for n, error in state["errors"].items()}
+            self.last_run = state["last_run"]
+            self._loaded_mtime = mtime
+
+    def snapshot(self, max_age=None):
+        """
+        Return the latest sample of every node and the p50/p95/max of each metric over
+        the nodes sampled within max_age seconds (default: 3 intervals)
+        """
+        if max_age is None:
+            max_age = 3 * self.interval
+
+        self.load()
+        with self._lock:
+            latest = {node: buf.latest() for node, buf in self.buffers.items()}
+            errors = dict(self.errors)
+            last_run = self.last_run
+
+        nodes = sorted(latest)
+        now = time.time()
+        if nodes:
+            times = np.array([latest[n][0] for n in nodes], dtype=np.float64)
+            values = np.vstack([latest[n][1] for n in nodes])
+        else:
+            times = np.empty(0, dtype=np.float64)
+            values = np.empty((0, len(METRICS)), dtype=np.float32)
+        fresh = values[now - times <= max_age]
+
+        # p50/p95/max of every metric over the fleet at once (all-NaN columns warn)
+        if len(fresh):
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)
+                p50, p95 = np.nanpercentile(fresh, [50, 95], axis=0)
+                p100 = np.nanmax(fresh, axis=0)
+        else:
+            p50 = p95 = p100 = np.full(len(METRICS), np.nan)
+        summary = {
+            metric: {"p50": p50_v, "p95": p95_v, "max": max_v}
+            for metric, p50_v, p95_v, max_v in zip(
+                METRICS, to_list(p50), to_list(p95), to_list(p100)
+            )
+        }
+
+        return {
+            "last_run": last_run,
+            "total": len(nodes),
+            "fresh": int(len(fresh)),
+            "summary": summary,
+            "nodes": [
+                {
+                    "node": node,
+                    "time": float(times[i]),
+                    **dict(zip(METRICS, to_list(values[i]))),
+                }
+                for i, node in enumerate(nodes)
+            ],
+            "errors": [
+                {"node": node, "time": t, "message": message}
+                for node, (t, message) in sorted(errors.items())
+            ],
+        }
+
+    def history(self, node):
+        """Return the buffered samples of a node, or None if it has none"""
+        self.load()
+        with self._lock:
+            buf = self.buffers.get(node)
+            if buf is None:
+                return None
+            times, values = buf.history()
+            times, values = times.copy(), values.copy()
+        return {
+            "node": node,
+            "time": times.tolist(),
+            **{m: to_list(values[:, i]) for i, m in enumerate(METRICS)},
+        }
+
+
+fleet_stats_collector = FleetStatsCollector(
+    interval=FLEET_STATS_INTERVAL,
+    workers=FLEET_STATS_WORKERS,
+    samples=FLEET_STATS_SAMPLES,
+    path=FLEET_STATS_PATH,
+)
@@ -1,7 +1,84 @@
 from future import standard_library
 standard_library.install_aliases()
 
+import os
+import copy
+import json
+
 from mozart import app, mozart_es
+from mozart.lib.cache_utils import TTLCache
+from mozart.lib.pagination import iter_search_after
+
+
+# jobs in these states no longer change (apart from user tags), so they are safe to cache
+TERMINAL_STATES = ("job-completed", "job-failed", "job-revoked")
+
+# shared by all workers on the host by default, so invalidate_job() reaches every worker
+JOB_CACHE_SHARED_PATH = app.config.get(
+    'JOB_CACHE_SHARED_PATH',
+    '/dev/shm/mozart_cache.db' if os.path.isdir('/dev/shm') else None,
+)
+
+# a per-worker cache is only invalidated in the worker that edited a job, keep it short
+job_cache = TTLCache(
+    "job-status",
+    maxsize=app.config.get("JOB_CACHE_SIZE", 10000),
+    ttl=app.config.get("JOB_CACHE_TTL", 3600 if JOB_CACHE_SHARED_PATH else 10),
+    shared_path=JOB_CACHE_SHARED_PATH,
+)
+
+EXECUTE_NODES_PAGE_SIZE = 1000
+EXECUTE_NODES_WINDOW = app.config.get("EXECUTE_NODES_WINDOW", None)
+
+execute_nodes_cache = TTLCache(
+    "execute-nodes", maxsize=16, ttl=app.config.get("EXECUTE_NODES_CACHE_TTL", 300)
+)
+
+
+def find_job_status(_id):
+    """
+    Return the status of a job, or None if it does not exist; terminal states are cached
+    @param _id - id of the job
+    """
+    status = job_cache.get('status:%s' % _id)
+    if status is not None:
+        return status
+
+    es_index = app.config['JOB_STATUS_INDEX']
+    result = mozart_es.search_by_id(index=es_index, id=_id, _source_includes=['status'], ignore=404)
+    if result['found'] is False:
+        return None
+
+    status = result['_source']['status']
+    if status in TERMINAL_STATES:
+        job_cache.set('status:%s' % _id, status)
+    return status
+
+
+def find_job_info(_id):
+    """
+    Return the full job document, or None if it does not exist; terminal states are cached
+    @param _id - id of the job
+    """
+    info = job_cache.get('info:%s' % _id)
+    if info is not None:
+        return copy.deepcopy(info)  # callers may modify it, the cached one must not change
+
+    es_index = app.config['JOB_STATUS_INDEX']
+    result = mozart_es.search_by_id(index=es_index, id=_id, ignore=404)
+    if result['found'] is False:
+        return None
+
+    info = result['_source']
+    if info.get('status') in TERMINAL_STATES:
+        job_cache.set('info:%s' % _id, copy.deepcopy(info))
+    return info
+
+
+def invalidate_job(_id):
+    """Drop any cached status/info of a job, e.g. after its document is edited"""
+    job_cache.pop('status:%s' % _id)
+    job_cache.pop('info:%s' % _id)
 
 
 def get_job_status(_id):
@@ -12,24 +89,36 @@ def get_job_status(_id):
     if _id is None:
         raise Exception("'id' must be supplied by request")
 
-    es_index = "job_status-current"
-    status = mozart_es.search_by_id(index=es_index, id=_id, _source_includes=['status'], ignore=404)
-    if status['found'] is False:
+    status = find_job_status(_id)
+    if status is None:
         raise Exception("job _id not found")
 
-    return status['_source']['status']
+    return status
 
 
 def get_job_list():
-    """Get a listing of jobs"""
+    """Get a listing of jobs, as a generator of job IDs fetched a page at a time"""
     query = {
-        "query": {
-            "match_all": {}
-        }
+        "_source": False,
+        "sort": [{"_id": {"order": "asc"}}]
     }
     es_index = "job_status-current"
-    results = mozart_es.query(es_index=es_index, body=query, _source=False)
-    return sorted([result["_id"] for result in results])
+    for result in iter_search_after(es_index, query):
+        yield result["_id"]
+
+
+def stream_job_list(jobs, chunk_size=1000):
+    """generator of the JSON job list response, chunk_size job IDs at a time"""
+    yield '{"success": true, "message": "", "result": ['
+    chunk, first = [], True
+    for job in jobs:
+        chunk.append(json.dumps(job["_id"]))
+        if len(chunk) == chunk_size:
+            yield ("" if first else ", ") + ", ".join(chunk)
+            chunk, first = [], False
+    if chunk:
+        yield ("" if first else ", ") + ", ".join(chunk)
+    yield '], "next": null}'
 
 
 def get_job_info(_id):
@@ -40,34 +129,75 @@ def get_job_info(_id):
     if _id is None:
         raise Exception("'id' must be supplied by request")
 
-    es_index = "job_status-current"
-    result = mozart_es.search_by_id(index=es_index, id=_id, ignore=404)
-    if result['found'] is False:
+    info = find_job_info(_id)
+    if info is None:
         raise Exception('job _id not found: %s' % _id)
 
-    return result['_source']
-
+    return info
 
-def get_execute_nodes():
-    """Return the names of all execute nodes."""
 
-    # TODO: facets have been deprecated: https://www.elastic.co/guide/en/elasticsearch/reference/6.8/search-facets.html
-    query = {
+def compute_execute_nodes(since=None):
+    """
+    Page through every distinct execute node with a composite aggregation
+    @param since - only consider jobs with @timestamp >= since (ES date math, e.g. now-7d)
+    """
+    body = {
         "size": 0,
-        "facets": {
-            "job.job_info.execute_node": {
-                "terms": {
-                    "field": "job.job_info.execute_node",
-                    "all_terms": True
+        "aggs": {
+            "nodes": {
+                "composite": {
+                    "size": EXECUTE_NODES_PAGE_SIZE,
+                    "sources": [{"node": {"terms": {"field": "job.job_info.execute_node"}}}]
                 }
             }
         }
     }
-    index = app.config['JOB_STATUS_INDEX']
-    result = mozart_es.search(index, body=query)
+    if since:
+        body['query'] = {"range": {"@timestamp": {"gte": since}}}
 
+    index = app.config['JOB_STATUS_INDEX']
     nodes = []
-    for terms in result['facets']['job.job_info.execute_node']['terms']:
-        nodes.append(terms['term'])
+    while True:
+        result = mozart_es.search(index=index, body=body)
+        composite = result['aggregations']['nodes']
+        nodes.extend(bucket['key']['node'] for bucket in composite['buckets'])
+        if not composite['buckets'] or 'after_key' not in composite:
+            break
+        body['aggs']['nodes']['composite']['after'] = composite['after_key']
     nodes.sort()
     return nodes
+
+
+def get_execute_nodes(since=EXECUTE_NODES_WINDOW):
+    """
+    Return the names of all execute nodes (cached)
+    @param since - only nodes that ran jobs since then (ES date math), None for all time
+    """
+    return execute_nodes_cache.get_or_load(since or '', lambda: compute_execute_nodes(since))
+
+
+def get_jobs_by_ids(ids, _source_includes=None, _source_excludes=None):
+    """
+    Resolve a batch of job documents with a single multi-get
+    @param ids - list of job ids
+    @param _source_includes - optional list of fields to return
+    @param _source_excludes - optional list of fields to leave out
+    @return: (dict of job id -> _source, list of job ids not found)
+    """
+    kwargs = {}
+    if _source_includes:
+        kwargs['_source_includes'] = _source_includes
+    if _source_excludes:
+        kwargs['_source_excludes'] = _source_excludes
+
+    index = app.config['JOB_STATUS_INDEX']
+    result = mozart_es.es.mget(index=index, body={"ids": ids}, **kwargs)
+
+    found = {}
+    missing = []
+    for doc in result['docs']:
+        if doc.get('found', False) is True:
+            found[doc['_id']] = doc['_source']
+        else:
+            missing.append(doc['_id'])
+    return found, missing
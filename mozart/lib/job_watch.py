@@ -0,0 +1,211 @@
+from future import standard_library
+
+standard_library.install_aliases()
+
+import json
+import time
+import queue
+import base64
+import threading
+from datetime import datetime, timedelta, timezone
+
+from mozart import app
+from mozart.lib.pagination import iter_search_after
+
+
+POLL_INTERVAL = app.config.get("JOB_WATCH_POLL_INTERVAL", 2)
+SUBSCRIBER_QUEUE_SIZE = app.config.get("JOB_WATCH_QUEUE_SIZE", 10000)
+
+# status docs may be indexed (visible) after newer ones, so every query looks back this
+# many seconds behind the newest @timestamp seen and skips (id, @timestamp) already sent
+SAFETY_WINDOW = app.config.get("JOB_WATCH_SAFETY_WINDOW", 30)
+
+# max number of watched job ids to push down into the poll query as a terms filter
+MAX_TERMS_FILTER = 10000
+
+
+def parse_timestamp(value):
+    """datetime of an @timestamp value"""
+    dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return dt if dt.tzinfo is not None else dt.replace(tzinfo=timezone.utc)
+
+
+def format_timestamp(dt):
+    return dt.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def prune_seen(seen, newest):
+    """drop (id, @timestamp) keys older than the safety window behind newest"""
+    oldest = newest - timedelta(seconds=SAFETY_WINDOW)
+    return {key: ts for key, ts in seen.items() if ts >= oldest}
+
+
+def encode_watch_cursor(newest, seen):
+    """
+    Return an opaque resume token for a long-poll watch
+    @param newest - newest @timestamp delivered (datetime)
+    @param seen - {(id, @timestamp): datetime} delivered within the safety window
+    """
+    cursor = {"t": format_timestamp(newest), "seen": sorted(seen)}
+    token = json.dumps(cursor, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(token).decode("ascii")
+
+
+def decode_watch_cursor(token):
+    """
+    Decode a token created by encode_watch_cursor
+    @return: (newest, seen)
+    """
+    try:
+        cursor = json.loads(base64.urlsafe_b64decode(token.encode("ascii")))
+        newest = parse_timestamp(cursor["t"])
+        seen = {(_id, ts): parse_timestamp(ts) for _id, ts in cursor["seen"]}
+    except (ValueError, TypeError, KeyError, UnicodeError, AttributeError) as e:
+        raise ValueError("malformed cursor: %s" % token) from e
+    return newest, seen
+
+
+def status_query(since, ids=None):
+    """
+    Query for the status docs with an @timestamp within the safety window before since
+    (oldest first), optionally of a set of job ids
+    """
+    lower = format_timestamp(since - timedelta(seconds=SAFETY_WINDOW))
+    must = [{"range": {"@timestamp": {"gte": lower}}}]
+    if ids is not None and len(ids) <= MAX_TERMS_FILTER:
+        must.append({"ids": {"values": sorted(ids)}})
+    return {
+        "_source": ["status", "@timestamp", "job.username", "tags", "user_tags"],
+        "sort": [{"@timestamp": {"order": "asc"}}, {"_id": {"order": "asc"}}],
+        "query": {"bool": {"must": must}},
+    }
+
+
+class Subscriber:
+    """
+    Queue of job status transitions for one watching client
+    @param ids - job ids to watch (None to match any job)
+    @param user - only match jobs submitted by this user
+    @param tag - only match jobs with this tag (or user tag)
+    """
+
+    def __init__(self, ids=None, user=None, tag=None):
+        self.ids = set(ids) if ids else None
+        self.user = user
+        self.tag = tag
+        self.events = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.dropped = 0
+
+    def matches(self, _id, doc):
+        if self.ids is not None and _id not in self.ids:
+            return False
+        if self.user is not None and doc.get("job", {}).get("username") != self.user:
+            return False
+        if self.tag is not None:
+            tags = (doc.get("tags") or []) + (doc.get("user_tags") or [])
+            if self.tag not in tags:
+                return False
+        return True
+
+    def push(self, event):
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:  # slow client, drop rather than stall the poller
+            self.dropped += 1
+
+
+class JobStatusPoller:
+    """
+    Single background poller per process: each tick queries the job status index for
+    documents with an @timestamp within SAFETY_WINDOW of the newest one seen (so docs
+    indexed late are not missed) and fans the transitions not yet sent out to every
+    subscriber, so the ES cost does not grow with the number of watchers
+    """
+
+    def __init__(self, index, interval=POLL_INTERVAL):
+        self.index = index
+        self.interval = interval
+        self.subscribers = set()
+        self.newest = None
+        self._seen = {}  # (id, @timestamp) -> datetime, within the safety window
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def subscribe(self, subscriber):
+        with self._lock:
+            self.subscribers.add(subscriber)
+            if self._thread is None or not self._thread.is_alive():
+                # a new poller starts from now, not from where an idle one stopped
+                self.newest = datetime.now(timezone.utc)
+                self._seen = {}
+                self._thread = threading.Thread(
+                    target=self._run, name="job-watch-poller", daemon=True
+                )
+                self._thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self.subscribers.discard(subscriber)
+
+    def _query(self, subscribers):
+        ids = None
+        if all(s.ids is not None for s in subscribers):
+            ids = set().union(*(s.ids for s in subscribers))
+        return status_query(self.newest, ids)
+
+    def poll(self):
+        """run one tick; returns the number of status transitions found"""
+        with self._lock:
+            subscribers = list(self.subscribers)
+        if not subscribers:
+            return 0
+
+        changes = 0
+        for doc in iter_search_after(self.index, self._query(subscribers)):
+            _id, source = doc["_id"], doc["_source"]
+            timestamp = source["@timestamp"]
+            if (_id, timestamp) in self._seen:
+                continue
+            ts = parse_timestamp(timestamp)
+            self._seen[(_id, timestamp)] = ts
+            self.newest = max(self.newest, ts)
+
+            event = {"id": _id, "status": source["status"], "@timestamp": timestamp}
+            for subscriber in subscribers:
+                if subscriber.matches(_id, source):
+                    subscriber.push(event)
+            changes += 1
+        self._seen = prune_seen(self._seen, self.newest)
+        return changes
+
+    def changes_since(self, subscriber, newest, seen):
+        """
+        Return the transitions matching a subscriber within the safety window before
+        newest that are not in seen, oldest first (catch-up of a resumed long-poll)
+        """
+        events = []
+        query = status_query(newest, subscriber.ids)
+        for doc in iter_search_after(self.index, query):
+            _id, source = doc["_id"], doc["_source"]
+            timestamp = source["@timestamp"]
+            if (_id, timestamp) in seen or not subscriber.matches(_id, source):
+                continue
+            event = {"id": _id, "status": source["status"], "@timestamp": timestamp}
+            events.append(event)
+        return events
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self.subscribers:
+                    self._thread = None
+                    return
+            try:
+                self.poll()
+            except Exception as e:
+                app.logger.warning("job watch poll failed: %s" % str(e))
+            time.sleep(self.interval)
+
+
+job_status_poller = JobStatusPoller(app.config["JOB_STATUS_INDEX"])
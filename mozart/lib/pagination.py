@@ -0,0 +1,103 @@
+from future import standard_library
+
+standard_library.install_aliases()
+
+import json
+import base64
+
+from mozart import app, mozart_es
+
+
+PIT_KEEP_ALIVE = app.config.get("ES_PIT_KEEP_ALIVE", "1m")
+
+
+def encode_cursor(search_after, pit_id=None):
+    """
+    Return an opaque continuation token for the next page of a search_after query
+    @param search_after - sort values of the last hit of the current page
+    @param pit_id - point-in-time id, if the query is bound to one
+    """
+    cursor = {"search_after": search_after}
+    if pit_id is not None:
+        cursor["pit"] = pit_id
+    token = json.dumps(cursor, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(token).decode("ascii")
+
+
+def decode_cursor(token):
+    """
+    Decode a continuation token created by encode_cursor
+    @param token - opaque cursor string
+    @return: dict with "search_after" and optionally "pit"
+    """
+    try:
+        cursor = json.loads(base64.urlsafe_b64decode(token.encode("ascii")))
+    except (ValueError, TypeError, UnicodeError) as e:
+        raise ValueError("malformed cursor: %s" % token) from e
+    if not isinstance(cursor, dict) or not isinstance(cursor.get("search_after"), list):
+        raise ValueError("malformed cursor: %s" % token)
+    return cursor
+
+
+def open_pit(index):
+    """Open a point-in-time on the index and return its id."""
+    res = mozart_es.es.open_point_in_time(index=index, keep_alive=PIT_KEEP_ALIVE)
+    return res["id"]
+
+
+def close_pit(pit_id):
+    """Release a point-in-time, ignoring ones which have already expired."""
+    try:
+        mozart_es.es.close_point_in_time(body={"id": pit_id}, ignore=404)
+    except Exception as e:
+        app.logger.warning("failed to close point-in-time: %s" % str(e))
+
+
+def search_after_page(index, body, size, cursor=None, pit=False, **kwargs):
+    """
+    Fetch a single page of a search_after query
+    @param index - ES index (ignored if the cursor is bound to a point-in-time)
+    @param body - ES query body, must contain a "sort" that ends with a unique tiebreaker
+    @param size - page size
+    @param cursor - continuation token returned by a previous call
+    @param pit - open a point-in-time for a consistent view across pages
+    @return: (list of hits, next cursor or None when exhausted)
+    """
+    body = dict(body)
+    body["size"] = size
+
+    pit_id = None
+    if cursor is not None:
+        cursor = decode_cursor(cursor)
+        body["search_after"] = cursor["search_after"]
+        pit_id = cursor.get("pit")
+    elif pit is True:
+        pit_id = open_pit(index)
+
+    if pit_id is not None:
+        body["pit"] = {"id": pit_id, "keep_alive": PIT_KEEP_ALIVE}
+        res = mozart_es.search(body=body, **kwargs)
+        pit_id = res.get("pit_id", pit_id)
+    else:
+        res = mozart_es.search(index=index, body=body, **kwargs)
+
+    hits = res["hits"]["hits"]
+    if len(hits) < size:
+        if pit_id is not None:
+            close_pit(pit_id)
+        return hits, None
+    return hits, encode_cursor(hits[-1]["sort"], pit_id)
+
+
+def iter_search_after(index, body, page_size=1000, cursor=None, pit=False, **kwargs):
+    """
+    Yield every hit of a search_after query, one page in memory at a time
+    (see search_after_page for parameters)
+    """
+    while True:
+        hits, cursor = search_after_page(
+            index, body, page_size, cursor=cursor, pit=pit, **kwargs
+        )
+        yield from hits
+        if cursor is None:
+            break
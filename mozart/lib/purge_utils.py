@@ -0,0 +1,405 @@
+from future import standard_library
+
+standard_library.install_aliases()
+
+import json
+import time
+import uuid
+import threading
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+from elasticsearch.exceptions import ConflictError
+from hysds.celery import app as celapp
+
+from mozart import app, mozart_es
+from mozart.lib.dav_utils import dav_session
+from mozart.lib.job_utils import invalidate_job
+from mozart.lib.pagination import encode_cursor, iter_search_after
+
+
+PURGE_BATCH_SIZE = app.config.get("PURGE_BATCH_SIZE", 500)
+PURGE_CONCURRENCY = app.config.get("PURGE_CONCURRENCY", 16)
+
+
+def build_purge_query(query):
+    """Wrap a user supplied ES query into a search_after query for purging"""
+    return {
+        "query": query.get("query", {"match_all": {}}),
+        "_source": ["uuid", "payload_id", "job.job_info.job_url"],
+        "sort": [{"_id": {"order": "asc"}}],
+    }
+
+
+def get_task_state(uuid):
+    """Always grab latest state (not state from query result)"""
+    return celapp.AsyncResult(uuid).state
+
+
+def delete_work_dir(url):
+    """Delete a job work dir via WebDAV, returns None or the error message"""
+    try:
+        dav_session.delete(url, timeout=5)
+    except Exception as e:
+        return str(e)
+    return None
+
+
+class PurgeEngine:
+    """
+    Stops (purge=False) or purges (purge=True) the tasks/jobs matched by a query, a
+    batch at a time: task states are resolved concurrently, revokes are sent as one
+    list per batch, work dirs are deleted through a pooled HTTP session with bounded
+    concurrency and ES documents are removed with a single bulk request per batch.
+    @param index - ES index (job_status-* or task_status-*)
+    @param query - ES query body (dict)
+    @param purge - True to purge inactive tasks, False to revoke active ones
+    @param cursor - resume after this checkpoint (see checkpoint)
+    """
+
+    def __init__(self, index, query, purge=True, cursor=None):
+        self.index = index
+        self.body = build_purge_query(query)
+        self.purge = purge
+        self.cursor = cursor
+        self.processed = 0
+        self.removed = 0
+        self.revoked = 0
+        self.errors = []
+        self.started = None
+
+    @property
+    def checkpoint(self):
+        """cursor of the last fully processed batch, None before the first one"""
+        return self.cursor
+
+    def batches(self):
+        batch = []
+        for hit in iter_search_after(
+            self.index, self.body, page_size=PURGE_BATCH_SIZE, cursor=self.cursor
+        ):
+            batch.append(hit)
+            if len(batch) == PURGE_BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def run(self):
+        """
+        generator of progress messages; the counters and the checkpoint are updated
+        together once a batch is done, before its messages are yielded, so they always
+        describe the same set of completed batches
+        """
+        self.started = time.time()
+        with ThreadPoolExecutor(max_workers=PURGE_CONCURRENCY) as executor:
+            for batch in self.batches():
+                messages, removed, revoked, errors = self.process_batch(batch, executor)
+                self.processed += len(batch)
+                self.removed += removed
+                self.revoked += revoked
+                self.errors.extend(errors)
+                self.cursor = encode_cursor(batch[-1]["sort"])
+                yield from messages
+
+    def process_batch(self, batch, executor):
+        """
+        Revoke/purge the tasks of a batch
+        @return: (messages, number removed, number revoked, errors)
+        """
+        uuids = [hit["_source"]["uuid"] for hit in batch]
+        states = list(executor.map(get_task_state, uuids))
+
+        revoke = []
+        remove = []
+        messages = []
+        for hit, state in zip(batch, states):
+            uuid = hit["_source"]["uuid"]
+            lines = ["Job state: %s\n" % state]
+            messages.append(lines)
+
+            # Active states may only revoke
+            if state in ["RETRY", "STARTED"] or (state == "PENDING" and not self.purge):
+                if not self.purge:
+                    lines.append("Revoking %s\n" % uuid)
+                    revoke.append(uuid)
+                else:
+                    lines.append("Cannot remove active job %s\n" % uuid)
+                continue
+            elif not self.purge:
+                lines.append("Cannot stop inactive job: %s\n" % uuid)
+                continue
+
+            # Safety net to revoke job if in PENDING state
+            if state == "PENDING":
+                lines.append("Revoking %s\n" % uuid)
+                revoke.append(uuid)
+            remove.append((hit, lines))
+
+        if revoke:
+            celapp.control.revoke(revoke, terminate=True)
+
+        # Inactive states remove from WebDAV (job_status only) and ES
+        urls = {}
+        for hit, lines in remove:
+            if hit["_index"].startswith("job_status"):
+                job_info = hit["_source"].get("job", {}).get("job_info", {})
+                url = job_info.get("job_url", None)
+                lines.append("Purging {} ({})...".format(hit["_source"]["uuid"], url))
+                if url is not None:
+                    urls[hit["_id"]] = url
+        dav_errors = dict(zip(urls, executor.map(delete_work_dir, urls.values())))
+
+        actions = [
+            {"delete": {"_index": hit["_index"], "_id": hit["_id"]}}
+            for hit, _ in remove
+        ]
+        es_errors = {}
+        if actions:
+            result = mozart_es.es.bulk(body=actions)
+            for item in result["items"]:
+                delete = item["delete"]
+                if delete.get("error") is not None:
+                    es_errors[delete["_id"]] = str(delete["error"])
+
+        removed, errors = 0, []
+        for hit, lines in remove:
+            payload_id = hit["_source"]["payload_id"]
+            if hit["_id"] in urls:
+                lines.append("Removing WebDAV directory...")
+                error = dav_errors[hit["_id"]]
+                lines.append("done.\n" if error is None else "failed (%s).\n" % error)
+            lines.append("Removing ES for %s" % payload_id)
+            if hit["_id"] in es_errors:
+                lines.append(" failed (%s)\n" % es_errors[hit["_id"]])
+                errors.append({"id": hit["_id"], "error": es_errors[hit["_id"]]})
+            else:
+                lines.append("done: %s\n" % payload_id)
+                removed += 1
+                invalidate_job(hit["_id"])
+
+        messages = ["".join(lines) for lines in messages]
+        return messages, removed, len(revoke), errors
+
+
+PURGE_OPERATIONS_INDEX = app.config.get(
+    "PURGE_OPERATIONS_INDEX", "purge_operations-mozart"
+)
+# a running operation's worker writes its heartbeat to ES every HEARTBEAT_INTERVAL
+# seconds; operations without one for HEARTBEAT_TIMEOUT seconds were interrupted, in
+# whichever worker or process they ran
+HEARTBEAT_INTERVAL = 60
+HEARTBEAT_TIMEOUT = 300
+# the heartbeat thread and the progress updates write the same operation document
+RETRY_ON_CONFLICT = 5
+MAX_REPORTED_ERRORS = 100
+
+
+def utc_now():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def write_heartbeats(op_id, done):
+    """keep the heartbeat of a running operation fresh, even during long batches"""
+    while not done.wait(HEARTBEAT_INTERVAL):
+        try:
+            mozart_es.update_document(
+                index=PURGE_OPERATIONS_INDEX,
+                id=op_id,
+                body={"doc": {"heartbeat": time.time()}},
+                retry_on_conflict=RETRY_ON_CONFLICT,
+            )
+        except Exception as e:
+            app.logger.warning("purge operation %s heartbeat failed: %s" % (op_id, e))
+
+
+def run_purge_operation(op_id, engine):
+    """
+    Background body of a purge operation, records progress and the checkpoint of
+    the last completed batch after every batch
+    """
+    start, start_processed = time.time(), engine.processed
+    status, message = "completed", ""
+    checkpoint = engine.checkpoint
+    done = threading.Event()
+    threading.Thread(
+        target=write_heartbeats,
+        args=(op_id, done),
+        name="purge-heartbeat-%s" % op_id,
+        daemon=True,
+    ).start()
+    try:
+        for _ in engine.run():
+            if engine.checkpoint == checkpoint:
+                continue
+            checkpoint = engine.checkpoint
+            elapsed = max(time.time() - start, 1e-6)
+            mozart_es.update_document(
+                index=PURGE_OPERATIONS_INDEX,
+                id=op_id,
+                body={
+                    "doc": {
+                        "processed": engine.processed,
+                        "removed": engine.removed,
+                        "revoked": engine.revoked,
+                        "errors": engine.errors[-MAX_REPORTED_ERRORS:],
+                        "error_count": len(engine.errors),
+                        "throughput": (engine.processed - start_processed) / elapsed,
+                        "checkpoint": engine.checkpoint,
+                        "updated": utc_now(),
+                        "heartbeat": time.time(),
+                    }
+                },
+                retry_on_conflict=RETRY_ON_CONFLICT,
+            )
+    except Exception as e:
+        status, message = "failed", "%s:%s" % (type(e), str(e))
+        app.logger.error("purge operation %s failed: %s" % (op_id, message))
+    finally:
+        done.set()
+
+    try:
+        mozart_es.update_document(
+            index=PURGE_OPERATIONS_INDEX,
+            id=op_id,
+            body={
+                "doc": {
+                    "status": status,
+                    "message": message,
+                    "processed": engine.processed,
+                    "removed": engine.removed,
+                    "revoked": engine.revoked,
+                    "error_count": len(engine.errors),
+                    "checkpoint": engine.checkpoint,
+                    "updated": utc_now(),
+                    "finished": utc_now(),
+                    "heartbeat": time.time(),
+                }
+            },
+            refresh=True,
+            retry_on_conflict=RETRY_ON_CONFLICT,
+        )
+    except Exception as e:
+        # without a heartbeat the operation is reported as interrupted and resumable
+        app.logger.error(
+            "purge operation %s: failed to record final status %s: %s"
+            % (op_id, status, str(e))
+        )
+
+
+def launch_purge_operation(op_id, engine):
+    threading.Thread(
+        target=run_purge_operation,
+        args=(op_id, engine),
+        name="purge-%s" % op_id,
+        daemon=True,
+    ).start()
+
+
+def start_purge_operation(index, query, purge=True):
+    """
+    Start purging (or stopping) the tasks matched by query in the background
+    @return: operation id
+    """
+    engine = PurgeEngine(index, query, purge)
+    total = mozart_es.get_count(index=index, body={"query": engine.body["query"]})
+
+    op_id = str(uuid.uuid4())
+    doc = {
+        "id": op_id,
+        "index": index,
+        "query": json.dumps(query),
+        "purge": purge,
+        "status": "running",
+        "message": "",
+        "total": total,
+        "processed": 0,
+        "removed": 0,
+        "revoked": 0,
+        "errors": [],
+        "error_count": 0,
+        "throughput": 0.0,
+        "checkpoint": None,
+        "created": utc_now(),
+        "updated": utc_now(),
+        "heartbeat": time.time(),
+    }
+    mozart_es.index_document(
+        index=PURGE_OPERATIONS_INDEX, body=doc, id=op_id, refresh=True
+    )
+    launch_purge_operation(op_id, engine)
+    return op_id
+
+
+def describe_operation(operation):
+    """
+    Add the remaining count and ETA to an operation document; running operations whose
+    heartbeat (kept in ES by the worker running them) stopped are reported as
+    interrupted
+    """
+    if operation["status"] == "running":
+        if time.time() - operation["heartbeat"] > HEARTBEAT_TIMEOUT:
+            operation["status"] = "interrupted"
+
+    operation["remaining"] = max(operation["total"] - operation["processed"], 0)
+    operation["eta_seconds"] = None
+    if operation["status"] == "running" and operation["throughput"] > 0:
+        operation["eta_seconds"] = operation["remaining"] / operation["throughput"]
+    return operation
+
+
+def get_purge_operation(op_id):
+    """Return the progress of a purge operation (None if unknown), with ETA"""
+    doc = mozart_es.get_by_id(index=PURGE_OPERATIONS_INDEX, id=op_id, ignore=404)
+    if doc.get("found", False) is False:
+        return None
+    return describe_operation(doc["_source"])
+
+
+def resume_purge_operation(op_id):
+    """
+    Restart an interrupted or failed purge operation from its last checkpoint; the
+    operation is claimed with a conditional update, so only one worker can resume it
+    @return: the operation, or None if unknown
+    """
+    doc = mozart_es.get_by_id(index=PURGE_OPERATIONS_INDEX, id=op_id, ignore=404)
+    if doc.get("found", False) is False:
+        return None
+    operation = describe_operation(doc["_source"])
+    if operation["status"] not in ("interrupted", "failed"):
+        raise ValueError(
+            "operation %s is %s, only interrupted or failed operations can be resumed"
+            % (op_id, operation["status"])
+        )
+
+    engine = PurgeEngine(
+        operation["index"],
+        json.loads(operation["query"]),
+        operation["purge"],
+        cursor=operation["checkpoint"],
+    )
+    engine.processed = operation["processed"]
+    engine.removed = operation["removed"]
+    engine.revoked = operation["revoked"]
+    engine.errors = list(operation["errors"])
+    try:
+        mozart_es.es.update(
+            index=PURGE_OPERATIONS_INDEX,
+            id=op_id,
+            body={
+                "doc": {
+                    "status": "running",
+                    "message": "",
+                    "updated": utc_now(),
+                    "heartbeat": time.time(),
+                }
+            },
+            if_seq_no=doc["_seq_no"],
+            if_primary_term=doc["_primary_term"],
+            refresh=True,
+        )
+    except ConflictError:
+        raise ValueError("operation %s was resumed by another worker" % op_id)
+    launch_purge_operation(op_id, engine)
+    operation["status"] = "running"
+    return operation
@@ -3,26 +3,29 @@ standard_library.install_aliases()
 
 from hysds_commons.queue_utils import get_all_queues
 
-from mozart import app, mozart_es
+from mozart import app
+from mozart.lib.registry import job_spec_registry
 
 
-def get_queue_names(_id):
+def get_queue_names(_id, all_queues=None):
     """
     List the queues available for job-running
     Note: does not return celery internal queues
     @param _id - identity of job
+    @param all_queues - queues of the broker, fetched from RabbitMQ if not given
     @return: list of queues
     """
 
-    queues = set(get_all_queues(app.config["RABBITMQ_ADMIN_API"]))  # Non-celery queues set
+    if all_queues is None:
+        all_queues = get_all_queues(app.config["RABBITMQ_ADMIN_API"])
+    queues = set(all_queues)  # Non-celery queues set
     protected = set(app.config["PROTECTED_QUEUES"])
     visible = queues - protected  # Visible generic queues
 
     spec = {}
     try:
-        spec = mozart_es.get_by_id(index="job_specs", id=_id, ignore=404)
-        if spec['found'] is True:
-            spec = spec['_source']
+        if _id is not None:
+            spec = job_spec_registry.get(_id) or {}
     except Exception as e:
         app.logger.warn(f"Failed to get job-spec: {_id} proceeding without it. {type(e)}:{e}")
 
@@ -34,3 +37,25 @@ def get_queue_names(_id):
         "recommended": sorted(required | recommended)
     }
     return queue_config
+
+
+def check_job_queues(pairs):
+    """
+    Check a set of (job type, queue) pairs with one RabbitMQ request and one job spec
+    lookup per pair
+    @param pairs - iterable of (job type, queue)
+    @return: dict of (job type, queue) -> error message, or None if the job type exists
+             and the queue is available to it
+    """
+
+    all_queues = get_all_queues(app.config["RABBITMQ_ADMIN_API"])
+    errors = {}
+    for job_type, queue in pairs:
+        if job_spec_registry.get(job_type) is None:
+            errors[(job_type, queue)] = "job type not found: %s" % job_type
+        elif queue not in get_queue_names(job_type, all_queues)["queues"]:
+            message = "queue %s not available for %s" % (queue, job_type)
+            errors[(job_type, queue)] = message
+        else:
+            errors[(job_type, queue)] = None
+    return errors
@@ -0,0 +1,204 @@
+from future import standard_library
+
+standard_library.install_aliases()
+
+import time
+import hashlib
+import threading
+from functools import wraps
+
+from flask import request, Response
+
+from mozart import app, mozart_es
+from mozart.lib.cache_utils import TTLCache
+from mozart.lib.pagination import encode_cursor, decode_cursor
+
+
+STALENESS_CHECK_INTERVAL = app.config.get("REGISTRY_STALENESS_CHECK_INTERVAL", 30)
+
+
+def index_fingerprint(index):
+    """cheap fingerprint of an index: indexing/delete counters and doc count"""
+    stats = mozart_es.es.indices.stats(index=index, metric="indexing,docs")
+    primaries = stats["_all"]["primaries"]
+    return (
+        primaries["indexing"]["index_total"],
+        primaries["indexing"]["delete_total"],
+        primaries["docs"]["count"],
+    )
+
+
+class StalenessCheck:
+    """
+    Detects writes to an index made by other processes (or workers) by comparing its
+    fingerprint, at most every STALENESS_CHECK_INTERVAL seconds
+    @param index - ES index
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self._fingerprint = None
+        self._checked = 0
+        self._lock = threading.Lock()
+
+    def changed(self):
+        """True if the index changed (or could not be checked) since the last check"""
+        now = time.time()
+        if now - self._checked < STALENESS_CHECK_INTERVAL:
+            return False
+        with self._lock:
+            if now - self._checked < STALENESS_CHECK_INTERVAL:
+                return False
+            self._checked = now
+            try:
+                fingerprint = index_fingerprint(self.index)
+            except Exception as e:
+                app.logger.warning("%s fingerprint failed: %s" % (self.index, str(e)))
+                return True
+            if fingerprint == self._fingerprint:
+                return False
+            if self._fingerprint is not None:
+                app.logger.info("%s changed" % self.index)
+            self._fingerprint = fingerprint
+            return True
+
+
+class SpecRegistry:
+    """
+    In-process cache of the documents of a rarely written index (job specs, hysds_ios,
+    containers) keyed by id. Writes through the Mozart API invalidate it directly; a
+    cheap fingerprint of the index (indexing/delete counters and doc count) is checked
+    every STALENESS_CHECK_INTERVAL seconds to catch writes made by other processes.
+    @param index - ES index
+    @param maxsize - max number of cached documents
+    @param ttl - upper bound on how long a document is served from cache
+    """
+
+    def __init__(self, index, maxsize=2048, ttl=3600):
+        self.index = index
+        self.version = 0  # bumped on every invalidation
+        self._cache = TTLCache("registry-%s" % index, maxsize=maxsize, ttl=ttl)
+        self._staleness = StalenessCheck(index)
+        self._ids = None  # (version, ids, etag) of the last listing
+
+    def check_staleness(self):
+        if self._staleness.changed():
+            self.invalidate()
+
+    def get_entry(self, _id):
+        """
+        Return {"_source": ..., "etag": ...} of document _id, or None if it does not
+        exist; the etag is derived from the document's _primary_term and _seq_no
+        """
+        self.check_staleness()
+
+        def load():
+            doc = mozart_es.get_by_id(index=self.index, id=_id, ignore=404)
+            if doc.get("found", False) is False:
+                return None
+            return {
+                "_source": doc["_source"],
+                "etag": "%s-%s" % (doc["_primary_term"], doc["_seq_no"]),
+            }
+
+        return self._cache.get_or_load(_id, load)
+
+    def get(self, _id):
+        """Return the _source of document _id, or None if it does not exist"""
+        entry = self.get_entry(_id)
+        return None if entry is None else entry["_source"]
+
+    def list_ids(self):
+        """
+        Return (sorted ids of all documents, etag); the listing is reused until the
+        registry is invalidated
+        """
+        self.check_staleness()
+        listing = self._ids
+        if listing is not None and listing[0] == self.version:
+            return listing[1], listing[2]
+
+        version = self.version
+        docs = mozart_es.query(index=self.index, _source=False)
+        ids = sorted(doc["_id"] for doc in docs)
+        etag = hashlib.sha1("\n".join(ids).encode("utf-8")).hexdigest()
+        self._ids = (version, ids, etag)
+        return ids, etag
+
+    def list_page(self, prefix=None, size=None, cursor=None, fields=None):
+        """
+        Return a page of the documents, in id order
+        @param prefix - only ids starting with prefix
+        @param size - page size, None for all
+        @param cursor - continuation token returned with the previous page
+        @param fields - project the documents on these fields; None returns only ids
+        @return: (list of ids or of {"id": ..., <fields>}, next cursor or None, total)
+        @raise ValueError: on a malformed cursor
+        """
+        ids, _ = self.list_ids()
+        if prefix:
+            ids = [_id for _id in ids if _id.startswith(prefix)]
+        total = len(ids)
+        if cursor:
+            search_after = decode_cursor(cursor)["search_after"]
+            if len(search_after) != 1 or not isinstance(search_after[0], str):
+                raise ValueError("malformed cursor: %s" % cursor)
+            after = search_after[0]
+            ids = [_id for _id in ids if _id > after]
+
+        next_cursor = None
+        if size is not None and len(ids) > size:
+            ids = ids[:size]
+            next_cursor = encode_cursor([ids[-1]])
+
+        if fields is None or not ids:
+            return ids, next_cursor, total
+
+        docs = mozart_es.es.mget(
+            index=self.index, body={"ids": ids}, _source_includes=fields
+        )["docs"]
+        page = [
+            {**doc.get("_source", {}), "id": doc["_id"]}
+            for doc in docs
+            if doc.get("found", False) is True
+        ]
+        return page, next_cursor, total
+
+    def invalidate(self, _id=None):
+        """Drop one document (or everything) after a write"""
+        if _id is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(_id)
+        self.version += 1
+
+
+def conditional_get(f):
+    """
+    Decorator for GET methods (applied above marshal_with) returning
+    (data, 200, {"ETag": etag}): answers 304 Not Modified without a body when the
+    request's If-None-Match matches the etag
+    """
+
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        resp = f(*args, **kwargs)
+        if isinstance(resp, tuple) and len(resp) == 3 and resp[1] == 200:
+            etag = (resp[2] or {}).get("ETag")
+            # If-None-Match uses the weak comparison (RFC 7232), W/"x" matches "x"
+            if etag is not None and request.if_none_match.contains_weak(
+                etag.strip('"')
+            ):
+                return Response(status=304, headers={"ETag": etag})
+        return resp
+
+    return wrapper
+
+
+def etag_header(etag):
+    return {"ETag": '"%s"' % etag}
+
+
+job_spec_registry = SpecRegistry(app.config["JOB_SPECS_INDEX"])
+hysds_io_registry = SpecRegistry(app.config["HYSDS_IOS_INDEX"])
+container_registry = SpecRegistry(app.config["CONTAINERS_INDEX"])
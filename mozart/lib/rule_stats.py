@@ -0,0 +1,210 @@
+from future import standard_library
+
+standard_library.install_aliases()
+
+import math
+import time
+import threading
+from collections import Counter
+
+from mozart import app, mozart_es
+from mozart.lib.cache_utils import TTLCache
+from mozart.lib.pagination import iter_search_after
+
+
+STATS_INDEX = app.config.get("USER_RULES_STATS_INDEX", "job_status-*")
+STATS_WINDOW = app.config.get("USER_RULES_STATS_WINDOW", 7)  # days
+STATS_BUCKET = app.config.get("USER_RULES_STATS_BUCKET", 3600)  # seconds
+STATS_SETTLE = app.config.get("USER_RULES_STATS_SETTLE", 86400)  # seconds
+STATS_TTL = app.config.get("USER_RULES_STATS_TTL", 60)  # seconds
+STATS_PAGE_SIZE = 1000
+
+# jobs submitted by a user rule are tagged with its rule name
+TIME_FIELD = "job.job_info.time_queued"
+RULE_FIELD = "tags.keyword"
+
+# a match of a rule with enable_dedup set may not submit a new job
+DEDUPED_STATES = ("job-deduped",)
+FAILED_STATES = ("job-failed", "job-offline")
+
+# bucket start (epoch seconds) -> {rule name: {job status: count}}; buckets older than
+# STATS_SETTLE are kept for the whole window, newer ones are re-aggregated every
+# STATS_TTL seconds as the jobs in them change state
+bucket_cache = TTLCache(
+    "rule-stats-buckets",
+    maxsize=int(STATS_WINDOW * 86400 / STATS_BUCKET) + 2,
+    ttl=STATS_TTL,
+)
+summary_cache = TTLCache("rule-stats", maxsize=4, ttl=STATS_TTL)
+
+_buckets_lock = threading.Lock()
+
+
+def aggregate_buckets(start, end):
+    """
+    Count jobs of every rule and status per STATS_BUCKET seconds, queued in [start, end)
+    @return: {bucket start: {rule name: {status: count}}}
+    """
+    body = {
+        "size": 0,
+        "query": {
+            "range": {
+                TIME_FIELD: {
+                    "gte": int(start * 1000),
+                    "lt": int(end * 1000),
+                    "format": "epoch_millis",
+                }
+            }
+        },
+        "aggs": {
+            "stats": {
+                "composite": {
+                    "size": STATS_PAGE_SIZE,
+                    "sources": [
+                        {
+                            "time": {
+                                "date_histogram": {
+                                    "field": TIME_FIELD,
+                                    "fixed_interval": "%ds" % STATS_BUCKET,
+                                }
+                            }
+                        },
+                        {"rule": {"terms": {"field": RULE_FIELD}}},
+                        {"status": {"terms": {"field": "status"}}},
+                    ],
+                }
+            }
+        },
+    }
+
+    buckets = {}
+    while True:
+        result = mozart_es.search(index=STATS_INDEX, body=body)
+        composite = result["aggregations"]["stats"]
+        for bucket in composite["buckets"]:
+            key = bucket["key"]
+            rules = buckets.setdefault(key["time"] // 1000, {})
+            rules.setdefault(key["rule"], {})[key["status"]] = bucket["doc_count"]
+        if not composite["buckets"] or "after_key" not in composite:
+            break
+        body["aggs"]["stats"]["composite"]["after"] = composite["after_key"]
+    return buckets
+
+
+def get_buckets():
+    """
+    Return the buckets of the last STATS_WINDOW days, aggregating only the ones missing
+    from (or expired in) bucket_cache with one query
+    @return: list of (bucket start, {rule name: {status: count}}), oldest first
+    """
+    now = time.time()
+    end = (math.floor(now / STATS_BUCKET) + 1) * STATS_BUCKET
+    count = int(STATS_WINDOW * 86400 / STATS_BUCKET)
+    starts = range(end - count * STATS_BUCKET, end, STATS_BUCKET)
+
+    with _buckets_lock:
+        buckets = {s: bucket_cache.get(str(s)) for s in starts}
+        missing = [s for s, bucket in buckets.items() if bucket is None]
+        if missing:
+            loaded = aggregate_buckets(missing[0], missing[-1] + STATS_BUCKET)
+            for s in range(missing[0], missing[-1] + STATS_BUCKET, STATS_BUCKET):
+                settled = now - (s + STATS_BUCKET) > STATS_SETTLE
+                buckets[s] = loaded.get(s, {})
+                bucket_cache.set(
+                    str(s),
+                    buckets[s],
+                    ttl=STATS_WINDOW * 86400 if settled else STATS_TTL,
+                )
+            app.logger.info(
+                "aggregated %d user rule stats buckets"
+                % ((missing[-1] - missing[0]) // STATS_BUCKET + 1)
+            )
+    return [(s, buckets[s]) for s in starts]
+
+
+def summarize(outcomes):
+    """match, submission and failure counts of a {status: count} dict"""
+    matched = sum(outcomes.values())
+    deduped = sum(outcomes.get(s, 0) for s in DEDUPED_STATES)
+    failed = sum(outcomes.get(s, 0) for s in FAILED_STATES)
+    completed = outcomes.get("job-completed", 0)
+    finished = completed + failed
+    return {
+        "matched": matched,
+        "submitted": matched - deduped,
+        "deduped": deduped,
+        "completed": completed,
+        "failed": failed,
+        "failure_rate": failed / finished if finished else None,
+        "outcomes": dict(outcomes),
+    }
+
+
+def compute_summary():
+    """totals of every rule over the window, including rules without any job"""
+    totals = {}
+    for _, rules in get_buckets():
+        for rule_name, outcomes in rules.items():
+            totals.setdefault(rule_name, Counter()).update(outcomes)
+
+    body = {
+        "query": {"match_all": {}},
+        "_source": ["rule_name"],
+        "sort": [{"_id": {"order": "asc"}}],
+    }
+    rule_ids = {
+        doc["_source"]["rule_name"]: doc["_id"]
+        for doc in iter_search_after(app.config["USER_RULES_INDEX"], body)
+    }
+    # tags of jobs that no user rule has (e.g. user defined job tags) are not rules
+    return {
+        "window": STATS_WINDOW,
+        "updated": time.time(),
+        "rules": [
+            {"id": _id, "rule_name": name, **summarize(totals.get(name, {}))}
+            for name, _id in rule_ids.items()
+        ],
+    }
+
+
+def get_summary():
+    """cached totals of every rule, see compute_summary()"""
+    return summary_cache.get_or_load("summary", compute_summary)
+
+
+def top_rules(by="matched", size=10, ascending=False):
+    """
+    Return the size rules with the highest (or lowest) value of by, e.g. the hottest or
+    dead rules by "matched" and the most failing by "failed" or "failure_rate"
+    """
+    summary = get_summary()
+    rules = [rule for rule in summary["rules"] if rule[by] is not None]
+    rules.sort(key=lambda rule: (rule[by], rule["rule_name"]), reverse=not ascending)
+    return {
+        "window": summary["window"],
+        "updated": summary["updated"],
+        "by": by,
+        "rules": rules[:size],
+    }
+
+
+def rule_stats(_id, rule_name):
+    """
+    Return the totals of a rule over the window and its non-empty buckets
+    @param _id - rule id
+    @param rule_name - rule name (the tag of the jobs it submitted)
+    """
+    totals, history = Counter(), []
+    for start, rules in get_buckets():
+        outcomes = rules.get(rule_name)
+        if outcomes:
+            totals.update(outcomes)
+            history.append({"time": start, **summarize(outcomes)})
+    return {
+        "id": _id,
+        "rule_name": rule_name,
+        "window": STATS_WINDOW,
+        "bucket": STATS_BUCKET,
+        **summarize(totals),
+        "history": history,
+    }
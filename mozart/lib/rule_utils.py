@@ -0,0 +1,672 @@
+from future import standard_library
+
+standard_library.install_aliases()
+
+import json
+import bisect
+import hashlib
+import threading
+from datetime import datetime, timezone
+
+from elasticsearch.exceptions import RequestError, ConnectionTimeout, TransportError
+
+from mozart import app, mozart_es
+from mozart.lib.cache_utils import TTLCache
+from mozart.lib.pagination import iter_search_after
+from mozart.lib.registry import StalenessCheck, index_fingerprint
+
+
+USER_RULES_INDEX = app.config["USER_RULES_INDEX"]
+JOB_STATUS_INDEX = app.config["JOB_STATUS_INDEX"]
+
+PERCOLATOR_ENABLED = app.config.get("USER_RULES_PERCOLATOR_ENABLED", False)
+PERCOLATOR_INDEX = app.config.get(
+    "USER_RULES_PERCOLATOR_INDEX", "user_rules_percolator-mozart"
+)
+
+# rules created before document ids were derived from rule names (see
+# migrate_rule_ids) are also looked up by a rule_name query while this is set
+LEGACY_RULE_IDS = app.config.get("USER_RULES_LEGACY_IDS", True)
+
+# rule fields copied to the percolator documents (under "rule")
+PERCOLATOR_RULE_FIELDS = ("rule_name", "workflow", "job_spec", "queue", "priority")
+
+DRY_RUN_INDEX = app.config.get("USER_RULES_DRY_RUN_INDEX", JOB_STATUS_INDEX)
+DRY_RUN_TIMEOUT = app.config.get("USER_RULES_DRY_RUN_TIMEOUT", 10)
+DRY_RUN_SAMPLE_SIZE = 10
+
+dry_run_cache = TTLCache(
+    "user-rule-dry-run",
+    maxsize=256,
+    ttl=app.config.get("USER_RULES_DRY_RUN_CACHE_TTL", 300),
+)
+
+TAGS_PAGE_SIZE = 1000
+
+# all user rule tags with their counts, dropped by invalidate_rule_tags() on rule writes
+# in this worker and when the rules index fingerprint shows writes made elsewhere
+tags_cache = TTLCache(
+    "user-rule-tags", maxsize=1, ttl=app.config.get("USER_RULES_TAGS_CACHE_TTL", 3600)
+)
+tags_staleness = StalenessCheck(USER_RULES_INDEX)
+
+_percolator_ready = threading.Event()
+_percolator_lock = threading.Lock()
+
+
+def rule_id(rule_name):
+    """Document id of a user rule; rule names are unique so the name is the id"""
+    return rule_name
+
+
+def find_rule(_id=None, rule_name=None):
+    """
+    Return a user rule document (_id, _source) by id or rule_name, or None; a name is
+    resolved with a get of rule_id(rule_name), falling back to a rule_name term query
+    for rules with legacy ids
+    """
+    doc = mozart_es.get_by_id(
+        index=USER_RULES_INDEX, id=_id or rule_id(rule_name), ignore=404
+    )
+    if doc.get("found", False) is True:
+        return doc
+    if _id is None and LEGACY_RULE_IDS:
+        result = mozart_es.search(
+            index=USER_RULES_INDEX,
+            body={"size": 1, "query": {"term": {"rule_name": rule_name}}},
+        )
+        if result["hits"]["hits"]:
+            return result["hits"]["hits"][0]
+    return None
+
+
+def delete_rule(_id=None, rule_name=None):
+    """Delete a user rule by id or rule_name (including legacy id copies)"""
+    mozart_es.delete_by_id(
+        index=USER_RULES_INDEX, id=_id or rule_id(rule_name), refresh=True, ignore=404
+    )
+    if _id is None and LEGACY_RULE_IDS:
+        query = {"query": {"term": {"rule_name": rule_name}}}
+        mozart_es.es.delete_by_query(
+            index=USER_RULES_INDEX, body=query, refresh=True, ignore=404
+        )
+
+
+def migrate_rule_ids():
+    """
+    One-shot migration of user rules to document ids derived from their rule names:
+    the rules are reindexed into a new index (same mappings and settings) with their
+    new ids, then USER_RULES_INDEX is atomically switched to an alias of it. The live
+    rules are not touched until the switch, nothing is changed if two rules have the
+    same name or the rules were written to during the copy.
+    @return: (number of migrated rules, name of the new index)
+    @raise RuntimeError: on duplicate rule names, concurrent writes or a failed reindex
+    """
+    new_index = "%s-%s" % (
+        USER_RULES_INDEX,
+        datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S"),
+    )
+    script = {"lang": "painless", "source": "ctx._id = ctx._source.rule_name"}
+
+    index_info = mozart_es.es.indices.get(index=USER_RULES_INDEX)
+    if len(index_info) != 1:
+        raise RuntimeError("%s must be a single index" % USER_RULES_INDEX)
+    old_index, info = next(iter(index_info.items()))
+    settings = {
+        key: value
+        for key, value in info["settings"]["index"].items()
+        if key in ("number_of_shards", "number_of_replicas", "analysis")
+    }
+    body = {"settings": {"index": settings}, "mappings": info["mappings"]}
+
+    fingerprint = index_fingerprint(old_index)
+    total = mozart_es.get_count(index=old_index, body={"query": {"match_all": {}}})
+    mozart_es.es.indices.create(index=new_index, body=body)
+    result = mozart_es.es.reindex(
+        body={
+            "source": {"index": old_index},
+            "dest": {"index": new_index, "op_type": "create"},
+            "script": script,
+            "conflicts": "proceed",
+        },
+        refresh=True,
+        wait_for_completion=True,
+    )
+    if result["failures"] or result["version_conflicts"] or result["created"] != total:
+        mozart_es.es.indices.delete(index=new_index, ignore=404)
+        raise RuntimeError(
+            "user rules not migrated, %d of %d rules copied (%d duplicate rule names, "
+            "failures: %s)"
+            % (
+                result["created"],
+                total,
+                result["version_conflicts"],
+                result["failures"],
+            )
+        )
+    if index_fingerprint(old_index) != fingerprint:
+        mozart_es.es.indices.delete(index=new_index, ignore=404)
+        raise RuntimeError("user rules were written during the migration, run it again")
+
+    # an index can't share its name with an alias, so the old index is removed in the
+    # same atomic request when USER_RULES_INDEX is not an alias yet
+    if old_index == USER_RULES_INDEX:
+        actions = [
+            {"add": {"index": new_index, "alias": USER_RULES_INDEX}},
+            {"remove_index": {"index": old_index}},
+        ]
+    else:
+        actions = [
+            {"remove": {"index": old_index, "alias": USER_RULES_INDEX}},
+            {"add": {"index": new_index, "alias": USER_RULES_INDEX}},
+        ]
+    mozart_es.es.indices.update_aliases(body={"actions": actions})
+    app.logger.info(
+        "migrated %d user rules from %s to %s" % (total, old_index, new_index)
+    )
+
+    if PERCOLATOR_ENABLED and mozart_es.es.indices.exists(index=PERCOLATOR_INDEX):
+        mozart_es.es.indices.delete(index=PERCOLATOR_INDEX)
+        _percolator_ready.clear()
+        ensure_percolator_index()
+    return total, new_index
+
+
+def compute_rule_tags():
+    """
+    Page through the tags of all user rules with a composite aggregation
+    @return: {"tags": [{key, count}] by count (desc), "keys": sorted tags}
+    """
+    body = {
+        "size": 0,
+        "aggs": {
+            "tags": {
+                "composite": {
+                    "size": TAGS_PAGE_SIZE,
+                    "sources": [{"tags": {"terms": {"field": "tags"}}}],
+                }
+            }
+        },
+    }
+    counts = {}
+    while True:
+        result = mozart_es.search(index=USER_RULES_INDEX, body=body)
+        composite = result["aggregations"]["tags"]
+        for bucket in composite["buckets"]:
+            counts[bucket["key"]["tags"]] = bucket["doc_count"]
+        if not composite["buckets"] or "after_key" not in composite:
+            break
+        body["aggs"]["tags"]["composite"]["after"] = composite["after_key"]
+
+    app.logger.info("loaded %d user rule tags" % len(counts))
+    tags = sorted(counts.items(), key=lambda tag: (-tag[1], tag[0]))
+    return {
+        "tags": [{"key": key, "count": count} for key, count in tags],
+        "keys": sorted(counts),
+        "counts": counts,
+    }
+
+
+def get_rule_tags(prefix=None, size=None):
+    """
+    Return the tags of all user rules (cached until a rule write) as [{key, count}],
+    most used first
+    @param prefix - only tags starting with prefix (autocomplete)
+    @param size - max number of tags
+    """
+    if tags_staleness.changed():
+        invalidate_rule_tags()
+    tags = tags_cache.get_or_load("tags", compute_rule_tags)
+    if not prefix:
+        return tags["tags"][:size]
+
+    # tags with the prefix are a contiguous range of the sorted keys
+    keys = tags["keys"]
+    matches = []
+    for i in range(bisect.bisect_left(keys, prefix), len(keys)):
+        if not keys[i].startswith(prefix):
+            break
+        matches.append({"key": keys[i], "count": tags["counts"][keys[i]]})
+    matches.sort(key=lambda tag: (-tag["count"], tag["key"]))
+    return matches[:size]
+
+
+def invalidate_rule_tags():
+    """drop the cached user rule tags after a rule is created, changed or deleted"""
+    tags_cache.pop("tags")
+
+
+def parse_rule_query(query_string):
+    """Return the ES query of a rule's query_string (a query clause or a search body)"""
+    query = json.loads(query_string)
+    if isinstance(query, dict) and "query" in query:
+        query = query["query"]
+    return query
+
+
+def percolator_doc(rule):
+    """Percolator document of a user rule (_source)"""
+    doc = {
+        "query": parse_rule_query(rule["query_string"]),
+        "rule": {field: rule.get(field) for field in PERCOLATOR_RULE_FIELDS},
+    }
+    doc["rule"]["enabled"] = rule.get("enabled", True) is not False
+    return doc
+
+
+def create_percolator_index():
+    """
+    Create the percolator index with the field mappings of the documents rules are
+    matched against (job status), then register all existing rules
+    """
+    properties = {}
+    mappings = mozart_es.es.indices.get_mapping(index=JOB_STATUS_INDEX)
+    for index in sorted(mappings):  # latest rollover index wins
+        properties.update(mappings[index]["mappings"].get("properties", {}))
+
+    properties["query"] = {"type": "percolator"}
+    properties["rule"] = {
+        "properties": {
+            "rule_name": {"type": "keyword"},
+            "workflow": {"type": "keyword"},
+            "job_spec": {"type": "keyword"},
+            "queue": {"type": "keyword"},
+            "priority": {"type": "long"},
+            "enabled": {"type": "boolean"},
+        }
+    }
+    body = {
+        "settings": {"index.percolator.map_unmapped_fields_as_text": True},
+        "mappings": {"properties": properties},
+    }
+    mozart_es.es.indices.create(index=PERCOLATOR_INDEX, body=body, ignore=400)
+    rebuild_percolator()
+
+
+def ensure_percolator_index():
+    """Return True if the percolator is enabled, creating its index on first use"""
+    if not PERCOLATOR_ENABLED:
+        return False
+    if _percolator_ready.is_set():
+        return True
+    with _percolator_lock:
+        if not _percolator_ready.is_set():
+            if not mozart_es.es.indices.exists(index=PERCOLATOR_INDEX):
+                create_percolator_index()
+            _percolator_ready.set()
+    return True
+
+
+def rebuild_percolator():
+    """Register every user rule in the percolator index with bulk requests"""
+    actions = []
+    body = {"query": {"match_all": {}}, "sort": [{"_id": {"order": "asc"}}]}
+    for rule in iter_search_after(USER_RULES_INDEX, body):
+        try:
+            doc = percolator_doc(rule["_source"])
+        except (ValueError, KeyError, TypeError) as e:
+            app.logger.warning("skipping user rule %s: %s" % (rule["_id"], str(e)))
+            continue
+        actions.append({"index": {"_index": PERCOLATOR_INDEX, "_id": rule["_id"]}})
+        actions.append(doc)
+        if len(actions) >= 1000:
+            mozart_es.es.bulk(body=actions)
+            actions = []
+    if actions:
+        mozart_es.es.bulk(body=actions)
+    mozart_es.es.indices.refresh(index=PERCOLATOR_INDEX)
+
+
+def sync_rule_percolator(_id, rule=None):
+    """
+    Register (or update) a user rule in the percolator index after a write; rules
+    that no longer exist or have an invalid query are removed from it
+    @param _id - user rule id
+    @param rule - the rule's _source, fetched if not given
+    """
+    if not PERCOLATOR_ENABLED:
+        return
+    try:
+        ensure_percolator_index()
+        if rule is None:
+            doc = mozart_es.get_by_id(index=USER_RULES_INDEX, id=_id, ignore=404)
+            if doc.get("found", False) is False:
+                delete_rule_percolator(_id)
+                return
+            rule = doc["_source"]
+        mozart_es.index_document(
+            index=PERCOLATOR_INDEX, body=percolator_doc(rule), id=_id, refresh=True
+        )
+    except (ValueError, KeyError, TypeError, RequestError) as e:
+        app.logger.warning("user rule %s not percolated: %s" % (_id, str(e)))
+        delete_rule_percolator(_id)
+    except Exception as e:  # the rule write itself succeeded, don't fail the request
+        app.logger.error("failed to percolate user rule %s: %s" % (_id, str(e)))
+
+
+def sync_rules_percolator(ids):
+    """Re-register a batch of user rules in the percolator index after a bulk write"""
+    if not PERCOLATOR_ENABLED or not ids:
+        return
+    try:
+        ensure_percolator_index()
+        docs = mozart_es.es.mget(index=USER_RULES_INDEX, body={"ids": ids})["docs"]
+        actions = []
+        for doc in docs:
+            if doc.get("found", False) is False:
+                actions.append(
+                    {"delete": {"_index": PERCOLATOR_INDEX, "_id": doc["_id"]}}
+                )
+                continue
+            try:
+                source = percolator_doc(doc["_source"])
+            except (ValueError, KeyError, TypeError) as e:
+                app.logger.warning("user rule %s not percolated: %s" % (doc["_id"], e))
+                continue
+            actions.append({"index": {"_index": PERCOLATOR_INDEX, "_id": doc["_id"]}})
+            actions.append(source)
+        if actions:
+            mozart_es.es.bulk(body=actions, refresh=True)
+    except Exception as e:
+        app.logger.error("failed to percolate user rules: %s" % str(e))
+
+
+def delete_rule_percolator(_id=None, rule_name=None):
+    """Remove a user rule (by id or rule_name) from the percolator index"""
+    if not PERCOLATOR_ENABLED:
+        return
+    try:
+        ensure_percolator_index()
+        if _id is not None:
+            mozart_es.delete_by_id(
+                index=PERCOLATOR_INDEX, id=_id, refresh=True, ignore=404
+            )
+        else:
+            query = {"query": {"term": {"rule.rule_name": rule_name}}}
+            mozart_es.es.delete_by_query(
+                index=PERCOLATOR_INDEX, body=query, refresh=True, ignore=404
+            )
+    except Exception as e:
+        app.logger.error(
+            "failed to remove user rule %s from percolator: %s"
+            % (_id or rule_name, str(e))
+        )
+
+
+def match_rules(documents):
+    """
+    Find the enabled user rules matching each document with one percolate query
+    @param documents - list of documents (dicts)
+    @return: list (one entry per document) of lists of {"id": ..., <rule fields>}
+    """
+    matches = [[] for _ in documents]
+    body = {
+        "_source": ["rule"],
+        "query": {
+            "bool": {
+                "filter": [
+                    {"percolate": {"field": "query", "documents": documents}},
+                    {"term": {"rule.enabled": True}},
+                ]
+            }
+        },
+        "sort": [{"_id": {"order": "asc"}}],
+    }
+    for hit in iter_search_after(PERCOLATOR_INDEX, body):
+        rule = {"id": hit["_id"], **hit["_source"]["rule"]}
+        slots = hit.get("fields", {}).get("_percolator_document_slot", [0])
+        for slot in slots:
+            matches[slot].append(rule)
+    return matches
+
+
+def dry_run_rule(query_string, query_all=False):
+    """
+    Validate a rule's query and estimate its reach without enabling it: the query is
+    checked with _validate/query, then counted and sampled on DRY_RUN_INDEX within
+    DRY_RUN_TIMEOUT seconds; results are cached by query hash
+    @param query_string - the rule's query_string (JSON)
+    @param query_all - whether the rule submits one job for all matches
+    @return: dict with valid, error, count, estimated_jobs, sample and timed_out;
+    count is None if the query timed out or ES failed
+    @raise ValueError: if query_string is not JSON
+    """
+    query = parse_rule_query(query_string)
+    key = hashlib.sha256(
+        json.dumps([DRY_RUN_INDEX, query], sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+    def load():
+        validation = mozart_es.es.indices.validate_query(
+            index=DRY_RUN_INDEX,
+            body={"query": query},
+            explain=True,
+            request_timeout=DRY_RUN_TIMEOUT,
+        )
+        if not validation["valid"]:
+            errors = [
+                e["error"] for e in validation.get("explanations", []) if "error" in e
+            ]
+            return {
+                "valid": False,
+                "error": "; ".join(errors) or validation.get("error", "invalid query"),
+                "count": None,
+                "sample": [],
+                "timed_out": False,
+            }
+
+        count = mozart_es.es.count(
+            index=DRY_RUN_INDEX,
+            body={"query": query},
+            request_timeout=DRY_RUN_TIMEOUT,
+        )["count"]
+        sample = mozart_es.es.search(
+            index=DRY_RUN_INDEX,
+            body={
+                "size": DRY_RUN_SAMPLE_SIZE,
+                "timeout": "%ds" % DRY_RUN_TIMEOUT,
+                "_source": ["@timestamp", "status", "type", "job.type"],
+                "query": {"function_score": {"query": query, "random_score": {}}},
+            },
+            request_timeout=DRY_RUN_TIMEOUT,
+        )
+        return {
+            "valid": True,
+            "error": None,
+            "count": count,
+            "sample": [
+                {"_id": hit["_id"], **hit["_source"]} for hit in sample["hits"]["hits"]
+            ],
+            "timed_out": sample["timed_out"],
+        }
+
+    # failures are returned, not cached
+    try:
+        result = dict(dry_run_cache.get_or_load(key, load))
+    except ConnectionTimeout:
+        result = {
+            "valid": True,
+            "error": "query did not finish within %ds" % DRY_RUN_TIMEOUT,
+            "count": None,
+            "sample": [],
+            "timed_out": True,
+        }
+    except RequestError as e:  # rejected by ES, e.g. a query that fails to parse
+        result = {
+            "valid": False,
+            "error": str(e.info or e.error),
+            "count": None,
+            "sample": [],
+            "timed_out": False,
+        }
+    except TransportError as e:
+        app.logger.warning("user rule dry-run failed: %s" % str(e))
+        result = {
+            "valid": True,
+            "error": "query failed: %s" % str(e),
+            "count": None,
+            "sample": [],
+            "timed_out": False,
+        }
+    if result["count"] is None:
+        result["estimated_jobs"] = None
+    elif query_all:
+        result["estimated_jobs"] = min(result["count"], 1)
+    else:
+        result["estimated_jobs"] = result["count"]
+    result["index"] = DRY_RUN_INDEX
+    return result
+
+
+# fields bulk rule updates may change, with their validation
+def _is_int(value):
+    """True for ints, but not bools (which are ints too)"""
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _time_limit(value):
+    if value is not None and (not _is_int(value) or not 0 < value <= 86400 * 7):
+        raise ValueError("must be an int between 0 and 604800 (sec)")
+    return value
+
+
+def _priority(value):
+    if not _is_int(value) or not 0 <= value <= 9:
+        raise ValueError("must be an int between 0 and 9")
+    return value
+
+
+def _enabled(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.lower() in ("true", "false"):
+        return value.lower() == "true"
+    raise ValueError("must be true or false")
+
+
+def _queue(value):
+    if not isinstance(value, str) or not value:
+        raise ValueError("must be a queue name")
+    return value
+
+
+BULK_UPDATE_FIELDS = {
+    "enabled": _enabled,
+    "queue": _queue,
+    "priority": _priority,
+    "time_limit": _time_limit,
+    "soft_time_limit": _time_limit,
+}
+
+# sets the changed fields and modified_time, rules already up to date are a noop;
+# numbers are compared by value as the source and params may box them differently
+BULK_UPDATE_SCRIPT = """
+boolean changed = false;
+for (entry in params.doc.entrySet()) {
+  def current = ctx._source[entry.getKey()];
+  def value = entry.getValue();
+  boolean same;
+  if (current instanceof Number && value instanceof Number) {
+    same = ((Number) current).doubleValue() == ((Number) value).doubleValue();
+  } else {
+    same = Objects.equals(current, value);
+  }
+  if (!same) {
+    ctx._source[entry.getKey()] = value;
+    changed = true;
+  }
+}
+if (changed) {
+  ctx._source.modified_time = params.now;
+} else {
+  ctx.op = 'noop';
+}
+"""
+
+
+def select_rules_query(ids=None, tag=None, rule_name=None):
+    """
+    Query selecting user rules by ids, tag and/or rule_name wildcard pattern
+    @raise ValueError: if no selector is given
+    """
+    filters = []
+    if ids:
+        filters.append({"ids": {"values": ids}})
+    if tag:
+        filters.append({"term": {"tags": tag}})
+    if rule_name:
+        filters.append({"wildcard": {"rule_name": {"value": rule_name}}})
+    if not filters:
+        raise ValueError("Must select rules by ids, tag or rule_name pattern")
+    return {"bool": {"filter": filters}}
+
+
+def bulk_update_rules(updates, ids=None, tag=None, rule_name=None, max_rules=5000):
+    """
+    Apply the same field changes to all selected user rules with one _bulk request
+    and a single refresh
+    @param updates - dict of BULK_UPDATE_FIELDS -> new value
+    @param ids, tag, rule_name - rule selectors (see select_rules_query)
+    @return: dict of matched, updated, noop counts and per rule results
+    @raise ValueError: on invalid updates or selectors, or too many selected rules
+    """
+    doc = {}
+    for field, value in updates.items():
+        if field not in BULK_UPDATE_FIELDS:
+            raise ValueError(
+                "%s can't be changed in bulk, only %s"
+                % (field, ", ".join(BULK_UPDATE_FIELDS))
+            )
+        try:
+            doc[field] = BULK_UPDATE_FIELDS[field](value)
+        except (ValueError, TypeError) as e:
+            raise ValueError("invalid %s: %s" % (field, str(e)))
+    if not doc:
+        raise ValueError("no updates given")
+    now = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    params = {"doc": doc, "now": now}
+
+    body = {
+        "_source": ["rule_name"],
+        "query": select_rules_query(ids, tag, rule_name),
+        "sort": [{"_id": {"order": "asc"}}],
+    }
+    rules = {}
+    for hit in iter_search_after(USER_RULES_INDEX, body):
+        rules[hit["_id"]] = hit["_source"].get("rule_name")
+        if len(rules) > max_rules:
+            raise ValueError("more than %d rules selected" % max_rules)
+
+    results = [
+        {"id": _id, "result": "not_found"} for _id in ids or [] if _id not in rules
+    ]
+    counts = {"matched": len(rules), "updated": 0, "noop": 0, "failed": 0}
+    if rules:
+        actions = []
+        for _id in rules:
+            actions.append({"update": {"_index": USER_RULES_INDEX, "_id": _id}})
+            actions.append({"script": {"source": BULK_UPDATE_SCRIPT, "params": params}})
+        response = mozart_es.es.bulk(body=actions, refresh=True)
+        for (_id, name), item in zip(rules.items(), response["items"]):
+            item = item["update"]
+            if item.get("error") is not None:
+                counts["failed"] += 1
+                results.append(
+                    {
+                        "id": _id,
+                        "rule_name": name,
+                        "result": "failed",
+                        "error": str(item["error"]),
+                    }
+                )
+                continue
+            counts["updated" if item["result"] == "updated" else "noop"] += 1
+            results.append({"id": _id, "rule_name": name, "result": item["result"]})
+        sync_rules_percolator(
+            [r["id"] for r in results if r["result"] == "updated"]
+        )
+
+    app.logger.info(
+        "bulk updated user rules %s: %s" % (", ".join(sorted(doc)), counts)
+    )
+    return {**counts, "updates": doc, "results": results}
@@ -0,0 +1,204 @@
+from future import standard_library
+
+standard_library.install_aliases()
+
+import io
+import json
+import hashlib
+import tarfile
+
+from mozart import app, mozart_es
+from mozart.lib.pagination import iter_search_after
+from mozart.lib.registry import (
+    job_spec_registry,
+    hysds_io_registry,
+    container_registry,
+)
+
+
+# spec type -> (index, registry)
+SPEC_TYPES = {
+    "job_spec": (app.config["JOB_SPECS_INDEX"], job_spec_registry),
+    "hysds_io": (app.config["HYSDS_IOS_INDEX"], hysds_io_registry),
+    "container": (app.config["CONTAINERS_INDEX"], container_registry),
+}
+
+# file name prefixes used for specs in HySDS package repos (docker/job-spec.json.<name>)
+FILE_PREFIXES = {"job-spec.json": "job_spec", "hysds-io.json": "hysds_io"}
+
+# fields a container spec must have, as required by POST /container/add
+CONTAINER_FIELDS = ("id", "url", "version", "digest")
+
+# tarball members larger than this (bytes) are rejected instead of read into memory
+MAX_MEMBER_SIZE = app.config.get("SPEC_IMPORT_MAX_MEMBER_SIZE", 16 * 1024 * 1024)
+
+
+def spec_hash(spec):
+    """content hash of a spec, independent of key order"""
+    return hashlib.sha256(
+        json.dumps(spec, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    ).hexdigest()
+
+
+def validate_spec(spec_type, spec):
+    """
+    Check a spec the same way the single spec POST endpoints do
+    @raise ValueError: if the spec is invalid
+    """
+    if spec_type not in SPEC_TYPES:
+        raise ValueError("unknown spec type: %s" % spec_type)
+    if not isinstance(spec, dict) or not spec.get("id"):
+        raise ValueError("%s without id" % spec_type)
+    if spec_type == "container":
+        missing = [field for field in CONTAINER_FIELDS if not spec.get(field)]
+        if missing:
+            raise ValueError(
+                "container %s missing: %s" % (spec["id"], ", ".join(missing))
+            )
+
+
+def parse_ndjson(lines):
+    """
+    Parse NDJSON bundle lines ({"type": "job_spec", "spec": {...}} each)
+    @return: (list of (type, spec), list of errors)
+    """
+    records, errors = [], []
+    for i, line in enumerate(lines, 1):
+        try:
+            if isinstance(line, bytes):
+                line = line.decode("utf-8")
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            records.append((record["type"], record["spec"]))
+        except (UnicodeDecodeError, ValueError, KeyError, TypeError) as e:
+            errors.append("line %d: %s" % (i, str(e)))
+    return records, errors
+
+
+def spec_type_of(name):
+    """type of a tarball member from its directory (job_spec/...) or file name"""
+    parts = name.split("/")
+    for part in parts[:-1]:
+        if part in SPEC_TYPES:
+            return part
+    basename = parts[-1]
+    for prefix, spec_type in FILE_PREFIXES.items():
+        if basename.startswith(prefix):
+            return spec_type
+    return None
+
+
+def parse_tarball(data):
+    """
+    Parse a (compressed) tarball of NDJSON bundles and/or single spec JSON files, typed
+    by their directory (job_spec/, hysds_io/, container/) or job-spec.json.* /
+    hysds-io.json.* file names
+    @return: (list of (type, spec), list of errors)
+    """
+    records, errors = [], []
+    with tarfile.open(fileobj=io.BytesIO(data), mode="r:*") as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            if member.size > MAX_MEMBER_SIZE:
+                errors.append(
+                    "%s: %d bytes, larger than the limit of %d"
+                    % (member.name, member.size, MAX_MEMBER_SIZE)
+                )
+                continue
+            content = tar.extractfile(member).read()
+            if member.name.endswith(".ndjson"):
+                member_records, member_errors = parse_ndjson(content.splitlines())
+                records.extend(member_records)
+                errors.extend("%s: %s" % (member.name, e) for e in member_errors)
+                continue
+
+            spec_type = spec_type_of(member.name)
+            if spec_type is None:
+                if member.name.endswith(".json"):
+                    errors.append("%s: unknown spec type" % member.name)
+                continue
+            try:
+                records.append((spec_type, json.loads(content)))
+            except ValueError as e:
+                errors.append("%s: %s" % (member.name, str(e)))
+    return records, errors
+
+
+def parse_bundle(data):
+    """Parse an NDJSON or tarball bundle (bytes)"""
+    if tarfile.is_tarfile(io.BytesIO(data)):
+        return parse_tarball(data)
+    return parse_ndjson(data.splitlines())
+
+
+def import_specs(records):
+    """
+    Write specs with a single _bulk request, skipping those whose content is unchanged
+    @param records - list of (type, spec); invalid specs (see validate_spec) are skipped
+    @return: dict of created, updated and unchanged counts and errors
+    """
+    result = {"created": 0, "updated": 0, "unchanged": 0, "errors": []}
+
+    # last occurrence wins if a bundle has a spec more than once
+    specs = {}
+    for spec_type, spec in records:
+        try:
+            validate_spec(spec_type, spec)
+        except ValueError as e:
+            result["errors"].append(str(e))
+            continue
+        specs[(spec_type, spec["id"])] = spec
+
+    actions, changed = [], []
+    for spec_type, (index, _) in SPEC_TYPES.items():
+        ids = [_id for (t, _id) in specs if t == spec_type]
+        if not ids:
+            continue
+        existing = mozart_es.es.mget(index=index, body={"ids": ids})
+        hashes = {
+            doc["_id"]: spec_hash(doc["_source"])
+            for doc in existing["docs"]
+            if doc.get("found", False) is True
+        }
+        for _id in ids:
+            spec = specs[(spec_type, _id)]
+            if hashes.get(_id) == spec_hash(spec):
+                result["unchanged"] += 1
+                continue
+            actions.append({"index": {"_index": index, "_id": _id}})
+            actions.append(spec)
+            changed.append((spec_type, _id))
+
+    if actions:
+        response = mozart_es.es.bulk(body=actions, refresh="wait_for")
+        for (spec_type, _id), item in zip(changed, response["items"]):
+            item = item["index"]
+            if item.get("error") is not None:
+                result["errors"].append("%s %s: %s" % (spec_type, _id, item["error"]))
+            elif item["result"] == "created":
+                result["created"] += 1
+            else:
+                result["updated"] += 1
+            SPEC_TYPES[spec_type][1].invalidate(_id)
+
+    app.logger.info(
+        "imported specs: %d created, %d updated, %d unchanged, %d errors"
+        % (
+            result["created"],
+            result["updated"],
+            result["unchanged"],
+            len(result["errors"]),
+        )
+    )
+    return result
+
+
+def export_specs(spec_types=None):
+    """Generator of NDJSON bundle lines of all specs of the given types (default all)"""
+    for spec_type in spec_types or SPEC_TYPES:
+        index = SPEC_TYPES[spec_type][0]
+        body = {"query": {"match_all": {}}, "sort": [{"_id": {"order": "asc"}}]}
+        for doc in iter_search_after(index, body):
+            yield json.dumps({"type": spec_type, "spec": doc["_source"]}) + "\n"
@@ -0,0 +1,221 @@
+from future import standard_library
+
+standard_library.install_aliases()
+
+import time
+import shlex
+import threading
+from contextlib import contextmanager
+
+import paramiko
+
+from mozart import app
+
+
+SSH_POOL_SIZE = app.config.get("SSH_POOL_SIZE", 2)
+SSH_IDLE_TIMEOUT = app.config.get("SSH_IDLE_TIMEOUT", 300)
+SSH_CONNECT_TIMEOUT = app.config.get("SSH_CONNECT_TIMEOUT", 10)
+SSH_COMMAND_TIMEOUT = app.config.get("SSH_COMMAND_TIMEOUT", 60)
+
+SECTION_MARKER = "@@mozart-section:"
+
+# commands for the node stats, run in one session with a marker before each output
+NODE_STATS_COMMANDS = {
+    "date": "TZ='America/Los_Angeles' date",
+    "cpu": "mpstat -P ALL 1 1",
+    "memory": "free",
+    "top": "top -n 1 -b",
+}
+# sections run with sudo, as the fabric helpers did; date runs unprivileged
+NODE_STATS_SUDO = ("cpu", "memory", "top")
+
+
+def sudo_command(command):
+    """Wrap a command to run with passwordless sudo in a login shell"""
+    return "sudo -n /bin/bash -l -c %s" % shlex.quote(command)
+
+
+class SSHConnectionPool:
+    """
+    Thread-safe pool of persistent SSH connections keyed by user and host; at most
+    max_per_host commands run concurrently on a host and connections idle for longer
+    than idle_timeout seconds are closed instead of reused.
+    @param key_filename - private key file
+    @param max_per_host - max open connections per user and host
+    @param idle_timeout - seconds an idle connection is kept open
+    """
+
+    def __init__(self, key_filename, max_per_host=2, idle_timeout=300):
+        self.key_filename = key_filename
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self._idle = {}  # (user, host) -> [(last used, client)]
+        self._slots = {}  # (user, host) -> semaphore
+        self._lock = threading.Lock()
+
+    def _connect(self, user, host):
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect(
+            host,
+            username=user,
+            key_filename=self.key_filename,
+            timeout=SSH_CONNECT_TIMEOUT,
+        )
+        return client
+
+    def _checkout(self, key):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            while idle:
+                last_used, client = idle.pop()
+                transport = client.get_transport()
+                if time.time() - last_used < self.idle_timeout and (
+                    transport is not None and transport.is_active()
+                ):
+                    return client
+                client.close()
+        return None
+
+    @contextmanager
+    def connection(self, user, host):
+        """Borrow a connection to user@host, opening one if none is idle"""
+        key = (user, host)
+        with self._lock:
+            slots = self._slots.setdefault(
+                key, threading.BoundedSemaphore(self.max_per_host)
+            )
+
+        with slots:
+            client = self._checkout(key) or self._connect(user, host)
+            try:
+                yield client
+            except BaseException:
+                client.close()  # state of the session is unknown, don't reuse it
+                raise
+            with self._lock:
+                self._idle[key].append((time.time(), client))
+
+    def run(self, user, host, command, sudo=False, timeout=SSH_COMMAND_TIMEOUT):
+        """
+        Run a command on user@host
+        @return: stdout of the command
+        @raise RuntimeError: if the command exits with a non-zero status
+        """
+        if sudo:
+            command = sudo_command(command)
+        with self.connection(user, host) as client:
+            _, stdout, stderr = client.exec_command(command, timeout=timeout)
+            output = stdout.read().decode("utf-8", "replace")
+            error = stderr.read().decode("utf-8", "replace")
+            status = stdout.channel.recv_exit_status()
+        if status != 0:
+            raise RuntimeError(
+                "'%s' on %s@%s exited with status %d: %s"
+                % (command, user, host, status, error.strip())
+            )
+        return output
+
+    def close(self):
+        """Close all idle connections"""
+        with self._lock:
+            for idle in self._idle.values():
+                for _, client in idle:
+                    client.close()
+            self._idle.clear()
+
+
+class FakeSSHRunner:
+    """
+    In-process stand-in for SSHConnectionPool (see set_ssh_runner) that returns canned
+    output for each command and records the calls made.
+    @param outputs - dict of command -> output, or a callable(user, host, command)
+    """
+
+    def __init__(self, outputs):
+        self.outputs = outputs
+        self.calls = []
+
+    def run(self, user, host, command, sudo=False, timeout=SSH_COMMAND_TIMEOUT):
+        self.calls.append((user, host, command, sudo))
+        if callable(self.outputs):
+            return self.outputs(user, host, command)
+        if command not in self.outputs:
+            raise RuntimeError(
+                "'%s' on %s@%s: command not found" % (command, user, host)
+            )
+        return self.outputs[command]
+
+    def close(self):
+        pass
+
+
+ssh_runner = SSHConnectionPool(
+    app.config.get("KEY_FILENAME"),
+    max_per_host=SSH_POOL_SIZE,
+    idle_timeout=SSH_IDLE_TIMEOUT,
+)
+
+
+def set_ssh_runner(runner):
+    """Replace the runner used for node commands, returns the previous one"""
+    global ssh_runner
+    previous, ssh_runner = ssh_runner, runner
+    return previous
+
+
+def mpstat(user, host):
+    """Return mpstat for host."""
+    return ssh_runner.run(user, host, NODE_STATS_COMMANDS["cpu"], sudo=True)
+
+
+def mem_free(user, host):
+    """Return free for host."""
+    return ssh_runner.run(user, host, NODE_STATS_COMMANDS["memory"], sudo=True)
+
+
+def get_node_user(node):
+    """Return the user to ssh to a node as."""
+    if node == app.config["PUCCINI_HOST"]:
+        return app.config["PUCCINI_USER"]
+    return app.config["EXECUTE_NODE_USER"]
+
+
+def node_stats_command(commands=NODE_STATS_COMMANDS, sudo=()):
+    """
+    One command printing the output of every command after a marker line
+    @param sudo - names of the commands to run with sudo
+    """
+    return "; ".join(
+        "echo '%s%s'; %s"
+        % (SECTION_MARKER, name, sudo_command(command) if name in sudo else command)
+        for name, command in commands.items()
+    )
+
+
+def parse_sections(output):
+    """Split the output of node_stats_command() into {section name: output}"""
+    sections = {}
+    name = None
+    for line in output.splitlines(True):
+        if line.startswith(SECTION_MARKER):
+            name = line[len(SECTION_MARKER) :].strip()
+            sections[name] = ""
+        elif name is not None:
+            sections[name] += line
+    return {name: section.rstrip("\n") for name, section in sections.items()}
+
+
+def get_node_stats(user, host):
+    """
+    Return the date, cpu (mpstat), memory (free) and top output of a node using a
+    single command over a pooled connection
+    """
+    output = ssh_runner.run(user, host, node_stats_command(sudo=NODE_STATS_SUDO))
+    sections = parse_sections(output)
+    missing = [name for name in NODE_STATS_COMMANDS if name not in sections]
+    if missing:
+        raise RuntimeError(
+            "missing %s in stats output of %s" % (", ".join(missing), host)
+        )
+    return sections
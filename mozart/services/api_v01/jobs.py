@@ -5,7 +5,7 @@ standard_library.install_aliases()
 import json
 import traceback
 
-from flask import request
+from flask import request, Response, stream_with_context
 from flask_restx import Namespace, Resource, fields, inputs
 
 from hysds.celery import app as celery_app
@@ -15,6 +15,9 @@ from hysds_commons.action_utils import check_passthrough_query
 
 from mozart import app, mozart_es
 import mozart.lib.queue_utils
+from mozart.lib.job_utils import find_job_status, find_job_info, stream_job_list
+from mozart.lib.registry import job_spec_registry, hysds_io_registry
+from mozart.lib.pagination import search_after_page, iter_search_after
 
 
 JOB_NS = "job"
@@ -33,6 +36,8 @@ JOB_SPECS_INDEX = app.config["JOB_SPECS_INDEX"]
 JOB_STATUS_INDEX = app.config["JOB_STATUS_INDEX"]
 CONTAINERS_INDEX = app.config["CONTAINERS_INDEX"]
 
+JOB_LIST_MAX_PAGE_SIZE = app.config.get("JOB_LIST_MAX_PAGE_SIZE", 10000)
+
 
 @job_ns.route("/list", endpoint="job-list")
 @job_ns.doc(
@@ -56,26 +61,105 @@ class GetJobs(Resource):
             "result": fields.List(
                 fields.String, required=True, description="list of job IDs"
             ),
+            "next": fields.String(
+                description="cursor for the next page; null on the last page"
+            ),
         },
     )
     parser = job_ns.parser()
     parser.add_argument("page_size", type=str, help="Job Listing Pagination Size")
     parser.add_argument("offset", type=str, help="Job Listing Pagination Offset")
+    parser.add_argument(
+        "cursor",
+        required=False,
+        type=str,
+        help="continuation token returned as 'next' by the previous page",
+    )
+    parser.add_argument(
+        "pit",
+        required=False,
+        type=inputs.boolean,
+        help="bind the listing to an ES point-in-time for a consistent view",
+    )
+    parser.add_argument(
+        "stream",
+        required=False,
+        type=inputs.boolean,
+        help="stream every job ID as NDJSON instead of a single page",
+    )
 
-    @job_ns.marshal_with(resp_model)
+    @job_ns.expect(parser)
+    @job_ns.response(200, "Success", resp_model)
     def get(self):
         """Paginated list submitted jobs"""
-        jobs = mozart_es.query(index=JOB_STATUS_INDEX, _source=False)
+        page_size = request.args.get("page_size")
+        offset = request.args.get("offset")
+        cursor = request.args.get("cursor")
+
+        try:
+            pit = inputs.boolean(request.args.get("pit", False))
+            stream = inputs.boolean(request.args.get("stream", False))
+        except ValueError as e:
+            return {"success": False, "message": str(e)}, 400
+        try:
+            if page_size:
+                page_size = min(int(page_size), JOB_LIST_MAX_PAGE_SIZE)
+            if offset:
+                offset = int(offset)
+        except (ValueError, TypeError):
+            return {
+                "success": False,
+                "message": "page_size and offset must be ints",
+            }, 400
+
+        query = {"_source": False, "sort": [{"_id": {"order": "asc"}}]}
+        if stream is True:
+            jobs = iter_search_after(
+                JOB_STATUS_INDEX, query, page_size=JOB_LIST_MAX_PAGE_SIZE, pit=True
+            )
+            ndjson = (json.dumps({"id": job["_id"]}) + "\n" for job in jobs)
+            return Response(
+                stream_with_context(ndjson), mimetype="application/x-ndjson"
+            )
+
+        if not page_size and not cursor:
+            # unpaginated listing, kept for older clients: the same JSON document,
+            # streamed a page of hits at a time instead of built in memory
+            jobs = iter_search_after(
+                JOB_STATUS_INDEX, query, page_size=JOB_LIST_MAX_PAGE_SIZE
+            )
+            return Response(
+                stream_with_context(stream_job_list(jobs)),
+                mimetype="application/json",
+            )
+
+        if offset and not cursor:
+            query["from"] = offset
+        try:
+            jobs, next_cursor = search_after_page(
+                JOB_STATUS_INDEX,
+                query,
+                page_size or JOB_LIST_MAX_PAGE_SIZE,
+                cursor=cursor,
+                pit=pit,
+            )
+        except ValueError as e:
+            return {"success": False, "message": str(e)}, 400
         return {
             "success": True,
             "message": "",
-            "result": sorted([job["_id"] for job in jobs]),
+            "result": [job["_id"] for job in jobs],
+            "next": next_cursor,
         }
 
 
 @job_ns.route("/user/<user>", endpoint="user-jobs")
 @job_ns.doc(
-    responses={200: "Success", 500: "Query execution failed"},
+    responses={
+        200: "Success",
+        400: "Invalid parameters",
+        500: "Query execution failed",
+    },
     description="Get list of user submitted job IDs",
 )
 class UserJobs(Resource):
@@ -112,11 +196,24 @@ class UserJobs(Resource):
         help="job status, ie. job-queued, job-started, job-completed, " "job-failed",
         required=False,
     )
+    parser.add_argument(
+        "cursor",
+        type=str,
+        help="continuation token returned as 'next' by the previous page",
+        required=False,
+    )
+    parser.add_argument(
+        "pit",
+        type=inputs.boolean,
+        help="bind paging to an ES point-in-time (consistent while jobs are added)",
+        required=False,
+    )
 
     @job_ns.expect(parser)
     def get(self, user):
         """
         return user submitted jobs from ElasticSearch (sorted by @timestamp desc)
+        pass the returned "next" token as cursor to fetch the following page
         """
         offset = request.args.get("offset")
         page_size = request.args.get("page_size")
@@ -127,6 +224,12 @@ class UserJobs(Resource):
         start_time = request.args.get("start_time")
         end_time = request.args.get("end_time")
         status = request.args.get("status")
+        cursor = request.args.get("cursor")
+
+        try:
+            pit = inputs.boolean(request.args.get("pit", False))
+        except ValueError as e:
+            return {"success": False, "message": str(e)}, 400
 
         if offset:
             try:
@@ -149,14 +252,12 @@ class UserJobs(Resource):
                 return {"success": False, "message": "priority must be an int"}, 400
 
         query = {
-            "sort": [{"@timestamp": {"order": "desc"}}],
+            "sort": [{"@timestamp": {"order": "desc"}}, {"_id": {"order": "asc"}}],
             "query": {"bool": {"must": [{"term": {"job.username": user}}]}},
         }
 
-        if offset:
+        if offset and not cursor:
             query["from"] = offset
-        if page_size:
-            query["size"] = page_size
         if tag:
             query["query"]["bool"]["must"].append({"term": {"tags.keyword": tag}})
         if job_type:
@@ -182,15 +283,26 @@ class UserJobs(Resource):
             query["query"]["bool"]["must"].append(datetime_filter)
 
         try:
-            res = mozart_es.search(index=JOB_STATUS_INDEX, body=query, _source=["tags"])
-        except Exception as e:
+            hits, next_cursor = search_after_page(
+                JOB_STATUS_INDEX,
+                query,
+                page_size or 250,
+                cursor=cursor,
+                pit=pit,
+                _source=["tags"],
+            )
+        except ValueError as e:  # malformed cursor
             return {"success": False, "message": str(e), "result": []}, 400
+        except Exception as e:
+            message = f"Failed to list jobs of {user}. {type(e)}:{str(e)}"
+            app.logger.error(message)
+            return {"success": False, "message": message, "result": []}, 500
         return {
             "success": True,
             "result": [
-                {"id": doc["_id"], "tags": doc["_source"]["tags"]}
-                for doc in res["hits"]["hits"]
+                {"id": doc["_id"], "tags": doc["_source"]["tags"]} for doc in hits
             ],
+            "next": next_cursor,
         }
 
 
@@ -461,17 +573,11 @@ class GetJobStatus(Resource):
         if _id is None:
             return {"success": False, "message": "id not supplied"}, 400
 
-        job_status = mozart_es.search_by_id(
-            index=JOB_STATUS_INDEX, id=_id, ignore=404, _source=["status"]
-        )
-        if job_status["found"] is False:
+        job_status = find_job_status(_id)
+        if job_status is None:
             return {"success": False, "message": "job status not found: %s" % _id}, 404
 
-        return {
-            "success": True,
-            "message": "",
-            "status": job_status["_source"]["status"],
-        }
+        return {"success": True, "message": "", "status": job_status}
 
 
 @job_ns.route("/info", endpoint="job-info")
@@ -510,11 +616,11 @@ class GetJobInfo(Resource):
                 "message": "id must be supplied (as query param or url param)",
             }, 400
 
-        info = mozart_es.search_by_id(index=JOB_STATUS_INDEX, id=_id, ignore=404)
-        if info["found"] is False:
+        info = find_job_info(_id)
+        if info is None:
             return {"success": False, "message": "job info not found: %s" % _id}, 404
 
-        return {"success": True, "message": "", "result": info["_source"]}
+        return {"success": True, "message": "", "result": info}
 
 
 @job_ns.route("/products/<_id>", endpoint="products")
@@ -684,12 +790,12 @@ class OnDemandJobs(Resource):
                 "message": "missing field: [tags, job_type, hysds_io, queue, query]",
             }, 400
 
-        doc = mozart_es.get_by_id(index=HYSDS_IOS_INDEX, id=hysds_io, ignore=404)
-        if doc["found"] is False:
+        doc = hysds_io_registry.get(hysds_io)
+        if doc is None:
             app.logger.error("failed to fetch %s, not found in hysds_ios" % hysds_io)
             return {"success": False, "message": "%s not found" % hysds_io}, 404
 
-        params = doc["_source"]["params"]
+        params = doc["params"]
         is_passthrough_query = check_passthrough_query(params)
 
         rule = {
@@ -792,8 +898,8 @@ class JobParams(Resource):
         job_params = hysds_io["_source"]["params"]
         job_params = list(filter(lambda x: x["from"] == "submitter", job_params))
 
-        job_spec = mozart_es.get_by_id(index=JOB_SPECS_INDEX, id=job_type, ignore=404)
-        if job_spec.get("found", False) is False:
+        job_spec = job_spec_registry.get(job_type)
+        if job_spec is None:
             return {
                 "success": False,
                 "message": "%s not found in job_specs" % job_type,
@@ -804,8 +910,8 @@ class JobParams(Resource):
             "submission_type": hysds_io["_source"].get("submission_type"),
             "hysds_io": hysds_io["_source"]["id"],
             "params": job_params,
-            "time_limit": job_spec["_source"]["time_limit"],
-            "soft_time_limit": job_spec["_source"]["soft_time_limit"],
-            "disk_usage": job_spec["_source"]["disk_usage"],
+            "time_limit": job_spec["time_limit"],
+            "soft_time_limit": job_spec["soft_time_limit"],
+            "disk_usage": job_spec["disk_usage"],
             "enable_dedup": hysds_io["_source"].get("enable_dedup", True),
         }
@@ -8,6 +8,13 @@ from flask import request
 from flask_restx import Namespace, Resource, fields
 
 from mozart import app, mozart_es
+from mozart.lib.registry import (
+    job_spec_registry,
+    hysds_io_registry,
+    container_registry,
+    conditional_get,
+    etag_header,
+)
 
 
 JOB_SPEC_NS = "job_spec"
@@ -51,13 +58,12 @@ class GetJobTypes(Resource):
         },
     )
 
+    @conditional_get
     @job_spec_ns.marshal_with(resp_model_job_types)
     def get(self):
         """Gets a list of Job Type specifications"""
-        query = {"query": {"match_all": {}}}
-        job_specs = mozart_es.query(index=JOB_SPECS_INDEX, body=query)
-        ids = [job_spec["_id"] for job_spec in job_specs]
-        return {"success": True, "message": "", "result": ids}
+        ids, etag = job_spec_registry.list_ids()
+        return {"success": True, "message": "", "result": ids}, 200, etag_header(etag)
 
 
 @job_spec_ns.route("/type", endpoint="job_spec-type")
@@ -86,6 +92,7 @@ class GetJobSpecType(Resource):
     parser.add_argument("id", required=True, type=str, help="Job Type ID")
 
     @job_spec_ns.expect(parser)
+    @conditional_get
     @job_spec_ns.marshal_with(resp_model)
     def get(self):
         """Gets a Job Type specification object for the given ID."""
@@ -93,19 +100,23 @@ class GetJobSpecType(Resource):
         if _id is None:
             return {"success": False, "message": "missing parameter: id"}, 400
 
-        job_spec = mozart_es.get_by_id(index=JOB_SPECS_INDEX, id=_id, ignore=404)
-        if job_spec["found"] is False:
+        job_spec = job_spec_registry.get_entry(_id)
+        if job_spec is None:
             app.logger.error("job_spec not found %s" % _id)
             return {
                 "success": False,
                 "message": "Failed to retrieve job_spec: %s" % _id,
             }, 404
 
-        return {
-            "success": True,
-            "message": "job spec for %s" % _id,
-            "result": job_spec["_source"],
-        }
+        return (
+            {
+                "success": True,
+                "message": "job spec for %s" % _id,
+                "result": job_spec["_source"],
+            },
+            200,
+            etag_header(job_spec["etag"]),
+        )
 
 
 @job_spec_ns.route("/add", endpoint="job_spec-add")
@@ -152,6 +163,7 @@ class AddJobSpecType(Resource):
             return {"success": False, "message": e}, 400
 
         mozart_es.index_document(index=JOB_SPECS_INDEX, body=obj, id=_id)
+        job_spec_registry.invalidate(_id)
         return {
             "success": True,
             "message": "job_spec {} added to index {}".format(_id, HYSDS_IOS_INDEX),
@@ -192,6 +204,7 @@ class RemoveJobSpecType(Resource):
             return {"success": False, "message": "id parameter not included"}, 400
 
         mozart_es.delete_by_id(index=JOB_SPECS_INDEX, id=_id)
+        job_spec_registry.invalidate(_id)
         app.logger.info(
             "Deleted job_spec {} from index: {}".format(_id, JOB_SPECS_INDEX)
         )
@@ -223,13 +236,12 @@ class GetContainerTypes(Resource):
         },
     )
 
+    @conditional_get
     @container_ns.marshal_with(resp_model_job_types)
     def get(self):
         """Get a list of containers managed by Mozart"""
-        containers = mozart_es.query(index=CONTAINERS_INDEX, _source=False)
-        ids = [container["_id"] for container in containers]
-
-        return {"success": True, "message": "", "result": ids}
+        ids, etag = container_registry.list_ids()
+        return {"success": True, "message": "", "result": ids}, 200, etag_header(etag)
 
 
 @container_ns.route("/add", endpoint="container-add")
@@ -278,6 +290,7 @@ class GetContainerAdd(Resource):
 
         container_obj = {"id": name, "digest": digest, "url": url, "version": version}
         mozart_es.index_document(index=CONTAINERS_INDEX, body=container_obj, id=name)
+        container_registry.invalidate(name)
 
         return {
             "success": True,
@@ -319,6 +332,7 @@ class GetContainerRemove(Resource):
             return {"success": False, "message": "id must be supplied"}, 400
 
         mozart_es.delete_by_id(index=CONTAINERS_INDEX, id=_id)
+        container_registry.invalidate(_id)
         app.logger.info(
             "Deleted container {} from index: {}".format(_id, CONTAINERS_INDEX)
         )
@@ -351,16 +365,21 @@ class GetContainerInfo(Resource):
     parser.add_argument("id", required=True, type=str, help="Container ID")
 
     @container_ns.expect(parser)
+    @conditional_get
     @container_ns.marshal_with(resp_model)
     def get(self):
         """Get information on container by ID"""
         _id = request.form.get("id", request.args.get("id", None))
 
-        container = mozart_es.get_by_id(index=CONTAINERS_INDEX, id=_id, ignore=404)
-        if container["found"] is False:
+        container = container_registry.get_entry(_id)
+        if container is None:
             return {"success": False, "message": ""}, 404
 
-        return {"success": True, "message": "", "result": container["_source"]}
+        return (
+            {"success": True, "message": "", "result": container["_source"]},
+            200,
+            etag_header(container["etag"]),
+        )
 
 
 @hysds_io_ns.route("/list", endpoint="hysds_io-list")
@@ -388,12 +407,12 @@ class GetHySDSIOTypes(Resource):
         },
     )
 
+    @conditional_get
     @container_ns.marshal_with(resp_model_job_types)
     def get(self):
         """List HySDS IO specifications"""
-        hysds_ios = mozart_es.query(index=HYSDS_IOS_INDEX, _source=False)
-        ids = [hysds_io["_id"] for hysds_io in hysds_ios]
-        return {"success": True, "message": "", "result": ids}
+        ids, etag = hysds_io_registry.list_ids()
+        return {"success": True, "message": "", "result": ids}, 200, etag_header(etag)
 
 
 @hysds_io_ns.route("/type", endpoint="hysds_io-type")
@@ -422,6 +441,7 @@ class GetHySDSIOType(Resource):
     parser.add_argument("id", required=True, type=str, help="HySDS IO Type ID")
 
     @hysds_io_ns.expect(parser)
+    @conditional_get
     @hysds_io_ns.marshal_with(resp_model)
     def get(self):
         """Gets a HySDS-IO specification by ID"""
@@ -429,11 +449,15 @@ class GetHySDSIOType(Resource):
         if _id is None:
             return {"success": False, "message": "missing parameter: id"}, 400
 
-        hysds_io = mozart_es.get_by_id(index=HYSDS_IOS_INDEX, id=_id, ignore=404)
-        if hysds_io["found"] is False:
+        hysds_io = hysds_io_registry.get_entry(_id)
+        if hysds_io is None:
             return {"success": False, "message": "hysds io not found: %s" % _id}, 404
 
-        return {"success": True, "message": "", "result": hysds_io["_source"]}
+        return (
+            {"success": True, "message": "", "result": hysds_io["_source"]},
+            200,
+            etag_header(hysds_io["etag"]),
+        )
 
 
 @hysds_io_ns.route("/add", endpoint="hysds_io-add")
@@ -477,6 +501,7 @@ class AddHySDSIOType(Resource):
             return {"success": False, "message": e}, 400
 
         mozart_es.index_document(index=HYSDS_IOS_INDEX, body=obj, id=_id)
+        hysds_io_registry.invalidate(_id)
         return {
             "success": True,
             "message": "{} added to index {}".format(_id, HYSDS_IOS_INDEX),
@@ -517,6 +542,7 @@ class RemoveHySDSIOType(Resource):
             return {"success": False, "message": "id parameter not included"}, 400
 
         mozart_es.delete_by_id(index=HYSDS_IOS_INDEX, id=_id)
+        hysds_io_registry.invalidate(_id)
         app.logger.info("deleted {} from index: {}".format(_id, HYSDS_IOS_INDEX))
 
         return {"success": True, "message": "deleted hysds_io: %s" % _id}
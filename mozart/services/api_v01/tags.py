@@ -6,6 +6,8 @@ from flask import request
 from flask_restx import Namespace, Resource
 
 from mozart import app, mozart_es
+from mozart.lib.job_utils import invalidate_job
+from mozart.lib.rule_utils import get_rule_tags
 
 
 USER_TAGS_NS = "user-tags"
@@ -66,6 +68,7 @@ class UserTags(Resource):
 
         update_doc = {"doc_as_upsert": True, "doc": {"user_tags": user_tags}}
         mozart_es.update_document(index=_index, id=_id, body=update_doc, refresh=True)
+        invalidate_job(_id)
 
         return {"success": True, "tags": user_tags}
 
@@ -103,6 +106,7 @@ class UserTags(Resource):
 
         update_doc = {"doc_as_upsert": True, "doc": {"user_tags": user_tags}}
         mozart_es.update_document(index=_index, id=_id, body=update_doc, refresh=True)
+        invalidate_job(_id)
 
         return {"success": True, "tags": user_tags}
 
@@ -115,28 +119,18 @@ class UserTags(Resource):
 class UserRulesTags(Resource):
     """user defined tags for trigger rules"""
 
+    parser = user_rules_tags_ns.parser()
+    parser.add_argument(
+        "prefix", type=str, help="only tags starting with prefix (autocomplete)"
+    )
+    parser.add_argument("size", type=int, help="max number of tags")
+
+    @user_rules_tags_ns.expect(parser)
     def get(self):
-        """retrieve user defined tags for trigger rules"""
-        index = app.config["USER_RULES_INDEX"]
-        body = {
-            "size": 0,
-            "aggs": {
-                "my_buckets": {
-                    "composite": {
-                        "size": 1000,
-                        "sources": [{"tags": {"terms": {"field": "tags"}}}],
-                    }
-                }
-            },
-        }
-        results = mozart_es.search(index=index, body=body)
-        buckets = results["aggregations"]["my_buckets"]["buckets"]
-        buckets = sorted(buckets, key=lambda k: k["doc_count"], reverse=True)
-        app.logger.info(buckets)
-        return {
-            "success": True,
-            "tags": [
-                {"key": tag["key"]["tags"], "count": tag["doc_count"]}
-                for tag in buckets
-            ],
-        }
+        """retrieve user defined tags for trigger rules, most used first"""
+        prefix = request.args.get("prefix")
+        size = request.args.get("size", None, type=int)
+        if size is not None and size < 1:
+            return {"success": False, "message": "size must be positive"}, 400
+
+        return {"success": True, "tags": get_rule_tags(prefix=prefix, size=size)}
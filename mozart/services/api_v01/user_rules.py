@@ -8,9 +8,20 @@ from datetime import datetime, timezone
 from flask import request
 from flask_restx import Namespace, Resource, inputs
 
+from elasticsearch.exceptions import ConflictError
 from hysds_commons.action_utils import check_passthrough_query
 
 from mozart import app, mozart_es
+from mozart.lib.registry import hysds_io_registry
+from mozart.lib.rule_utils import (
+    sync_rule_percolator,
+    delete_rule_percolator,
+    rule_id,
+    find_rule,
+    delete_rule,
+    LEGACY_RULE_IDS,
+    invalidate_rule_tags,
+)
 
 
 USER_RULE_NS = "user-rules"
@@ -137,24 +148,13 @@ class UserRules(Resource):
         _rule_name = request.args.get("rule_name", None)
         user_rules_index = app.config["USER_RULES_INDEX"]
 
-        if _id:
-            rule = mozart_es.get_by_id(index=user_rules_index, id=_id, ignore=404)
-            if rule.get("found", False) is False:
-                return {"success": False, "message": rule["message"]}, 404
-            else:
-                rule = {**rule, **rule["_source"]}
-                rule.pop("_source", None)
-                return {"success": True, "rule": rule}
-        elif _rule_name:
-            result = mozart_es.search(
-                index=user_rules_index, q=f"rule_name:{_rule_name}", ignore=404
-            )
-            if result.get("hits", {}).get("total", {}).get("value", 0) == 0:
+        if _id or _rule_name:
+            rule = find_rule(_id, _rule_name)
+            if rule is None:
                 return {
                     "success": False,
-                    "message": f"rule {_rule_name} not found",
+                    "message": f"rule {_id or _rule_name} not found",
                 }, 404
-            rule = result.get("hits").get("hits")[0]
             rule = {**rule, **rule["_source"]}
             rule.pop("_source", None)
             return {"success": True, "rule": rule}
@@ -244,23 +244,20 @@ class UserRules(Resource):
             app.logger.error(e)
             return {"success": False, "message": "invalid JSON: kwargs"}, 400
 
-        # check if rule name already exists
-        rule_exists_query = {"query": {"term": {"rule_name": rule_name}}}
-        existing_rules_count = mozart_es.get_count(
-            index=user_rules_index, body=rule_exists_query
-        )
-        if existing_rules_count > 0:
+        # rule names are unique: the document id is derived from the name and
+        # created with op_type=create (rules with legacy ids are checked by name)
+        if LEGACY_RULE_IDS and find_rule(rule_name=rule_name) is not None:
             return {
                 "success": False,
                 "message": "user rule already exists: %s" % rule_name,
             }, 409
 
         # check if job_type (hysds_io) exists in elasticsearch
-        job_type = mozart_es.get_by_id(index=HYSDS_IOS_INDEX, id=hysds_io, ignore=404)
-        if job_type["found"] is False:
+        job_type = hysds_io_registry.get(hysds_io)
+        if job_type is None:
             return {"success": False, "message": "%s not found" % hysds_io}, 400
 
-        params = job_type["_source"]["params"]
+        params = job_type["params"]
         is_passthrough_query = check_passthrough_query(params)
 
         if type(tags) == str:
@@ -308,9 +305,22 @@ class UserRules(Resource):
         if enable_dedup is not None:
             new_doc["enable_dedup"] = enable_dedup
 
-        result = mozart_es.index_document(
-            index=user_rules_index, body=new_doc, refresh=True
-        )
+        try:
+            result = mozart_es.index_document(
+                index=user_rules_index,
+                body=new_doc,
+                id=rule_id(rule_name),
+                op_type="create",
+                refresh=True,
+            )
+        except ConflictError:
+            return {
+                "success": False,
+                "message": "user rule already exists: %s" % rule_name,
+            }, 409
+        sync_rule_percolator(result["_id"], new_doc)
+        if tags:
+            invalidate_rule_tags()
         return {"success": True, "message": "rule created", "result": result}
 
     @user_rule_ns.expect(put_parser)
@@ -349,37 +359,22 @@ class UserRules(Resource):
 
         # check if job_type (hysds_io) exists in ElasticSearch (only if we're updating job_type)
         if hysds_io:
-            job_type = mozart_es.get_by_id(
-                index=HYSDS_IOS_INDEX, id=hysds_io, ignore=404
-            )
-            if job_type.get("found", False) is False:
+            job_type = hysds_io_registry.get(hysds_io)
+            if job_type is None:
                 return {
                     "success": False,
                     "message": "job_type not found: %s" % hysds_io,
                 }, 404
 
-        if _id:
-            app.logger.info("finding existing user rule: %s" % _id)
-            existing_rule = mozart_es.get_by_id(
-                index=user_rules_index, id=_id, ignore=404
-            )
-            if existing_rule.get("found", False) is False:
-                app.logger.info("rule not found %s" % _id)
-                return {
-                    "result": False,
-                    "message": "user rule not found: %s" % _id,
-                }, 404
-        elif _rule_name:
-            result = mozart_es.search(
-                index=user_rules_index, q=f"rule_name:{_rule_name}", ignore=404
-            )
-            if result.get("hits", {}).get("total", {}).get("value", 0) == 0:
-                return {
-                    "success": False,
-                    "message": "rule %s not found" % _rule_name,
-                }, 404
-            else:
-                _id = result.get("hits").get("hits")[0].get("_id")
+        app.logger.info("finding existing user rule: %s" % (_id or _rule_name))
+        existing_rule = find_rule(_id, _rule_name)
+        if existing_rule is None:
+            app.logger.info("rule not found %s" % (_id or _rule_name))
+            return {
+                "success": False,
+                "message": "user rule not found: %s" % (_id or _rule_name),
+            }, 404
+        _id = existing_rule["_id"]
 
         update_doc = {}
         if rule_name:
@@ -463,6 +458,40 @@ class UserRules(Resource):
         if "enable_dedup" in request_data:
             update_doc["enable_dedup"] = enable_dedup
 
+        new_id = rule_id(update_doc["rule_name"]) if rule_name else _id
+        if new_id != _id:
+            # the document id follows the rule name, a renamed rule moves to a new id
+            app.logger.info("moving user rule %s to %s" % (_id, new_id))
+            renamed_rule = {**existing_rule["_source"], **update_doc}
+            if LEGACY_RULE_IDS:  # names of rules with legacy ids are not ids
+                same_name = find_rule(rule_name=update_doc["rule_name"])
+                if same_name is not None and same_name["_id"] != _id:
+                    return {
+                        "success": False,
+                        "message": "user rule already exists: %s" % rule_name,
+                    }, 409
+            try:
+                mozart_es.index_document(
+                    index=user_rules_index,
+                    body=renamed_rule,
+                    id=new_id,
+                    op_type="create",
+                    refresh=True,
+                )
+            except ConflictError:
+                return {
+                    "success": False,
+                    "message": "user rule already exists: %s" % rule_name,
+                }, 409
+            mozart_es.delete_by_id(
+                index=user_rules_index, id=_id, refresh=True, ignore=404
+            )
+            delete_rule_percolator(_id)
+            sync_rule_percolator(new_id, renamed_rule)
+            if "tags" in update_doc:
+                invalidate_rule_tags()
+            return {"success": True, "id": new_id, "updated": update_doc}
+
         app.logger.info("editing document id %s in user_rule index" % _id)
 
         doc = {"doc_as_upsert": True, "doc": update_doc}
@@ -472,6 +501,9 @@ class UserRules(Resource):
         )
         app.logger.info(result)
         app.logger.info("document updated: %s" % _id)
+        sync_rule_percolator(_id)
+        if "tags" in update_doc:
+            invalidate_rule_tags()
         return {"success": True, "id": _id, "updated": update_doc}
 
     @user_rule_ns.expect(parser)
@@ -489,11 +521,14 @@ class UserRules(Resource):
 
         if _id:
             mozart_es.delete_by_id(index=user_rules_index, id=_id, ignore=404)
+            delete_rule_percolator(_id)
+            invalidate_rule_tags()
             app.logger.info("user rule %s deleted" % _id)
             return {"success": True, "message": "user rule deleted", "id": _id}
         elif _rule_name:
-            query = {"query": {"match": {"rule_name": _rule_name}}}
-            mozart_es.es.delete_by_query(index=user_rules_index, body=query, ignore=404)
+            delete_rule(rule_name=_rule_name)
+            delete_rule_percolator(rule_name=_rule_name)
+            invalidate_rule_tags()
             app.logger.info("user rule %s deleted" % _rule_name)
             return {
                 "success": True,
@@ -11,11 +11,14 @@ from flask_restx import Namespace, Resource, fields
 from hysds.log_utils import log_custom_event
 
 from mozart import app
+from mozart.lib.event_utils import parse_events, log_custom_events
 
 
 EVENT_NS = "event"
 event_ns = Namespace(EVENT_NS, description="HySDS event stream operations")
 
+EVENT_BATCH_MAX = app.config.get("EVENT_BATCH_MAX", 10000)
+
 
 @event_ns.route("/add", endpoint="event-add", methods=["POST"])
 @event_ns.doc(
@@ -131,3 +134,56 @@ class AddLogEvent(Resource):
             return {"success": False, "message": message}, 500
 
         return {"success": True, "message": "", "result": uuid}
+
+
+@event_ns.route("/add/batch", endpoint="event-add-batch", methods=["POST"])
+@event_ns.doc(
+    responses={
+        200: "Success",
+        400: "Malformed or too large batch",
+        500: "Event log failed",
+    },
+    description="Logs a batch of HySDS custom events",
+)
+class AddLogEventBatch(Resource):
+    """Add a batch of log events."""
+
+    @event_ns.doc(
+        body={
+            "events": "NDJSON (one event per line) or a JSON array of events with "
+            "type, status, event and optional tags and hostname"
+        }
+    )
+    def post(self):
+        """
+        Log a batch of HySDS custom events with one bulk write; returns the result of
+        every event by its line (NDJSON) or position (JSON array)
+        """
+        try:
+            records = parse_events(request.get_data(as_text=True))
+        except ValueError as e:
+            return {"success": False, "message": str(e)}, 400
+        if not records:
+            return {"success": False, "message": "no events"}, 400
+        if len(records) > EVENT_BATCH_MAX:
+            return {
+                "success": False,
+                "message": "too many events (max %d)" % EVENT_BATCH_MAX,
+            }, 400
+
+        try:
+            results = log_custom_events(records)
+        except Exception as e:
+            message = f"Failed to log custom events. {type(e)}:{str(e)}"
+            app.logger.warning(message)
+            app.logger.warning("".join(traceback.format_exception(e)))
+            return {"success": False, "message": message}, 500
+
+        failed = sum(1 for result in results if not result["success"])
+        return {
+            "success": failed == 0,
+            "message": "" if failed == 0 else "%d events rejected" % failed,
+            "logged": len(results) - failed,
+            "failed": failed,
+            "results": results,
+        }
@@ -3,9 +3,11 @@ from future import standard_library
 standard_library.install_aliases()
 
 import json
+import queue
 import traceback
+from datetime import datetime, timezone
 
-from flask import request
+from flask import request, Response, stream_with_context
 from flask_restx import Namespace, Resource, fields, inputs
 
 from hysds.celery import app as celery_app
@@ -15,6 +17,23 @@ from hysds_commons.action_utils import check_passthrough_query
 
 from mozart import app, mozart_es
 import mozart.lib.queue_utils
+from mozart.lib.job_utils import (
+    TERMINAL_STATES,
+    find_job_status,
+    find_job_info,
+    get_jobs_by_ids,
+    stream_job_list,
+)
+from mozart.lib.job_watch import (
+    Subscriber,
+    job_status_poller,
+    parse_timestamp,
+    prune_seen,
+    encode_watch_cursor,
+    decode_watch_cursor,
+)
+from mozart.lib.registry import job_spec_registry, hysds_io_registry
+from mozart.lib.pagination import search_after_page, iter_search_after
 
 
 job_ns = Namespace("job", description="Mozart job operations")
@@ -28,6 +47,13 @@ JOB_SPECS_INDEX = app.config["JOB_SPECS_INDEX"]
 JOB_STATUS_INDEX = app.config["JOB_STATUS_INDEX"]
 CONTAINERS_INDEX = app.config["CONTAINERS_INDEX"]
 
+JOB_LIST_MAX_PAGE_SIZE = app.config.get("JOB_LIST_MAX_PAGE_SIZE", 10000)
+JOB_BATCH_MAX_IDS = app.config.get("JOB_BATCH_MAX_IDS", 1000)
+JOB_SUBMIT_BATCH_MAX = app.config.get("JOB_SUBMIT_BATCH_MAX", 10000)
+
+WATCH_MAX_WAIT = 60  # seconds a long-poll request may block
+WATCH_KEEPALIVE = 15  # seconds between SSE keepalive comments
+
 
 @job_ns.route("/submit", endpoint="job-submit")
 @job_ns.doc(
@@ -220,9 +246,184 @@ class SubmitJob(Resource):
         return {"success": True, "message": "", "result": ident, "tags": tags}
 
 
+def parse_batch_job(job):
+    """validate one job of a batch submission and return resolve_hysds_job kwargs"""
+    if not isinstance(job, dict):
+        raise ValueError("job must be a JSON object")
+    job_type = job.get("type")
+    job_queue = job.get("queue")
+    if not job_type or not job_queue:
+        raise ValueError("type and queue must be supplied")
+
+    priority = int(job.get("priority", 0))
+    if priority < 0 or priority > 9:
+        raise ValueError("priority must be in the range of 0 to 9")
+
+    tags = job.get("tags")
+    if isinstance(tags, str):
+        tags = json.loads(tags)
+    params = job.get("params", {})
+    if isinstance(params, str):
+        params = json.loads(params)
+
+    enable_dedup = inputs.boolean(job.get("enable_dedup", True))
+    publish_overwrite_ok = inputs.boolean(job.get("publish_overwrite_ok", False))
+
+    soft_time_limit = job.get("soft_time_limit")
+    if soft_time_limit is not None:
+        soft_time_limit = int(soft_time_limit)
+        if soft_time_limit < 1:
+            raise ValueError("soft_time_limit must be greater than 0")
+    time_limit = job.get("time_limit")
+    if time_limit is not None:
+        time_limit = int(time_limit)
+        if time_limit < 1:
+            raise ValueError("time_limit must be greater than 0")
+
+    return {
+        "job_type": job_type,
+        "job_queue": job_queue,
+        "priority": priority,
+        "tags": tags,
+        "params": params,
+        "username": job.get("username"),
+        "job_name": job.get("name"),
+        "payload_hash": job.get("payload_hash"),
+        "enable_dedup": enable_dedup,
+        "soft_time_limit": soft_time_limit,
+        "time_limit": time_limit,
+        "disk_usage": job.get("disk_usage"),
+        "publish_overwrite_ok": publish_overwrite_ok,
+    }
+
+
+@job_ns.route("/submit/batch", endpoint="job-submit-batch", methods=["POST"])
+@job_ns.doc(
+    responses={200: "Success", 400: "Invalid parameters", 500: "Job submission failed"},
+    description="Submit a batch of jobs for execution in HySDS.",
+)
+class SubmitJobBatch(Resource):
+    """Submit a batch of jobs for execution in HySDS."""
+
+    parser = job_ns.parser()
+    parser.add_argument(
+        "jobs",
+        required=True,
+        type=list,
+        location="json",
+        help="""JSON list of jobs, each with the /job/submit parameters, e.g. [{
+                            "type": "job-hello_world:develop",
+                            "queue": "factotum-job_worker-small",
+                            "priority": 5,
+                            "tags": ["test_job"],
+                            "params": {"min_sleep": 1, "max_sleep": 10}
+                        }]""",
+    )
+
+    @job_ns.expect(parser)
+    def post(self):
+        """
+        Submits a batch of jobs; every job is validated and resolved before anything is
+        submitted, and each distinct (type, queue) pair is checked once
+        """
+        request_data = request.json or {}
+        jobs = request_data.get("jobs")
+        if not isinstance(jobs, list) or len(jobs) == 0:
+            return {"success": False, "message": "jobs must be a non-empty list"}, 400
+        if len(jobs) > JOB_SUBMIT_BATCH_MAX:
+            return {
+                "success": False,
+                "message": "too many jobs, max is %d" % JOB_SUBMIT_BATCH_MAX,
+            }, 400
+
+        results = []
+        validated = []
+        for i, job in enumerate(jobs):
+            try:
+                validated.append(parse_batch_job(job))
+                results.append({"index": i, "success": True})
+            except (ValueError, TypeError) as e:
+                results.append({"index": i, "success": False, "message": str(e)})
+
+        # each distinct (type, queue) pair is checked once, for all of its jobs
+        pairs = sorted({(job["job_type"], job["job_queue"]) for job in validated})
+        try:
+            pair_errors = mozart.lib.queue_utils.check_job_queues(pairs)
+        except Exception as e:
+            message = f"Failed to check job types and queues. {type(e)}:{str(e)}"
+            app.logger.error(message)
+            return {"success": False, "message": message}, 500
+        for result, job in zip((r for r in results if r["success"]), validated):
+            error = pair_errors[(job["job_type"], job["job_queue"])]
+            if error is not None:
+                result["success"] = False
+                result["message"] = error
+
+        if not all(result["success"] for result in results):
+            return {
+                "success": False,
+                "message": "invalid jobs, nothing submitted",
+                "result": [r for r in results if not r["success"]],
+            }, 400
+
+        # every job is resolved before any is published, so a job that cannot be
+        # resolved does not leave the batch half submitted
+        job_jsons = []
+        for result, job in zip(results, validated):
+            try:
+                job_json = hysds_commons.job_utils.resolve_hysds_job(
+                    job["job_type"],
+                    job["job_queue"],
+                    job["priority"],
+                    job["tags"],
+                    job["params"],
+                    username=job["username"],
+                    job_name=job["job_name"],
+                    payload_hash=job["payload_hash"],
+                    enable_dedup=job["enable_dedup"],
+                    soft_time_limit=job["soft_time_limit"],
+                    time_limit=job["time_limit"],
+                    disk_usage=job["disk_usage"],
+                    publish_overwrite_ok=job["publish_overwrite_ok"],
+                )
+                job_jsons.append(job_json)
+            except Exception as e:
+                result["success"] = False
+                result["message"] = f"Failed to resolve job. {type(e)}:{str(e)}"
+                app.logger.error(result["message"])
+
+        if not all(result["success"] for result in results):
+            return {
+                "success": False,
+                "message": "unresolvable jobs, nothing submitted",
+                "result": [r for r in results if not r["success"]],
+            }, 400
+
+        submitted = 0
+        for result, job_json in zip(results, job_jsons):
+            try:
+                result["result"] = hysds_commons.job_utils.submit_hysds_job(job_json)
+                submitted += 1
+            except Exception as e:
+                result["success"] = False
+                result["message"] = f"Failed to submit job. {type(e)}:{str(e)}"
+                app.logger.error(result["message"])
+
+        app.logger.info("submitted %d/%d jobs" % (submitted, len(results)))
+        return {
+            "success": submitted == len(results),
+            "message": "submitted %d/%d jobs" % (submitted, len(results)),
+            "result": results,
+        }
+
+
 @job_ns.route("/user/<user>", endpoint="user-jobs")
 @job_ns.doc(
-    responses={200: "Success", 500: "Query execution failed"},
+    responses={
+        200: "Success",
+        400: "Invalid parameters",
+        500: "Query execution failed",
+    },
     description="Get list of user submitted job IDs",
 )
 class UserJobs(Resource):
@@ -259,11 +460,24 @@ class UserJobs(Resource):
         help="job status, ie. job-queued, job-started, job-completed, " "job-failed",
         required=False,
     )
+    parser.add_argument(
+        "cursor",
+        type=str,
+        help="continuation token returned as 'next' by the previous page",
+        required=False,
+    )
+    parser.add_argument(
+        "pit",
+        type=inputs.boolean,
+        help="bind paging to an ES point-in-time (consistent while jobs are added)",
+        required=False,
+    )
 
     @job_ns.expect(parser)
     def get(self, user):
         """
         return user submitted jobs from ElasticSearch (sorted by @timestamp desc)
+        pass the returned "next" token as cursor to fetch the following page
         """
         offset = request.args.get("offset")
         page_size = request.args.get("page_size")
@@ -274,6 +488,12 @@ class UserJobs(Resource):
         start_time = request.args.get("start_time")
         end_time = request.args.get("end_time")
         status = request.args.get("status")
+        cursor = request.args.get("cursor")
+
+        try:
+            pit = inputs.boolean(request.args.get("pit", False))
+        except ValueError as e:
+            return {"success": False, "message": str(e)}, 400
 
         if offset:
             try:
@@ -296,14 +516,12 @@ class UserJobs(Resource):
                 return {"success": False, "message": "priority must be an int"}, 400
 
         query = {
-            "sort": [{"@timestamp": {"order": "desc"}}],
+            "sort": [{"@timestamp": {"order": "desc"}}, {"_id": {"order": "asc"}}],
             "query": {"bool": {"must": [{"term": {"job.username": user}}]}},
         }
 
-        if offset:
+        if offset and not cursor:
             query["from"] = offset
-        if page_size:
-            query["size"] = page_size
         if tag:
             query["query"]["bool"]["must"].append({"term": {"tags.keyword": tag}})
         if job_type:
@@ -329,15 +547,26 @@ class UserJobs(Resource):
             query["query"]["bool"]["must"].append(datetime_filter)
 
         try:
-            res = mozart_es.search(index=JOB_STATUS_INDEX, body=query, _source=["tags"])
-        except Exception as e:
+            hits, next_cursor = search_after_page(
+                JOB_STATUS_INDEX,
+                query,
+                page_size or 250,
+                cursor=cursor,
+                pit=pit,
+                _source=["tags"],
+            )
+        except ValueError as e:  # malformed cursor
             return {"success": False, "message": str(e), "result": []}, 400
+        except Exception as e:
+            message = f"Failed to list jobs of {user}. {type(e)}:{str(e)}"
+            app.logger.error(message)
+            return {"success": False, "message": message, "result": []}, 500
         return {
             "success": True,
             "result": [
-                {"id": doc["_id"], "tags": doc["_source"]["tags"]}
-                for doc in res["hits"]["hits"]
+                {"id": doc["_id"], "tags": doc["_source"]["tags"]} for doc in hits
             ],
+            "next": next_cursor,
         }
 
 
@@ -426,17 +655,11 @@ class JobStatus(Resource):
         if _id is None:
             return {"success": False, "message": "id not supplied"}, 400
 
-        job_status = mozart_es.search_by_id(
-            index=JOB_STATUS_INDEX, id=_id, ignore=404, _source=["status"]
-        )
-        if job_status["found"] is False:
+        job_status = find_job_status(_id)
+        if job_status is None:
             return {"success": False, "message": "job status not found: %s" % _id}, 404
 
-        return {
-            "success": True,
-            "message": "",
-            "status": job_status["_source"]["status"],
-        }
+        return {"success": True, "message": "", "status": job_status}
 
 
 @job_ns.route("/list", endpoint="job-list")
@@ -459,6 +682,9 @@ class Jobs(Resource):
             "result": fields.List(
                 fields.String, required=True, description="list of job IDs"
             ),
+            "next": fields.String(
+                description="cursor for the next page; null on the last page"
+            ),
         },
     )
     parser = job_ns.parser()
@@ -468,15 +694,87 @@ class Jobs(Resource):
     parser.add_argument(
         "offset", required=False, type=str, help="Job Listing Pagination Offset"
     )
+    parser.add_argument(
+        "cursor",
+        required=False,
+        type=str,
+        help="continuation token returned as 'next' by the previous page",
+    )
+    parser.add_argument(
+        "pit",
+        required=False,
+        type=inputs.boolean,
+        help="bind the listing to an ES point-in-time for a consistent view",
+    )
+    parser.add_argument(
+        "stream",
+        required=False,
+        type=inputs.boolean,
+        help="stream every job ID as NDJSON instead of a single page",
+    )
 
-    @job_ns.marshal_with(resp_model)
+    @job_ns.expect(parser)
+    @job_ns.response(200, "Success", resp_model)
     def get(self):
         """Paginated list submitted jobs"""
-        jobs = mozart_es.query(index=JOB_STATUS_INDEX, _source=False)
+        page_size = request.args.get("page_size")
+        offset = request.args.get("offset")
+        cursor = request.args.get("cursor")
+
+        try:
+            pit = inputs.boolean(request.args.get("pit", False))
+            stream = inputs.boolean(request.args.get("stream", False))
+        except ValueError as e:
+            return {"success": False, "message": str(e)}, 400
+        try:
+            if page_size:
+                page_size = min(int(page_size), JOB_LIST_MAX_PAGE_SIZE)
+            if offset:
+                offset = int(offset)
+        except (ValueError, TypeError):
+            return {
+                "success": False,
+                "message": "page_size and offset must be ints",
+            }, 400
+
+        query = {"_source": False, "sort": [{"_id": {"order": "asc"}}]}
+        if stream is True:
+            jobs = iter_search_after(
+                JOB_STATUS_INDEX, query, page_size=JOB_LIST_MAX_PAGE_SIZE, pit=True
+            )
+            ndjson = (json.dumps({"id": job["_id"]}) + "\n" for job in jobs)
+            return Response(
+                stream_with_context(ndjson), mimetype="application/x-ndjson"
+            )
+
+        if not page_size and not cursor:
+            # unpaginated listing, kept for older clients: the same JSON document,
+            # streamed a page of hits at a time instead of built in memory
+            jobs = iter_search_after(
+                JOB_STATUS_INDEX, query, page_size=JOB_LIST_MAX_PAGE_SIZE
+            )
+            return Response(
+                stream_with_context(stream_job_list(jobs)),
+                mimetype="application/json",
+            )
+
+        if offset and not cursor:
+            query["from"] = offset
+        try:
+            jobs, next_cursor = search_after_page(
+                JOB_STATUS_INDEX,
+                query,
+                page_size or JOB_LIST_MAX_PAGE_SIZE,
+                cursor=cursor,
+                pit=pit,
+            )
+        except ValueError as e:
+            return {"success": False, "message": str(e)}, 400
         return {
             "success": True,
             "message": "",
-            "result": sorted([job["_id"] for job in jobs]),
+            "result": [job["_id"] for job in jobs],
+            "next": next_cursor,
         }
 
 
@@ -516,11 +814,296 @@ class JobInfo(Resource):
                 }, 400
             _id = request.args.get("id")
 
-        info = mozart_es.search_by_id(index=JOB_STATUS_INDEX, id=_id, ignore=404)
-        if info["found"] is False:
+        info = find_job_info(_id)
+        if info is None:
             return {"success": False, "message": "job info not found: %s" % _id}, 404
 
-        return {"success": True, "message": "", "result": info["_source"]}
+        return {"success": True, "message": "", "result": info}
+
+
+@job_ns.route("/watch", endpoint="job-watch")
+@job_ns.doc(
+    responses={200: "Success", 400: "Invalid parameters"},
+    description="Watch job status transitions (Server-Sent Events or long-poll).",
+)
+class JobWatch(Resource):
+    """Push job status transitions to the client as they happen."""
+
+    parser = job_ns.parser()
+    parser.add_argument(
+        "id", type=str, action="append", help="job ID(s) to watch, comma separated"
+    )
+    parser.add_argument("user", type=str, help="watch all jobs submitted by user")
+    parser.add_argument("tag", type=str, help="watch all jobs with tag or user tag")
+    parser.add_argument(
+        "mode",
+        type=str,
+        choices=("sse", "poll"),
+        default="sse",
+        help="'sse' for an event stream, 'poll' to long-poll for the next changes",
+    )
+    parser.add_argument(
+        "timeout", type=int, help="long-poll wait in seconds (max %d)" % WATCH_MAX_WAIT
+    )
+    parser.add_argument(
+        "cursor", type=str, help="long-poll resume token returned by the previous poll"
+    )
+
+    @job_ns.expect(parser)
+    def get(self):
+        """Stream status transitions of jobs by ID, user or tag"""
+        ids = []
+        for value in request.args.getlist("id"):
+            ids.extend(i.strip() for i in value.split(",") if i.strip())
+        user = request.args.get("user")
+        tag = request.args.get("tag")
+        mode = request.args.get("mode", "sse")
+
+        if not ids and not user and not tag:
+            return {
+                "success": False,
+                "message": "id, user or tag must be supplied",
+            }, 400
+        if len(ids) > JOB_BATCH_MAX_IDS:
+            return {
+                "success": False,
+                "message": "too many ids, max is %d" % JOB_BATCH_MAX_IDS,
+            }, 400
+        try:
+            timeout = min(int(request.args.get("timeout", 30)), WATCH_MAX_WAIT)
+        except (ValueError, TypeError):
+            return {"success": False, "message": "timeout must be an int"}, 400
+
+        if mode == "poll":
+            return self.long_poll(ids, user, tag, timeout, request.args.get("cursor"))
+
+        subscriber = job_status_poller.subscribe(Subscriber(ids, user, tag))
+
+        def stream_events():
+            pending = set(ids) if ids else None
+            try:
+                # current state first, so jobs that already finished are reported
+                if ids:
+                    found, _ = get_jobs_by_ids(
+                        ids, _source_includes=["status", "@timestamp"]
+                    )
+                    for _id, doc in found.items():
+                        event = {"id": _id, **doc}
+                        yield "data: %s\n\n" % json.dumps(event)
+                        if doc["status"] in TERMINAL_STATES:
+                            pending.discard(_id)
+
+                while pending is None or pending:
+                    try:
+                        event = subscriber.events.get(timeout=WATCH_KEEPALIVE)
+                    except queue.Empty:
+                        yield ": keepalive\n\n"
+                        continue
+                    yield "data: %s\n\n" % json.dumps(event)
+                    if pending is not None and event["status"] in TERMINAL_STATES:
+                        pending.discard(event["id"])
+                yield "event: done\ndata: {}\n\n"
+            finally:
+                job_status_poller.unsubscribe(subscriber)
+
+        return Response(stream_events(), mimetype="text/event-stream")
+
+    @staticmethod
+    def long_poll(ids, user, tag, timeout, cursor=None):
+        """
+        Return the transitions since the poll that returned cursor, waiting up to timeout
+        seconds for one; the first poll (no cursor) returns the current state of the
+        watched ids right away. Every response carries the cursor for the next poll.
+        """
+        if cursor is not None:
+            try:
+                newest, seen = decode_watch_cursor(cursor)
+            except ValueError as e:
+                return {"success": False, "message": str(e)}, 400
+        else:
+            newest, seen = datetime.now(timezone.utc), {}
+
+        subscriber = job_status_poller.subscribe(Subscriber(ids, user, tag))
+        try:
+            if cursor is not None:
+                events = job_status_poller.changes_since(subscriber, newest, seen)
+            elif ids:
+                # current state first, so jobs that already finished are reported
+                found, _ = get_jobs_by_ids(
+                    ids, _source_includes=["status", "@timestamp"]
+                )
+                events = [{"id": _id, **doc} for _id, doc in found.items()]
+            else:
+                events = []
+
+            if not events:
+                try:
+                    events.append(subscriber.events.get(timeout=timeout))
+                    while not subscriber.events.empty():
+                        events.append(subscriber.events.get_nowait())
+                except queue.Empty:
+                    pass
+        finally:
+            job_status_poller.unsubscribe(subscriber)
+
+        delivered = []
+        for event in events:
+            key = (event["id"], event["@timestamp"])
+            if key in seen:
+                continue
+            seen[key] = parse_timestamp(event["@timestamp"])
+            newest = max(newest, seen[key])
+            delivered.append(event)
+
+        return {
+            "success": True,
+            "message": "",
+            "events": delivered,
+            "cursor": encode_watch_cursor(newest, prune_seen(seen, newest)),
+        }
+
+
+def parse_job_id_batch(request_data):
+    """validate the "ids" list of a batch lookup request, returns (ids, error)"""
+    ids = request_data.get("ids")
+    if isinstance(ids, str):
+        try:
+            ids = json.loads(ids)
+        except ValueError:
+            return None, "ids must be a JSON list of job IDs"
+    if not isinstance(ids, list) or not all(isinstance(i, str) for i in ids):
+        return None, "ids must be a list of job IDs"
+    if len(ids) == 0:
+        return None, "ids must not be empty"
+    if len(ids) > JOB_BATCH_MAX_IDS:
+        return None, "too many ids, max is %d" % JOB_BATCH_MAX_IDS
+    return list(dict.fromkeys(ids)), None
+
+
+@job_ns.route("/status/batch", endpoint="job-status-batch", methods=["POST"])
+@job_ns.doc(
+    responses={200: "Success", 400: "Invalid parameters", 500: "Query failed"},
+    description="Get status of multiple jobs by ID.",
+)
+class JobStatusBatch(Resource):
+    """Get status of a batch of job IDs with a single lookup."""
+
+    resp_model = job_ns.model(
+        "Job Status Batch Response(JSON)",
+        {
+            "success": fields.Boolean(
+                required=True, description="Boolean, whether the API was successful"
+            ),
+            "message": fields.String(
+                required=True, description="message describing success or failure"
+            ),
+            "found": fields.Raw(required=True, description="job ID -> job status"),
+            "missing": fields.List(
+                fields.String, required=True, description="job IDs not found"
+            ),
+        },
+    )
+
+    parser = job_ns.parser()
+    parser.add_argument(
+        "ids", required=True, type=list, location="json", help="list of job IDs"
+    )
+
+    @job_ns.expect(parser)
+    @job_ns.marshal_with(resp_model)
+    def post(self):
+        """Gets the status of a batch of submitted jobs"""
+        request_data = request.json or request.form
+        ids, error = parse_job_id_batch(request_data)
+        if error is not None:
+            return {"success": False, "message": error}, 400
+
+        try:
+            found, missing = get_jobs_by_ids(ids, _source_includes=["status"])
+        except Exception as e:
+            message = f"Failed to get job statuses. {type(e)}:{str(e)}"
+            app.logger.error(message)
+            return {"success": False, "message": message}, 500
+
+        return {
+            "success": True,
+            "message": "",
+            "found": {_id: doc["status"] for _id, doc in found.items()},
+            "missing": missing,
+        }
+
+
+@job_ns.route("/info/batch", endpoint="job-info-batch", methods=["POST"])
+@job_ns.doc(
+    responses={200: "Success", 400: "Invalid parameters", 500: "Query failed"},
+    description="Gets the info for multiple jobs.",
+)
+class JobInfoBatch(Resource):
+    """Get info of a batch of job IDs with a single lookup."""
+
+    resp_model = job_ns.model(
+        "Job Info Batch Response(JSON)",
+        {
+            "success": fields.Boolean(
+                required=True, description="Boolean, whether the API was successful"
+            ),
+            "message": fields.String(
+                required=True, description="message describing success or failure"
+            ),
+            "found": fields.Raw(
+                required=True, description="job ID -> Job Info Object"
+            ),
+            "missing": fields.List(
+                fields.String, required=True, description="job IDs not found"
+            ),
+        },
+    )
+
+    parser = job_ns.parser()
+    parser.add_argument(
+        "ids", required=True, type=list, location="json", help="list of job IDs"
+    )
+    parser.add_argument(
+        "_source_includes",
+        type=list,
+        location="json",
+        help='fields to return, e.g. ["status", "job.job_info.execute_node"]',
+    )
+    parser.add_argument(
+        "_source_excludes",
+        type=list,
+        location="json",
+        help='fields to leave out, e.g. ["job.params"]',
+    )
+
+    @job_ns.expect(parser)
+    @job_ns.marshal_with(resp_model)
+    def post(self):
+        """Get complete info for a batch of submitted jobs"""
+        request_data = request.json or request.form
+        ids, error = parse_job_id_batch(request_data)
+        if error is not None:
+            return {"success": False, "message": error}, 400
+
+        includes = request_data.get("_source_includes")
+        excludes = request_data.get("_source_excludes")
+        for fields_list in (includes, excludes):
+            if fields_list is not None and not isinstance(fields_list, list):
+                return {
+                    "success": False,
+                    "message": "_source_includes/_source_excludes must be lists",
+                }, 400
+
+        try:
+            found, missing = get_jobs_by_ids(
+                ids, _source_includes=includes, _source_excludes=excludes
+            )
+        except Exception as e:
+            message = f"Failed to get job info. {type(e)}:{str(e)}"
+            app.logger.error(message)
+            return {"success": False, "message": message}, 500
+
+        return {"success": True, "message": "", "found": found, "missing": missing}
 
 
 @on_demand_ns.route("", endpoint="on-demand")
@@ -659,12 +1242,12 @@ class OnDemandJobs(Resource):
                 "message": "missing field: [tags, job_type, hysds_io, queue, query]",
             }, 400
 
-        doc = mozart_es.get_by_id(index=HYSDS_IOS_INDEX, id=hysds_io, ignore=404)
-        if doc["found"] is False:
+        doc = hysds_io_registry.get(hysds_io)
+        if doc is None:
             app.logger.error("failed to fetch %s, not found in hysds_ios" % hysds_io)
             return {"success": False, "message": "%s not found" % hysds_io}, 404
 
-        params = doc["_source"]["params"]
+        params = doc["params"]
         is_passthrough_query = check_passthrough_query(params)
 
         rule = {
@@ -767,8 +1350,8 @@ class JobParams(Resource):
         job_params = hysds_io["_source"]["params"]
         job_params = list(filter(lambda x: x["from"] == "submitter", job_params))
 
-        job_spec = mozart_es.get_by_id(index=JOB_SPECS_INDEX, id=job_type, ignore=404)
-        if job_spec.get("found", False) is False:
+        job_spec = job_spec_registry.get(job_type)
+        if job_spec is None:
             return {
                 "success": False,
                 "message": "%s not found in job_specs" % job_type,
@@ -779,8 +1362,8 @@ class JobParams(Resource):
             "submission_type": hysds_io["_source"].get("submission_type"),
             "hysds_io": hysds_io["_source"]["id"],
             "params": job_params,
-            "time_limit": job_spec["_source"]["time_limit"],
-            "soft_time_limit": job_spec["_source"]["soft_time_limit"],
-            "disk_usage": job_spec["_source"]["disk_usage"],
+            "time_limit": job_spec["time_limit"],
+            "soft_time_limit": job_spec["soft_time_limit"],
+            "disk_usage": job_spec["disk_usage"],
             "enable_dedup": hysds_io["_source"].get("enable_dedup", True),
         }
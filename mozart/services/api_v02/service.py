@@ -5,7 +5,12 @@ standard_library.install_aliases()
 from flask import Blueprint
 from flask_restx import Api, apidoc
 
-from mozart.services.api_v02.specs import job_spec_ns, container_ns, hysds_io_ns
+from mozart.services.api_v02.specs import (
+    job_spec_ns,
+    container_ns,
+    hysds_io_ns,
+    specs_ns,
+)
 from mozart.services.api_v02.events import event_ns
 from mozart.services.api_v02.jobs import job_ns, queue_ns, on_demand_ns
 from mozart.services.api_v02.tags import user_tags_ns, user_rules_tags_ns
@@ -25,6 +30,7 @@ api = Api(
 api.add_namespace(job_spec_ns)
 api.add_namespace(container_ns)
 api.add_namespace(hysds_io_ns)
+api.add_namespace(specs_ns)
 
 # events.py
 api.add_namespace(event_ns)
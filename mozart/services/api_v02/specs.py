@@ -4,20 +4,92 @@ standard_library.install_aliases()
 
 import json
 
-from flask import request
+from flask import request, Response
 from flask_restx import Namespace, Resource, fields
+from werkzeug.datastructures import FileStorage
 
 from mozart import app, mozart_es
+from mozart.lib.registry import (
+    job_spec_registry,
+    hysds_io_registry,
+    container_registry,
+    conditional_get,
+    etag_header,
+)
+from mozart.lib.spec_utils import (
+    SPEC_TYPES,
+    validate_spec,
+    parse_bundle,
+    import_specs,
+    export_specs,
+)
 
 
 job_spec_ns = Namespace("job_spec", description="Mozart job-specification operations")
 container_ns = Namespace("container", description="Mozart container operations")
 hysds_io_ns = Namespace("hysds_io", description="HySDS IO operations")
+specs_ns = Namespace(
+    "specs", description="Bulk import/export of job specs, hysds_ios and containers"
+)
 
 HYSDS_IOS_INDEX = app.config["HYSDS_IOS_INDEX"]
 JOB_SPECS_INDEX = app.config["JOB_SPECS_INDEX"]
 JOB_STATUS_INDEX = app.config["JOB_STATUS_INDEX"]
 CONTAINERS_INDEX = app.config["CONTAINERS_INDEX"]
+SPEC_LIST_MAX_SIZE = 1000
+
+list_parser = job_spec_ns.parser()
+list_parser.add_argument(
+    "fields",
+    required=False,
+    type=str,
+    help="comma separated fields to return per document (e.g. version,required-queues)",
+)
+list_parser.add_argument("prefix", required=False, type=str, help="ID prefix")
+list_parser.add_argument(
+    "size", required=False, type=int, help="page size (max %d)" % SPEC_LIST_MAX_SIZE
+)
+list_parser.add_argument(
+    "cursor", required=False, type=str, help="'next' cursor of the previous page"
+)
+
+
+def list_specs(registry):
+    """
+    Shared GET of the /list endpoints: all ids (with an ETag) unless fields, prefix,
+    size or cursor are given, then a page of ids or of documents projected on fields
+    """
+    projection = request.args.get("fields", None)
+    prefix = request.args.get("prefix", None)
+    size = request.args.get("size", None)
+    cursor = request.args.get("cursor", None)
+    if not any((projection, prefix, size, cursor)):
+        ids, etag = registry.list_ids()
+        return (
+            {"success": True, "message": "", "result": ids, "total": len(ids)},
+            200,
+            etag_header(etag),
+        )
+
+    try:
+        size = min(int(size), SPEC_LIST_MAX_SIZE) if size else None
+        if size is not None and size < 1:
+            raise ValueError("size must be > 0")
+        if projection:
+            projection = [f.strip() for f in projection.split(",") if f.strip()]
+        result, next_cursor, total = registry.list_page(
+            prefix, size, cursor, projection or None
+        )
+    except ValueError as e:
+        return {"success": False, "message": str(e)}, 400
+
+    return {
+        "success": True,
+        "message": "",
+        "result": result,
+        "next": next_cursor,
+        "total": total,
+    }
 
 
 @job_spec_ns.route("", endpoint="job_spec")
@@ -50,6 +122,7 @@ class JobSpecs(Resource):
     )
 
     @job_spec_ns.expect(job_spec_parser)
+    @conditional_get
     @job_spec_ns.marshal_with(resp_model_job_spec)
     def get(self):
         """Gets a Job Type specification object for the given ID."""
@@ -57,9 +130,8 @@ class JobSpecs(Resource):
         if _id is None:
             return {"success": False, "message": "missing parameter: id"}, 400
 
-        job_spec = mozart_es.get_by_id(index=JOB_SPECS_INDEX, id=_id, ignore=404)
-        app.logger.info(job_spec)
-        if job_spec["found"] is False:
+        job_spec = job_spec_registry.get_entry(_id)
+        if job_spec is None:
             app.logger.error("job_spec not found %s" % _id)
             return {
                 "success": False,
@@ -67,11 +139,15 @@ class JobSpecs(Resource):
                 "result": None,
             }, 404
 
-        return {
-            "success": True,
-            "message": "job spec for %s" % _id,
-            "result": job_spec["_source"],
-        }
+        return (
+            {
+                "success": True,
+                "message": "job spec for %s" % _id,
+                "result": job_spec["_source"],
+            },
+            200,
+            etag_header(job_spec["etag"]),
+        )
 
     @job_spec_ns.expect(post_job_spec_parser)
     @job_spec_ns.marshal_with(resp_model_job_spec)
@@ -83,11 +159,13 @@ class JobSpecs(Resource):
 
         try:
             obj = json.loads(spec)
+            validate_spec("job_spec", obj)
             _id = obj["id"]
         except (ValueError, KeyError, json.decoder.JSONDecodeError, Exception) as e:
             return {"success": False, "message": e}, 400
 
         mozart_es.index_document(index=JOB_SPECS_INDEX, body=obj, id=_id)
+        job_spec_registry.invalidate(_id)
         return {
             "success": True,
             "message": "job_spec {} added to index {}".format(_id, HYSDS_IOS_INDEX),
@@ -103,6 +181,7 @@ class JobSpecs(Resource):
             return {"success": False, "message": "id parameter not included"}, 400
 
         mozart_es.delete_by_id(index=JOB_SPECS_INDEX, id=_id)
+        job_spec_registry.invalidate(_id)
         app.logger.info(
             "Deleted job_spec {} from index: {}".format(_id, JOB_SPECS_INDEX)
         )
@@ -126,19 +205,21 @@ class GetJobTypes(Resource):
             "message": fields.String(
                 required=True, description="message describing success or failure"
             ),
-            "result": fields.List(
-                fields.String, required=True, description="list of job types"
+            "result": fields.Raw(
+                required=True,
+                description="list of job types, or of their fields if requested",
             ),
+            "next": fields.String(description="cursor for the next page"),
+            "total": fields.Integer(description="number of matching job types"),
         },
     )
 
+    @job_spec_ns.expect(list_parser)
+    @conditional_get
     @job_spec_ns.marshal_with(resp_model_job_types)
     def get(self):
         """Gets a list of Job Type specifications"""
-        query = {"query": {"match_all": {}}}
-        job_specs = mozart_es.query(index=JOB_SPECS_INDEX, body=query)
-        ids = [job_spec["_id"] for job_spec in job_specs]
-        return {"success": True, "message": "", "result": ids}
+        return list_specs(job_spec_registry)
 
 
 @container_ns.route("/list", endpoint="containers")
@@ -158,19 +239,21 @@ class ContainerTypes(Resource):
             "message": fields.String(
                 required=True, description="message describing success or failure"
             ),
-            "result": fields.List(
-                fields.String, required=True, description="list of hysds-io types"
+            "result": fields.Raw(
+                required=True,
+                description="list of containers, or of their fields if requested",
             ),
+            "next": fields.String(description="cursor for the next page"),
+            "total": fields.Integer(description="number of matching containers"),
         },
     )
 
+    @container_ns.expect(list_parser)
+    @conditional_get
     @container_ns.marshal_with(resp_model_job_types)
     def get(self):
         """Get a list of containers managed by Mozart"""
-        containers = mozart_es.query(index=CONTAINERS_INDEX, _source=False)
-        ids = [container["_id"] for container in containers]
-
-        return {"success": True, "message": "", "result": ids}
+        return list_specs(container_registry)
 
 
 @container_ns.route("", endpoint="container")
@@ -208,6 +291,7 @@ class Containers(Resource):
     post_parser.add_argument("digest", required=True, type=str, help="Container Digest")
 
     @container_ns.expect(parser)
+    @conditional_get
     @container_ns.marshal_with(resp_model)
     def get(self):
         """Get information on container by ID"""
@@ -215,15 +299,19 @@ class Containers(Resource):
         if _id is None:
             return {"success": False, "message": "id must be supplied", "result": None}
 
-        container = mozart_es.get_by_id(index=CONTAINERS_INDEX, id=_id, ignore=404)
-        if container["found"] is False:
+        container = container_registry.get_entry(_id)
+        if container is None:
             return {
                 "success": False,
                 "message": "container not found: %s" % _id,
                 "result": None,
             }, 404
 
-        return {"success": True, "message": "", "result": container["_source"]}
+        return (
+            {"success": True, "message": "", "result": container["_source"]},
+            200,
+            etag_header(container["etag"]),
+        )
 
     @container_ns.expect(post_parser)
     @container_ns.marshal_with(resp_model)
@@ -234,14 +322,17 @@ class Containers(Resource):
         version = request.form.get("version", request.args.get("version", None))
         digest = request.form.get("digest", request.args.get("digest", None))
 
-        if not all((name, url, version, digest)):
+        container_obj = {"id": name, "digest": digest, "url": url, "version": version}
+        try:
+            validate_spec("container", container_obj)
+        except ValueError:
             return {
                 "success": False,
                 "message": "Parameters (name, url, version, digest) must be supplied",
             }, 400
 
-        container_obj = {"id": name, "digest": digest, "url": url, "version": version}
         mozart_es.index_document(index=CONTAINERS_INDEX, body=container_obj, id=name)
+        container_registry.invalidate(name)
 
         return {
             "success": True,
@@ -262,6 +353,7 @@ class Containers(Resource):
             }, 400
 
         mozart_es.delete_by_id(index=CONTAINERS_INDEX, id=_id)
+        container_registry.invalidate(_id)
         app.logger.info(
             "Deleted container {} from index: {}".format(_id, CONTAINERS_INDEX)
         )
@@ -285,18 +377,21 @@ class HySDSIOTypes(Resource):
             "message": fields.String(
                 required=True, description="message describing success or failure"
             ),
-            "result": fields.List(
-                fields.String, required=True, description="list of hysds-io types"
+            "result": fields.Raw(
+                required=True,
+                description="list of hysds-io types, or of their fields if requested",
             ),
+            "next": fields.String(description="cursor for the next page"),
+            "total": fields.Integer(description="number of matching hysds-io types"),
         },
     )
 
+    @hysds_io_ns.expect(list_parser)
+    @conditional_get
     @hysds_io_ns.marshal_with(resp_model_job_types)
     def get(self):
         """List HySDS IO specifications"""
-        hysds_ios = mozart_es.query(index=HYSDS_IOS_INDEX, _source=False)
-        ids = [hysds_io["_id"] for hysds_io in hysds_ios]
-        return {"success": True, "message": "", "result": ids}
+        return list_specs(hysds_io_registry)
 
 
 @hysds_io_ns.route("", endpoint="hysds_io")
@@ -327,6 +422,7 @@ class HySDSio(Resource):
     )
 
     @hysds_io_ns.expect(parser)
+    @conditional_get
     @hysds_io_ns.marshal_with(resp_model)
     def get(self):
         """Gets a HySDS-IO specification by ID"""
@@ -334,11 +430,15 @@ class HySDSio(Resource):
         if _id is None:
             return {"success": False, "message": "missing parameter: id"}, 400
 
-        hysds_io = mozart_es.get_by_id(index=HYSDS_IOS_INDEX, id=_id, ignore=404)
-        if hysds_io["found"] is False:
+        hysds_io = hysds_io_registry.get_entry(_id)
+        if hysds_io is None:
             return {"success": False, "message": ""}, 404
 
-        return {"success": True, "message": "", "result": hysds_io["_source"]}
+        return (
+            {"success": True, "message": "", "result": hysds_io["_source"]},
+            200,
+            etag_header(hysds_io["etag"]),
+        )
 
     @hysds_io_ns.expect(post_parser)
     @hysds_io_ns.marshal_with(resp_model)
@@ -351,11 +451,13 @@ class HySDSio(Resource):
 
         try:
             obj = json.loads(spec)
+            validate_spec("hysds_io", obj)
             _id = obj["id"]
         except (ValueError, KeyError, json.decoder.JSONDecodeError, Exception) as e:
             return {"success": False, "message": e}, 400
 
         mozart_es.index_document(index=HYSDS_IOS_INDEX, body=obj, id=_id)
+        hysds_io_registry.invalidate(_id)
         return {
             "success": True,
             "message": "{} added to index {}".format(_id, HYSDS_IOS_INDEX),
@@ -371,6 +473,107 @@ class HySDSio(Resource):
             return {"success": False, "message": "id parameter not included"}, 400
 
         mozart_es.delete_by_id(index=HYSDS_IOS_INDEX, id=_id)
+        hysds_io_registry.invalidate(_id)
         app.logger.info("deleted {} from index: {}".format(_id, HYSDS_IOS_INDEX))
 
         return {"success": True, "message": "deleted hysds_io: %s" % _id}
+
+
+@specs_ns.route("/import", endpoint="specs-import")
+@specs_ns.doc(
+    responses={200: "Success", 400: "Invalid bundle", 500: "Bulk import failed"},
+    description="Import a bundle of job specs, hysds_ios and containers.",
+)
+class ImportSpecs(Resource):
+    """Bulk import of specs from an NDJSON or tarball bundle"""
+
+    resp_model = specs_ns.model(
+        "Spec Import Response(JSON)",
+        {
+            "success": fields.Boolean(
+                required=True, description="Boolean, whether the API was successful"
+            ),
+            "message": fields.String(
+                required=True, description="message describing success or failure"
+            ),
+            "created": fields.Integer(description="number of specs created"),
+            "updated": fields.Integer(description="number of specs updated"),
+            "unchanged": fields.Integer(description="number of specs left as is"),
+            "errors": fields.List(fields.String, description="rejected specs"),
+        },
+    )
+
+    parser = specs_ns.parser()
+    parser.add_argument(
+        "bundle",
+        type=FileStorage,
+        location="files",
+        required=False,
+        help="NDJSON ({'type': 'job_spec|hysds_io|container', 'spec': {...}} per line) "
+        "or tarball of spec files; may also be sent as the request body",
+    )
+
+    @specs_ns.expect(parser)
+    @specs_ns.marshal_with(resp_model)
+    def post(self):
+        """Write all specs of a bundle with one bulk request, skipping unchanged ones"""
+        bundle = request.files.get("bundle", None)
+        data = bundle.read() if bundle is not None else request.get_data()
+        if not data:
+            return {"success": False, "message": "empty bundle"}, 400
+
+        records, errors = parse_bundle(data)
+        for spec_type, spec in records:
+            try:
+                validate_spec(spec_type, spec)
+            except ValueError as e:
+                errors.append(str(e))
+        if errors:
+            return {
+                "success": False,
+                "message": "invalid bundle, nothing imported",
+                "errors": errors,
+            }, 400
+
+        try:
+            result = import_specs(records)
+        except Exception as e:
+            app.logger.error("spec import failed: %s" % str(e))
+            return {"success": False, "message": str(e)}, 500
+
+        return {"success": not result["errors"], "message": "", **result}
+
+
+@specs_ns.route("/export", endpoint="specs-export")
+@specs_ns.doc(
+    responses={200: "Success", 400: "Unknown spec type"},
+    description="Stream all job specs, hysds_ios and containers as an NDJSON bundle.",
+)
+class ExportSpecs(Resource):
+    """Stream specs as an NDJSON bundle accepted by /specs/import"""
+
+    parser = specs_ns.parser()
+    parser.add_argument(
+        "types",
+        required=False,
+        type=str,
+        help="comma separated spec types (job_spec,hysds_io,container), default all",
+    )
+
+    @specs_ns.expect(parser)
+    def get(self):
+        """Export specs"""
+        types = request.args.get("types", None)
+        spec_types = None
+        if types:
+            spec_types = [t.strip() for t in types.split(",") if t.strip()]
+        unknown = [t for t in spec_types or [] if t not in SPEC_TYPES]
+        if unknown:
+            return {
+                "success": False,
+                "message": "unknown spec types: %s" % ", ".join(unknown),
+            }, 400
+
+        resp = Response(export_specs(spec_types), mimetype="application/x-ndjson")
+        resp.headers["Content-Disposition"] = "attachment; filename=specs.ndjson"
+        return resp
@@ -8,14 +8,33 @@ from datetime import datetime, timezone
 from flask import request
 from flask_restx import Namespace, Resource, inputs
 
+from elasticsearch.exceptions import ConflictError
 from hysds_commons.action_utils import check_passthrough_query
 
 from mozart import app, mozart_es
+from mozart.lib.registry import hysds_io_registry
+from mozart.lib.rule_utils import (
+    ensure_percolator_index,
+    sync_rule_percolator,
+    delete_rule_percolator,
+    match_rules,
+    dry_run_rule,
+    bulk_update_rules,
+    rule_id,
+    find_rule,
+    delete_rule,
+    LEGACY_RULE_IDS,
+    invalidate_rule_tags,
+)
+from mozart.lib.rule_stats import rule_stats, top_rules
 
 
 user_rule_ns = Namespace("user-rules", description="C.R.U.D. for Mozart user rules")
 
 HYSDS_IOS_INDEX = app.config["HYSDS_IOS_INDEX"]
+USER_RULES_MATCH_MAX_DOCS = app.config.get("USER_RULES_MATCH_MAX_DOCS", 1000)
+USER_RULES_BULK_MAX = app.config.get("USER_RULES_BULK_MAX", 5000)
+USER_RULES_STATS_ORDER_BY = ("matched", "submitted", "failed", "failure_rate")
 
 
 @user_rule_ns.route("", endpoint="user-rules")
@@ -136,24 +155,13 @@ class UserRules(Resource):
         _rule_name = request.args.get("rule_name", None)
         user_rules_index = app.config["USER_RULES_INDEX"]
 
-        if _id:
-            rule = mozart_es.get_by_id(index=user_rules_index, id=_id, ignore=404)
-            if rule.get("found", False) is False:
-                return {"success": False, "message": rule["message"]}, 404
-            else:
-                rule = {**rule, **rule["_source"]}
-                rule.pop("_source", None)
-                return {"success": True, "rule": rule}
-        elif _rule_name:
-            result = mozart_es.search(
-                index=user_rules_index, q=f"rule_name:{_rule_name}", ignore=404
-            )
-            if result.get("hits", {}).get("total", {}).get("value", 0) == 0:
+        if _id or _rule_name:
+            rule = find_rule(_id, _rule_name)
+            if rule is None:
                 return {
                     "success": False,
-                    "message": f"rule {_rule_name} not found",
+                    "message": f"rule {_id or _rule_name} not found",
                 }, 404
-            rule = result.get("hits").get("hits")[0]
             rule = {**rule, **rule["_source"]}
             rule.pop("_source", None)
             return {"success": True, "rule": rule}
@@ -243,23 +251,20 @@ class UserRules(Resource):
             app.logger.error(e)
             return {"success": False, "message": "invalid JSON: kwargs"}, 400
 
-        # check if rule name already exists
-        rule_exists_query = {"query": {"term": {"rule_name": rule_name}}}
-        existing_rules_count = mozart_es.get_count(
-            index=user_rules_index, body=rule_exists_query
-        )
-        if existing_rules_count > 0:
+        # rule names are unique: the document id is derived from the name and
+        # created with op_type=create (rules with legacy ids are checked by name)
+        if LEGACY_RULE_IDS and find_rule(rule_name=rule_name) is not None:
             return {
                 "success": False,
                 "message": "user rule already exists: %s" % rule_name,
             }, 409
 
         # check if job_type (hysds_io) exists in elasticsearch
-        job_type = mozart_es.get_by_id(index=HYSDS_IOS_INDEX, id=hysds_io, ignore=404)
-        if job_type["found"] is False:
+        job_type = hysds_io_registry.get(hysds_io)
+        if job_type is None:
             return {"success": False, "message": "%s not found" % hysds_io}, 400
 
-        params = job_type["_source"]["params"]
+        params = job_type["params"]
         is_passthrough_query = check_passthrough_query(params)
 
         if type(tags) == str:
@@ -307,9 +312,22 @@ class UserRules(Resource):
         if enable_dedup is not None:
             new_doc["enable_dedup"] = enable_dedup
 
-        result = mozart_es.index_document(
-            index=user_rules_index, body=new_doc, refresh=True
-        )
+        try:
+            result = mozart_es.index_document(
+                index=user_rules_index,
+                body=new_doc,
+                id=rule_id(rule_name),
+                op_type="create",
+                refresh=True,
+            )
+        except ConflictError:
+            return {
+                "success": False,
+                "message": "user rule already exists: %s" % rule_name,
+            }, 409
+        sync_rule_percolator(result["_id"], new_doc)
+        if tags:
+            invalidate_rule_tags()
         return {"success": True, "message": "rule created", "result": result}
 
     @user_rule_ns.expect(put_parser)
@@ -348,38 +366,22 @@ class UserRules(Resource):
 
         # check if job_type (hysds_io) exists in elasticsearch (only if we're updating job_type)
         if hysds_io:
-            job_type = mozart_es.get_by_id(
-                index=HYSDS_IOS_INDEX, id=hysds_io, ignore=404
-            )
-            if job_type.get("found", False) is False:
+            job_type = hysds_io_registry.get(hysds_io)
+            if job_type is None:
                 return {
                     "success": False,
                     "message": "job_type not found: %s" % hysds_io,
                 }, 404
 
-        if _id:
-            app.logger.info("finding existing user rule: %s" % _id)
-            existing_rule = mozart_es.get_by_id(
-                index=user_rules_index, id=_id, ignore=404
-            )
-            if existing_rule.get("found", False) is False:
-                app.logger.info("rule not found %s" % _id)
-                return {
-                    "result": False,
-                    "message": "user rule not found: %s" % _id,
-                }, 404
-        elif _rule_name:
-            app.logger.info("finding existing user rule: %s" % _rule_name)
-            result = mozart_es.search(
-                index=user_rules_index, q=f"rule_name:{_rule_name}", ignore=404
-            )
-            if result.get("hits", {}).get("total", {}).get("value", 0) == 0:
-                return {
-                    "success": False,
-                    "message": "rule %s not found" % _rule_name,
-                }, 404
-            else:
-                _id = result.get("hits").get("hits")[0].get("_id")
+        app.logger.info("finding existing user rule: %s" % (_id or _rule_name))
+        existing_rule = find_rule(_id, _rule_name)
+        if existing_rule is None:
+            app.logger.info("rule not found %s" % (_id or _rule_name))
+            return {
+                "success": False,
+                "message": "user rule not found: %s" % (_id or _rule_name),
+            }, 404
+        _id = existing_rule["_id"]
 
         update_doc = {}
         if rule_name:
@@ -463,6 +465,40 @@ class UserRules(Resource):
         if "enable_dedup" in request_data:
             update_doc["enable_dedup"] = enable_dedup
 
+        new_id = rule_id(update_doc["rule_name"]) if rule_name else _id
+        if new_id != _id:
+            # the document id follows the rule name, a renamed rule moves to a new id
+            app.logger.info("moving user rule %s to %s" % (_id, new_id))
+            renamed_rule = {**existing_rule["_source"], **update_doc}
+            if LEGACY_RULE_IDS:  # names of rules with legacy ids are not ids
+                same_name = find_rule(rule_name=update_doc["rule_name"])
+                if same_name is not None and same_name["_id"] != _id:
+                    return {
+                        "success": False,
+                        "message": "user rule already exists: %s" % rule_name,
+                    }, 409
+            try:
+                mozart_es.index_document(
+                    index=user_rules_index,
+                    body=renamed_rule,
+                    id=new_id,
+                    op_type="create",
+                    refresh=True,
+                )
+            except ConflictError:
+                return {
+                    "success": False,
+                    "message": "user rule already exists: %s" % rule_name,
+                }, 409
+            mozart_es.delete_by_id(
+                index=user_rules_index, id=_id, refresh=True, ignore=404
+            )
+            delete_rule_percolator(_id)
+            sync_rule_percolator(new_id, renamed_rule)
+            if "tags" in update_doc:
+                invalidate_rule_tags()
+            return {"success": True, "id": new_id, "updated": update_doc}
+
         app.logger.info("editing document id %s in user_rule index" % _id)
 
         doc = {"doc_as_upsert": True, "doc": update_doc}
@@ -472,6 +508,9 @@ class UserRules(Resource):
         )
         app.logger.info(result)
         app.logger.info("document updated: %s" % _id)
+        sync_rule_percolator(_id)
+        if "tags" in update_doc:
+            invalidate_rule_tags()
         return {"success": True, "id": _id, "updated": update_doc}
 
     @user_rule_ns.expect(parser)
@@ -489,14 +528,252 @@ class UserRules(Resource):
 
         if _id:
             mozart_es.delete_by_id(index=user_rules_index, id=_id, ignore=404)
+            delete_rule_percolator(_id)
+            invalidate_rule_tags()
             app.logger.info("user rule %s deleted" % _id)
             return {"success": True, "message": "user rule deleted", "id": _id}
         elif _rule_name:
-            query = {"query": {"match": {"rule_name": _rule_name}}}
-            mozart_es.es.delete_by_query(index=user_rules_index, body=query, ignore=404)
+            delete_rule(rule_name=_rule_name)
+            delete_rule_percolator(rule_name=_rule_name)
+            invalidate_rule_tags()
             app.logger.info("user rule %s deleted" % _rule_name)
             return {
                 "success": True,
                 "message": "user rule deleted",
                 "rule_name": _rule_name,
             }
+
+
+@user_rule_ns.route("/match", endpoint="user-rules-match")
+@user_rule_ns.doc(
+    responses={
+        200: "Success",
+        400: "Invalid documents",
+        501: "Percolator not enabled",
+    },
+    description="Find the enabled user rules matching documents",
+)
+class UserRulesMatch(Resource):
+    """Match documents against all user rules with one percolate query"""
+
+    @user_rule_ns.doc(
+        body={"documents": "a document (JSON object) or a list of documents"}
+    )
+    def post(self):
+        """
+        Return the enabled rules matching each document; the body is a document, a
+        list of documents or {"documents": [...]}
+        """
+        if not ensure_percolator_index():
+            return {
+                "success": False,
+                "message": "user rule percolator is not enabled "
+                "(USER_RULES_PERCOLATOR_ENABLED)",
+            }, 501
+
+        documents = request.get_json(silent=True)
+        if isinstance(documents, dict) and isinstance(
+            documents.get("documents"), list
+        ):
+            documents = documents["documents"]
+        elif isinstance(documents, dict):
+            documents = [documents]
+        if not isinstance(documents, list) or not documents:
+            return {"success": False, "message": "no documents to match"}, 400
+        if not all(isinstance(doc, dict) for doc in documents):
+            return {"success": False, "message": "documents must be JSON objects"}, 400
+        if len(documents) > USER_RULES_MATCH_MAX_DOCS:
+            return {
+                "success": False,
+                "message": "too many documents (max %d)" % USER_RULES_MATCH_MAX_DOCS,
+            }, 400
+
+        matches = match_rules(documents)
+        return {
+            "success": True,
+            "message": "",
+            "matches": [
+                {"slot": slot, "rules": rules} for slot, rules in enumerate(matches)
+            ],
+        }
+
+
+@user_rule_ns.route("/dry-run", endpoint="user-rules-dry-run")
+@user_rule_ns.doc(
+    responses={
+        200: "Success",
+        400: "Invalid query",
+        404: "Rule not found",
+        504: "Query timed out or failed",
+    },
+    description="Validate a rule query and estimate how many jobs it would submit",
+)
+class UserRulesDryRun(Resource):
+    """Dry-run of a user rule's query"""
+
+    parser = user_rule_ns.parser()
+    parser.add_argument("query_string", type=str, help="elasticsearch query to test")
+    parser.add_argument("id", type=str, help="test the query of an existing rule")
+    parser.add_argument(
+        "rule_name", type=str, help="rule name (fallback if id is not provided)"
+    )
+    parser.add_argument(
+        "query_all", type=inputs.boolean, help="one job for all matches"
+    )
+
+    @user_rule_ns.expect(parser)
+    def post(self):
+        """
+        Validate the query, count its matches and return a few sampled matches; the
+        query is given directly (query_string) or taken from a rule (id, rule_name)
+        """
+        request_data = request.get_json(silent=True) or request.form
+        query_string = request_data.get("query_string")
+        _id = request_data.get("id")
+        _rule_name = request_data.get("rule_name")
+        query_all = request_data.get("query_all")
+
+        if not query_string:
+            if not _id and not _rule_name:
+                return {
+                    "success": False,
+                    "message": "Must specify query_string, id or rule_name",
+                }, 400
+            rule = find_rule(_id, _rule_name)
+            if rule is None:
+                return {
+                    "success": False,
+                    "message": "rule %s not found" % (_id or _rule_name),
+                }, 404
+            query_string = rule["_source"]["query_string"]
+            if query_all is None:
+                query_all = rule["_source"].get("query_all", False)
+
+        try:
+            query_all = inputs.boolean(query_all) if query_all is not None else False
+            result = dry_run_rule(query_string, query_all)
+        except (ValueError, TypeError) as e:
+            return {"success": False, "message": "invalid query: %s" % str(e)}, 400
+
+        if not result["valid"]:
+            return {"success": False, "message": result["error"], **result}, 400
+        if result["count"] is None:
+            return {"success": False, "message": result["error"], **result}, 504
+        return {"success": True, "message": "", **result}
+
+
+@user_rule_ns.route("/bulk", endpoint="user-rules-bulk")
+@user_rule_ns.doc(
+    responses={200: "Success", 400: "Invalid selection or updates"},
+    description="Change enabled, queue, priority or time limits of many rules at once",
+)
+class UserRulesBulk(Resource):
+    """Bulk edit of user rules"""
+
+    @user_rule_ns.doc(
+        body={
+            "ids": "list of rule ids",
+            "tag": "rules with this tag",
+            "rule_name": "rule name pattern (* and ? wildcards)",
+            "updates": "fields to set: enabled, queue, priority, time_limit, "
+            "soft_time_limit",
+        }
+    )
+    def post(self):
+        """
+        Apply the same changes to all rules selected by ids, tag and/or rule_name
+        pattern with one bulk request; returns the outcome for every rule
+        """
+        request_data = request.get_json(silent=True)
+        if not isinstance(request_data, dict):
+            return {"success": False, "message": "expected a JSON object"}, 400
+
+        ids = request_data.get("ids")
+        if ids is not None and (
+            not isinstance(ids, list) or not all(isinstance(i, str) for i in ids)
+        ):
+            return {"success": False, "message": "ids must be a list of rule ids"}, 400
+        updates = request_data.get("updates")
+        if not isinstance(updates, dict):
+            return {"success": False, "message": "updates must be a JSON object"}, 400
+
+        try:
+            result = bulk_update_rules(
+                updates,
+                ids=ids,
+                tag=request_data.get("tag"),
+                rule_name=request_data.get("rule_name"),
+                max_rules=USER_RULES_BULK_MAX,
+            )
+        except ValueError as e:
+            return {"success": False, "message": str(e)}, 400
+
+        return {"success": result["failed"] == 0, "message": "", **result}
+
+
+@user_rule_ns.route("/stats", endpoint="user-rules-stats")
+@user_rule_ns.doc(
+    responses={200: "Success", 400: "Invalid parameters"},
+    description="Top user rules by jobs matched, submitted or failed",
+)
+class UserRulesStats(Resource):
+    """Top-N view of the user rule statistics"""
+
+    parser = user_rule_ns.parser()
+    parser.add_argument(
+        "by", type=str, help="matched (default), submitted, failed or failure_rate"
+    )
+    parser.add_argument("size", type=int, help="number of rules (default 10)")
+    parser.add_argument(
+        "order", type=str, help="desc (default) or asc, e.g. dead rules"
+    )
+
+    @user_rule_ns.expect(parser)
+    def get(self):
+        """
+        Rules with the most (or fewest) jobs over the stats window; rules without
+        jobs are included with zero counts
+        """
+        by = request.args.get("by", "matched")
+        order = request.args.get("order", "desc")
+        try:
+            size = int(request.args.get("size", 10))
+        except ValueError:
+            return {"success": False, "message": "size must be an integer"}, 400
+
+        if by not in USER_RULES_STATS_ORDER_BY:
+            return {
+                "success": False,
+                "message": "by must be one of: %s"
+                % ", ".join(USER_RULES_STATS_ORDER_BY),
+            }, 400
+        if order not in ("asc", "desc"):
+            return {"success": False, "message": "order must be asc or desc"}, 400
+        if size < 1:
+            return {"success": False, "message": "size must be positive"}, 400
+
+        result = top_rules(by=by, size=size, ascending=order == "asc")
+        return {"success": True, "message": "", **result}
+
+
+@user_rule_ns.route("/<_id>/stats", endpoint="user-rule-stats")
+@user_rule_ns.doc(
+    responses={200: "Success", 404: "Rule not found"},
+    description="Jobs matched, submitted and their outcomes for a user rule",
+)
+class UserRuleStats(Resource):
+    """Statistics of one user rule"""
+
+    def get(self, _id):
+        """
+        Totals and per-bucket counts of the jobs the rule submitted (by job tag) over
+        the stats window
+        """
+        rule = find_rule(_id)
+        if rule is None:
+            rule = find_rule(rule_name=_id)
+        if rule is None:
+            return {"success": False, "message": "rule %s not found" % _id}, 404
+
+        result = rule_stats(rule["_id"], rule["_source"]["rule_name"])
+        return {"success": True, "message": "", **result}
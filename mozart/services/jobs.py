@@ -3,14 +3,34 @@ from future import standard_library
 standard_library.install_aliases()
 
 import re
-import requests
+import json
+import html
+import posixpath
 import traceback
-import cgi
+from itertools import chain
+from datetime import timezone
+from urllib.parse import urlparse, unquote
 from flask import jsonify, Blueprint, request, Response
 from flask_login import login_required
 
-from hysds.celery import app as celapp
-from mozart import app, mozart_es
+from mozart import app
+from mozart.lib.count_utils import get_job_counts
+from mozart.lib.file_cache import job_file_cache
+from mozart.lib.job_utils import find_job_info, TERMINAL_STATES
+from mozart.lib.dav_utils import (
+    dav_session,
+    find_tail_offset,
+    iter_bytes,
+    follow_bytes,
+    escape_chunks,
+)
+from mozart.lib.purge_utils import (
+    PurgeEngine,
+    start_purge_operation,
+    get_purge_operation,
+    resume_purge_operation,
+)
+from mozart.lib.time_utils import getDatetimeFromString
 
 
 mod = Blueprint("services/jobs", __name__)
@@ -23,34 +43,173 @@ JOB_NAME_RE = re.compile(r"^(.+)-\d{8}T\d{6}.*$")
 def job_count():
     """Return total number of jobs and counts by status."""
 
-    body = {"size": 0, "aggs": {"result": {"terms": {"field": "status"}}}}
-    results = mozart_es.search(index="job_status-*", body=body)
-    app.logger.info(results)
+    results = get_job_counts(("status",))
 
-    buckets = results["aggregations"]["result"]["buckets"]
-
-    total = 0
-    counts = {}
-    for bucket in buckets:
-        counts[bucket["key"]] = bucket["doc_count"]
-        total += bucket["doc_count"]
-    counts["total"] = total
+    counts = dict(results["counts"]["status"])
+    counts["total"] = results["total"]
 
     return jsonify({"success": True, "counts": counts})
 
 
+def parse_epoch_millis(value):
+    """Parse epoch millis or a date time string (UTC) to epoch millis."""
+
+    if value is None or value == "":
+        return None
+    if value.isdigit():
+        return int(value)
+    dt = getDatetimeFromString(value).replace(tzinfo=timezone.utc)
+    return int(dt.timestamp() * 1000)
+
+
+@mod.route("/job_counts")
+def job_counts():
+    """
+    Return job counts broken down by status, queue, type and/or user, e.g.
+    /job_counts?dims=status,queue&start_time=2024-01-01T00:00:00
+    """
+
+    dims = request.args.get("dims", "status").split(",")
+    try:
+        start_time = parse_epoch_millis(request.args.get("start_time", None))
+        end_time = parse_epoch_millis(request.args.get("end_time", None))
+        results = get_job_counts(
+            [d.strip() for d in dims if d.strip()], start_time, end_time
+        )
+    except (ValueError, RuntimeError) as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    return jsonify({"success": True, "message": "", **results})
+
+
+def is_job_file(job_url, url_file):
+    """Return True if url_file is a file within the work dir at job_url."""
+
+    job, file = urlparse(job_url), urlparse(url_file)
+    if (file.scheme, file.netloc) != (job.scheme, job.netloc):
+        return False
+    if file.params or file.query or file.fragment:
+        return False
+    work_dir = posixpath.normpath(unquote(job.path)).rstrip("/") + "/"
+    return posixpath.normpath(unquote(file.path)).startswith(work_dir)
+
+
+def is_cacheable(job_id, url_file):
+    """
+    Work dir files are only cached once their job reached a terminal state; the file
+    must be in that job's work dir, so the status checked is the one of its job.
+    """
+
+    if not job_id:
+        return False
+    try:
+        job = find_job_info(job_id)
+    except Exception as e:
+        app.logger.warning("failed to get info of job %s: %s" % (job_id, str(e)))
+        return False
+    if job is None or job.get("status") not in TERMINAL_STATES:
+        return False
+    job_url = job.get("job", {}).get("job_info", {}).get("job_url")
+    return bool(job_url) and is_job_file(job_url, url_file)
+
+
+def tail_offset(content, lines):
+    """Return the offset where the last N lines of content (bytes) start."""
+
+    end = len(content) - 1 if content.endswith(b"\n") else len(content)
+    for _ in range(lines):
+        end = content.rfind(b"\n", 0, end)
+        if end == -1:
+            return 0
+    return end + 1
+
+
+def stream_text(
+    url_file, offset=None, length=None, tail=None, follow=False, cached=None
+):
+    """
+    Stream (part of) a job file as escaped text using HTTP range requests, or from
+    the cached content (bytes) of a finished job's file.
+    """
+
+    try:
+        offset = int(offset) if offset else 0
+        length = int(length) if length else None
+        tail = int(tail) if tail else None
+        if offset < 0 or (length is not None and length < 1):
+            raise ValueError("offset must be >= 0 and length > 0")
+        if tail is not None and tail < 1:
+            raise ValueError("tail must be > 0")
+    except ValueError as e:
+        return jsonify({"success": False, "content": str(e)}), 400
+
+    if cached is not None:
+        if tail is not None:
+            offset = tail_offset(cached, tail)
+        end = None if length is None else offset + length
+        resp = Response(
+            html.escape(cached[offset:end].decode("utf-8", "replace"), quote=False),
+            mimetype="text/plain",
+        )
+        resp.headers["X-File-Offset"] = str(offset)
+        return resp
+
+    try:
+        if tail is not None:
+            offset = find_tail_offset(url_file, tail)
+        if follow:
+            chunks = follow_bytes(url_file, offset)
+        else:
+            chunks = iter_bytes(url_file, offset, length)
+        first = next(chunks, b"")  # surface errors before the response starts
+    except Exception as e:
+        return jsonify(
+            {
+                "success": False,
+                "content": "{}\n{}".format(str(e), traceback.format_exc()),
+            }
+        )
+
+    resp = Response(escape_chunks(chain([first], chunks)), mimetype="text/plain")
+    resp.headers["X-File-Offset"] = str(offset)
+    return resp
+
+
 @mod.route("/get_text")
 def get_text():
-    """Return text content for a job file."""
+    """
+    Return text content for a job file; offset/length, tail (last N lines) and
+    follow (keep streaming appended bytes) stream the content instead. If the job
+    id is given, the job is finished and the file is in its work dir, the file is
+    cached on local disk and served from there on later views, even after the worker
+    removed the work dir.
+    """
 
     # check file param
     url_file = request.args.get("file", None)
     if url_file is None:
         return jsonify({"success": False, "content": "No job file specified"})
 
+    offset = request.args.get("offset", None)
+    length = request.args.get("length", None)
+    tail = request.args.get("tail", None)
+    follow = request.args.get("follow", "false").lower() == "true"
+
+    job_id = request.args.get("id", None)
+    cacheable = is_cacheable(job_id, url_file)
+    cached = job_file_cache.get(job_id, url_file) if cacheable else None
+
+    if offset or length or tail or follow:
+        # nothing is appended to files of finished jobs, so follow ends there
+        return stream_text(url_file, offset, length, tail, follow, cached)
+
+    if cached is not None:
+        content = html.escape(cached.decode("utf-8", "replace"), quote=False)
+        return jsonify({"success": True, "content": content})
+
     # read contents
     try:
-        r = requests.get(url_file, verify=False)
+        r = dav_session.get(url_file, verify=False)
         r.raise_for_status()
     except Exception as e:
         return jsonify(
@@ -75,19 +234,21 @@ def get_text():
         content += "work directory may have been cleaned out by verdi to free up<br/>"
         content += "disk space to run new jobs."
     else:
-        content = cgi.escape(r.text)
+        content = html.escape(r.text, quote=False)
+        if cacheable:
+            job_file_cache.put(job_id, url_file, r.content)
 
     return jsonify({"success": success, "content": content})
 
 
-@mod.route("/task/stop/<index>", methods=["GET"])
+@mod.route("/task/stop/<index>", methods=["GET", "POST"])
 @login_required
 def stop_running(index=None):
     """Stops tasks"""
     return purge(index, False)
 
 
-@mod.route("/task/purge/<index>", methods=["GET"])
+@mod.route("/task/purge/<index>", methods=["GET", "POST"])
 @login_required
 def purge_complete(index=None):
     """Purges non-active tasks"""
@@ -95,10 +256,13 @@ def purge_complete(index=None):
 
 
 def purge(es_index, purge):
-    """Purge job."""
+    """
+    Purge job; GET streams the progress, POST runs the purge in the background and
+    returns an operation id to follow it with /task/operation/<id>
+    """
 
     # get callback, source, and job status index
-    source = request.args.get("source")
+    source = request.form.get("source", request.args.get("source"))
     if es_index is None:
         return (
             jsonify(
@@ -119,56 +283,51 @@ def purge(es_index, purge):
             ),
             500,
         )
-    docs = mozart_es.query(es_index, body=source)
+    try:
+        query = json.loads(source)
+    except ValueError:
+        return (
+            jsonify({"success": False, "message": "Malformed source: %s" % source}),
+            400,
+        )
+
+    if request.method == "POST":
+        op_id = start_purge_operation(es_index, query, purge)
+        return jsonify({"success": True, "message": "", "id": op_id}), 202
 
     # stream purge output
-    def stream_purge(results, index):
+    def stream_purge(engine):
         # purge job from index and delete work dir via DAV
         yield "Starting...\n"
-        for res in results:
-            uuid = res["uuid"]
-            payload_id = res["payload_id"]
-            task = celapp.AsyncResult(
-                uuid
-            )  # Always grab latest state (not state from query result)
-            state = task.state
-
-            # Active states may only revoke
-            yield "Job state: %s\n" % state
-            if state in ["RETRY", "STARTED"] or (state == "PENDING" and not purge):
-                if not purge:
-                    yield "Revoking %s\n" % (uuid)
-                    celapp.control.revoke(uuid, terminate=True)
-                else:
-                    yield "Cannot remove active job %s\n" % (uuid)
-                continue
-            elif not purge:
-                yield "Cannot stop inactive job: %s\n" % (uuid)
-                continue
-
-            # Safety net to revoke job if in PENDING state
-            if state == "PENDING":
-                yield "Revoking %s\n" % (uuid)
-                celapp.control.revoke(uuid, terminate=True)
-
-            # Inactive states remove from ES, WebDav etc.
-            if index.startswith("job_status"):
-                url = res.get("job", {}).get("job_info", {}).get("job_url", None)
-                yield "Purging {} ({})...".format(uuid, url)
-
-                # Delete from WebDAV
-                if url is not None:
-                    yield "Removing WebDAV directory..."
-                    try:
-                        r = requests.delete(url, timeout=5)
-                        yield "done.\n"
-                    except Exception as e:
-                        yield "failed (%s).\n" % str(e)
-
-            # Both associated task and job from ES
-            yield "Removing ES for %s" % payload_id
-            mozart_es.delete_by_id(index, id=payload_id)
-            yield "done: %s\n" % payload_id
+        yield from engine.run()
         yield "Finished\n"
 
-    return Response(stream_purge(docs, es_index), mimetype="text/plain")
+    engine = PurgeEngine(es_index, query, purge)
+    return Response(stream_purge(engine), mimetype="text/plain")
+
+
+@mod.route("/task/operation/<op_id>", methods=["GET"])
+@login_required
+def purge_operation(op_id):
+    """Return progress of a background purge/stop operation"""
+
+    operation = get_purge_operation(op_id)
+    if operation is None:
+        message = "unknown operation: %s" % op_id
+        return jsonify({"success": False, "message": message}), 404
+    return jsonify({"success": True, "message": "", "operation": operation})
+
+
+@mod.route("/task/operation/<op_id>/resume", methods=["POST"])
+@login_required
+def resume_operation(op_id):
+    """Resume an interrupted purge/stop operation from its last checkpoint"""
+
+    try:
+        operation = resume_purge_operation(op_id)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 409
+    if operation is None:
+        message = "unknown operation: %s" % op_id
+        return jsonify({"success": False, "message": message}), 404
+    return jsonify({"success": True, "message": "", "operation": operation})
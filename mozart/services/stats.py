@@ -9,8 +9,10 @@ from flask import jsonify, Blueprint, request
 
 
 from mozart import app
-from mozart.lib.fab_utils import mpstat, mem_free, sys_date, top
+from mozart.lib.cache_utils import CACHES
+from mozart.lib.fleet_stats import fleet_stats_collector
 from mozart.lib.job_utils import get_execute_nodes
+from mozart.lib.ssh_utils import mpstat, mem_free, get_node_stats, get_node_user
 
 
 mod = Blueprint("services/stats", __name__)
@@ -85,14 +87,56 @@ def parse_mem_stats(output):
 
 @mod.route("/execute_nodes", methods=["GET"])
 def execute_nodes():
-    """Return the names of all execute nodes."""
+    """
+    Return the names of all execute nodes; ?since=now-7d (ES date math) only returns
+    the nodes that ran jobs in that window.
+    """
 
-    nodes = get_execute_nodes()
+    since = request.args.get("since", None)
+    nodes = get_execute_nodes(since) if since else get_execute_nodes()
     return jsonify(
         {"success": True, "message": "", "nodes": nodes, "total": len(nodes)}
     )
 
 
+@mod.route("/cache_stats", methods=["GET"])
+def cache_stats():
+    """Return size and hit/miss counters of the caches in this worker."""
+
+    stats = {name: cache.stats() for name, cache in CACHES.items()}
+    return jsonify({"success": True, "message": "", "caches": stats})
+
+
+@mod.route("/stats/fleet", methods=["GET"])
+def fleet_stats():
+    """
+    Return the latest CPU/memory sample of every execute node with the fleet wide
+    p50/p95/max, or the buffered samples of one node (?node=<node>), as collected in
+    the background.
+    """
+
+    fleet_stats_collector.start()
+
+    node = request.args.get("node", None)
+    if node is not None:
+        history = fleet_stats_collector.history(node)
+        if history is None:
+            return (
+                jsonify({"success": False, "message": "No samples for %s" % node}),
+                404,
+            )
+        return jsonify({"success": True, "message": "", **history})
+
+    try:
+        max_age = request.args.get("max_age", None)
+        max_age = float(max_age) if max_age else None
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    snapshot = fleet_stats_collector.snapshot(max_age)
+    return jsonify({"success": True, "message": "", **snapshot})
+
+
 @mod.route("/mpstat", methods=["GET"])
 def get_mpstat():
     """Return the CPU stats for a node."""
@@ -100,10 +144,7 @@ def get_mpstat():
     node = request.args.get("node", None)
     if node is None:
         return jsonify({"success": False, "message": "No execute node specfied."}), 500
-    if node == app.config["PUCCINI_HOST"]:
-        user = app.config["PUCCINI_USER"]
-    else:
-        user = app.config["EXECUTE_NODE_USER"]
+    user = get_node_user(node)
     try:
         output = mpstat(user, node)
     except (Exception, SystemExit) as e:
@@ -125,10 +166,7 @@ def get_mem_free():
     node = request.args.get("node", None)
     if node is None:
         return jsonify({"success": False, "message": "No execute node specfied."}), 500
-    if node == app.config["PUCCINI_HOST"]:
-        user = app.config["PUCCINI_USER"]
-    else:
-        user = app.config["EXECUTE_NODE_USER"]
+    user = get_node_user(node)
     try:
         output = mem_free(user, node)
     except (Exception, SystemExit) as e:
@@ -150,17 +188,15 @@ def get_cpu_mem_stats():
     node = request.args.get("node", None)
     if node is None:
         return jsonify({"success": False, "message": "No execute node specfied."}), 500
-    if node == app.config["PUCCINI_HOST"]:
-        user = app.config["PUCCINI_USER"]
-    else:
-        user = app.config["EXECUTE_NODE_USER"]
+    user = get_node_user(node)
     try:
-        cpu_stats = mpstat(user, node)
+        node_stats = get_node_stats(user, node)
+        cpu_stats = node_stats["cpu"]
         values = parse_cpu_stats(cpu_stats)
-        mem_stats = mem_free(user, node)
+        mem_stats = node_stats["memory"]
         values.extend(parse_mem_stats(mem_stats))
-        date = sys_date(user, node)
-        top_procs = top(user, node)
+        date = node_stats["date"]
+        top_procs = node_stats["top"]
     except (Exception, SystemExit) as e:
         app.logger.info(
             "Failed to execute mpstat/mem_free('%s', '%s'):\n%s\n%s"
@@ -0,0 +1,15 @@
+#!/usr/bin/env python
+"""
+One-shot migration of user rules to document ids derived from their rule names;
+set USER_RULES_LEGACY_IDS = False in settings.cfg once it has run.
+"""
+from future import standard_library
+
+standard_library.install_aliases()
+
+from mozart import app
+from mozart.lib.rule_utils import migrate_rule_ids
+
+with app.app_context():
+    total, index = migrate_rule_ids()
+    print("migrated %d user rules to %s" % (total, index))
@@ -41,6 +41,7 @@ setup(
         'future>=0.17.1',
         'pytz',
         'numpy',
+        'paramiko>=2.7.0',
         "werkzeug>=2.2.0",
         "cryptography>=39.0.0",
     ],